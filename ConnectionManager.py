@@ -1,24 +1,33 @@
-import datetime
+import time
 import uuid
-from typing import Dict, List, Optional, Any
+from typing import Dict, Iterable, List, Optional, Any, Set
 
 from websockets import ServerConnection
 
+from clock import coarse_clock
 from models import ClientConnection
+from RoutingRegistry import RoutingRegistry, InMemoryRoutingRegistry
+from TimerWheel import TimerWheel
 import logging
 
 
 class ConnectionManager:
     """连接管理"""
 
-    def __init__(self):
-        # connection_id -> ClientConnection
+    def __init__(self, node_id: Optional[str] = None,
+                 routing_registry: Optional[RoutingRegistry] = None,
+                 heartbeat_timeout: float = 60):
+        # 当前节点ID及跨节点路由注册表
+        self.node_id = node_id or str(uuid.uuid4())
+        self.routing_registry = routing_registry or InMemoryRoutingRegistry()
+        # connection_id -> ClientConnection（唯一数据源，user_id 记录在连接上）
         self.connections: Dict[str, ClientConnection] = {}
-        # user_id -> [connection_id]
-        self.user_connections: Dict[int, List[str]] = {}
-        # connection_id -> user_id（快速查找）
-        self.connection_to_user: Dict[str, int] = {}
+        # user_id -> {connection_id}（索引）
+        self.user_connections: Dict[int, Set[str]] = {}
         self.logger = logging.getLogger("ConnectionManager")
+        # 心跳超时时间轮（connection_id -> 超时时刻），检查时只触及到期的连接
+        self.heartbeat_timeout = heartbeat_timeout
+        self.heartbeat_wheel = TimerWheel(tick=1.0)
 
     def add_connection(self, websocket: ServerConnection,
                        device_id: Optional[str] = None) -> str:
@@ -31,81 +40,141 @@ class ConnectionManager:
         )
 
         self.connections[connection_id] = connection
+        self.heartbeat_wheel.schedule(connection_id, connection.last_heartbeat + self.heartbeat_timeout)
         self.logger.info(f"新连接建立: {connection_id}")
 
         return connection_id
 
-    async def authenticate_connection(self, connection_id: str, user_id: int):
+    async def authenticate_connection(self, connection_id: str, user_id: int,
+                                      token_payload: Optional[Dict[str, Any]] = None):
         """认证连接"""
         if connection_id not in self.connections:
             return False
 
         connection = self.connections[connection_id]
+        # 同一连接切换用户时先移出旧用户的索引，旧用户在本节点没有其他连接时注销其路由
+        previous_user_id = connection.user_id
+        if previous_user_id is not None and previous_user_id != user_id:
+            self._unindex(previous_user_id, connection_id)
+            await self.release_user(previous_user_id)
+
         connection.user_id = user_id
         connection.authenticated = True
-        connection.last_activity = datetime.datetime.now()
+        connection.last_activity = coarse_clock.now
+        if token_payload:
+            self.bind_session(connection, token_payload)
 
-        # 添加到用户连接映射
-        if user_id not in self.user_connections:
-            self.user_connections[user_id] = []
-        self.user_connections[user_id].append(connection_id)
-        self.connection_to_user[connection_id] = user_id
+        # 添加到用户连接索引
+        self.user_connections.setdefault(user_id, set()).add(connection_id)
+        await self.routing_registry.register(user_id, self.node_id)
 
         self.logger.info(f"用户 {user_id} 认证成功，连接: {connection_id}")
         return True
 
+    @staticmethod
+    def bind_session(connection: ClientConnection, token_payload: Dict[str, Any]):
+        """把Token中的会话信息绑定到连接"""
+        connection.token_jti = token_payload.get("jti")
+        connection.token_expires_at = int(token_payload.get("exp", 0))
+        connection.scopes = tuple(token_payload.get("scopes", ()))
+
+    def _unindex(self, user_id: int, connection_id: str):
+        """从用户连接索引中移除"""
+        indexed = self.user_connections.get(user_id)
+        if indexed is None:
+            return
+        indexed.discard(connection_id)
+        # 如果用户没有其他连接，清理索引
+        if not indexed:
+            del self.user_connections[user_id]
+
     def remove_connection(self, connection_id: str):
         """移除连接"""
-        if connection_id not in self.connections:
+        connection = self.connections.pop(connection_id, None)
+        if connection is None:
             return
 
-        connection = self.connections[connection_id]
-        user_id = connection.user_id
-
-        # 从用户连接映射中移除
-        if user_id and user_id in self.user_connections:
-            if connection_id in self.user_connections[user_id]:
-                self.user_connections[user_id].remove(connection_id)
-
-            # 如果用户没有其他连接，清理用户连接映射
-            if not self.user_connections[user_id]:
-                del self.user_connections[user_id]
-
-        # 从快速映射中移除
-        if connection_id in self.connection_to_user:
-            del self.connection_to_user[connection_id]
-
-        # 从连接池中移除
-        del self.connections[connection_id]
+        if connection.user_id is not None:
+            self._unindex(connection.user_id, connection_id)
+        self.heartbeat_wheel.cancel(connection_id)
 
         self.logger.info(f"连接移除: {connection_id}")
 
     def get_user_connections(self, user_id: int) -> List[ClientConnection]:
         """获取用户的所有连接"""
-        connection_ids = self.user_connections.get(user_id, [])
-        connections = []
-        for conn_id in connection_ids:
-            if conn_id in self.connections:
-                connections.append(self.connections[conn_id])
-        return connections
+        connections = self.connections
+        return [connections[conn_id] for conn_id in self.user_connections.get(user_id, ())
+                if conn_id in connections]
 
     def is_user_online(self, user_id: int) -> bool:
-        """检查用户是否在线"""
-        return user_id in self.user_connections and len(self.user_connections[user_id]) > 0
+        """检查用户是否在本节点在线"""
+        return user_id in self.user_connections
+
+    async def is_user_online_anywhere(self, user_id: int) -> bool:
+        """检查用户是否在任意节点在线"""
+        if self.is_user_online(user_id):
+            return True
+        return bool(await self.routing_registry.get_nodes(user_id))
+
+    async def filter_online_anywhere(self, user_ids: Iterable[int]) -> Set[int]:
+        """批量获取在任意节点在线的用户，本节点不在线的用户一次性查询路由注册表"""
+        online = set()
+        remote = []
+        user_connections = self.user_connections
+        for user_id in user_ids:
+            if user_id in user_connections:
+                online.add(user_id)
+            else:
+                remote.append(user_id)
+        if remote:
+            online |= await self.routing_registry.get_online_users(remote)
+        return online
+
+    async def locate_users(self, user_ids: Iterable[int]) -> Dict[int, Set[str]]:
+        """批量获取在线用户所在的节点（一次查询路由注册表），不在线的用户不出现在结果中"""
+        user_ids = list(user_ids)
+        located = await self.routing_registry.get_nodes_batch(user_ids)
+        user_connections = self.user_connections
+        for user_id in user_ids:
+            if user_id in user_connections:
+                located.setdefault(user_id, set()).add(self.node_id)
+        return located
+
+    async def release_user(self, user_id: int):
+        """用户在本节点完全下线时注销路由"""
+        if not self.is_user_online(user_id):
+            await self.routing_registry.unregister(user_id, self.node_id)
 
     def get_connection_by_id(self, connection_id: str) -> Optional[ClientConnection]:
         """根据ID获取连接"""
         return self.connections.get(connection_id)
 
     def update_heartbeat(self, connection_id: str):
-        """更新心跳时间"""
-        if connection_id in self.connections:
-            self.connections[connection_id].last_heartbeat = datetime.datetime.now()
+        """更新心跳时间（时间轮在到期检查时按最新心跳重新排期）"""
+        connection = self.connections.get(connection_id)
+        if connection is not None:
+            connection.last_heartbeat = coarse_clock.now
+
+    def collect_heartbeat_timeouts(self) -> List[str]:
+        """推进心跳时间轮，返回心跳超时的连接ID"""
+        now = time.monotonic()
+        timeouts = []
+        for connection_id in self.heartbeat_wheel.advance(now):
+            connection = self.connections.get(connection_id)
+            if connection is None:
+                continue
+            deadline = connection.last_heartbeat + self.heartbeat_timeout
+            if deadline > now:
+                self.heartbeat_wheel.schedule(connection_id, deadline)
+            else:
+                timeouts.append(connection_id)
+        return timeouts
 
     def update_activity(self, connection_id: str):
         """更新活动时间"""
-        if connection_id in self.connections:
-            self.connections[connection_id].last_activity = datetime.datetime.now()
+        connection = self.connections.get(connection_id)
+        if connection is not None:
+            connection.last_activity = coarse_clock.now
 
     def get_connection_stats(self) -> Dict[str, Any]:
         """获取连接统计信息"""
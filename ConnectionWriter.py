@@ -0,0 +1,188 @@
+# ConnectionWriter.py
+import asyncio
+import logging
+from collections import deque
+from typing import Callable, Optional, Deque, List
+
+from websockets import ServerConnection
+from websockets.exceptions import ConnectionClosed
+
+from enums import EnqueueResult, OverflowPolicy
+from frames import Frame, encode, encode_batch
+
+logger = logging.getLogger("ConnectionWriter")
+
+
+class ConnectionWriter:
+    """连接的有界出站队列，由独立的写任务发送
+
+    推送方只做入队，不等待 websocket.send，单个慢客户端不会阻塞发送方或群聊扇出。
+    队列满时先丢弃低优先级消息（输入状态、在线状态），仍然放不下时按 policy 处理。
+    关闭时在 drain_timeout 内发送完已排队的消息，剩余的（包括被中断发送的一批）按 policy 转存离线。
+    """
+    __slots__ = ('websocket', 'max_size', 'policy', 'on_spill', 'on_disconnect',
+                 'batching', 'coalesce_delay', 'max_batch', 'drain_timeout',
+                 'queue', 'closed', 'dropped', 'spilled', 'frames_sent', '_wakeup', '_task', '_drain_waiters')
+
+    # 可以丢弃的低优先级消息
+    LOW_PRIORITY_ENDPOINTS = frozenset({"/message/typing", "/presence/change"})
+
+    def __init__(self, websocket: ServerConnection, max_size: int = 256,
+                 policy: OverflowPolicy = OverflowPolicy.SPILL_OFFLINE,
+                 on_spill: Optional[Callable[[Frame], None]] = None,
+                 on_disconnect: Optional[Callable[[], None]] = None,
+                 batching: bool = False, coalesce_delay: float = 0.002, max_batch: int = 64,
+                 drain_timeout: float = 1.0):
+        self.websocket = websocket
+        self.max_size = max_size
+        self.policy = policy
+        self.on_spill = on_spill
+        self.on_disconnect = on_disconnect
+        # 客户端声明支持 /batch 时，把 coalesce_delay 内排队的消息合并为一帧
+        self.batching = batching
+        self.coalesce_delay = coalesce_delay
+        self.max_batch = max_batch
+        self.drain_timeout = drain_timeout
+        # 队列元素为消息字典或共享的 EncodedFrame
+        self.queue: Deque[Frame] = deque()
+        self.closed = False
+        # 统计
+        self.dropped = 0
+        self.spilled = 0
+        self.frames_sent = 0
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        # join() 的等待者，队列清空时唤醒
+        self._drain_waiters: List[asyncio.Future] = []
+
+    def start(self):
+        """启动写任务"""
+        self._task = asyncio.create_task(self._run())
+
+    @classmethod
+    def is_low_priority(cls, message: Frame) -> bool:
+        return message.get("endpoint") in cls.LOW_PRIORITY_ENDPOINTS
+
+    def enqueue(self, message: Frame) -> EnqueueResult:
+        """消息入队，返回入队结果（只有 QUEUED 为真）"""
+        if self.closed:
+            return EnqueueResult.DROPPED
+
+        queue = self.queue
+        if len(queue) >= self.max_size:
+            if self.is_low_priority(message):
+                self.dropped += 1
+                return EnqueueResult.DROPPED
+            if not self._evict_low_priority():
+                return self._overflow(message)
+
+        queue.append(message)
+        self._wakeup.set()
+        return EnqueueResult.QUEUED
+
+    def _evict_low_priority(self) -> bool:
+        """丢弃队列中最早的一条低优先级消息"""
+        for index, queued in enumerate(self.queue):
+            if self.is_low_priority(queued):
+                del self.queue[index]
+                self.dropped += 1
+                return True
+        return False
+
+    def _overflow(self, message: Frame) -> EnqueueResult:
+        """队列已满且没有可丢弃的低优先级消息"""
+        if self.policy == OverflowPolicy.SPILL_OFFLINE and self.on_spill is not None:
+            self.spilled += 1
+            self.on_spill(message)
+            return EnqueueResult.SPILLED
+
+        if self.policy == OverflowPolicy.DISCONNECT:
+            logger.warning("出站队列已满，断开慢连接")
+            self.closed = True
+            if self.on_disconnect is not None:
+                self.on_disconnect()
+            return EnqueueResult.DROPPED
+
+        self.dropped += 1
+        return EnqueueResult.DROPPED
+
+    async def _run(self):
+        """写任务：依次发送队列中的消息，支持合并时按批发送"""
+        try:
+            await self._send_loop()
+        finally:
+            self._wake_drain_waiters()
+
+    async def _send_loop(self):
+        queue = self.queue
+        while True:
+            if not queue:
+                if self._drain_waiters:
+                    self._wake_drain_waiters()
+                if self.closed:
+                    break
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            if self.batching and self.coalesce_delay > 0 and len(queue) < self.max_batch:
+                # 等待一小段时间，让同一时刻产生的消息一起发送
+                await asyncio.sleep(self.coalesce_delay)
+
+            batch = [queue.popleft()]
+            if self.batching:
+                while queue and len(batch) < self.max_batch:
+                    batch.append(queue.popleft())
+
+            try:
+                await self.websocket.send(self.encode(batch))
+                self.frames_sent += 1
+            except ConnectionClosed:
+                self.closed = True
+                queue.extendleft(reversed(batch))
+                break
+            except asyncio.CancelledError:
+                # 关闭超时被中断：这一批可能没有发出，放回队列由 close 转存（至少一次）
+                queue.extendleft(reversed(batch))
+                raise
+            except Exception as e:
+                logger.error(f"发送消息失败: {e}")
+
+    def _wake_drain_waiters(self):
+        waiters, self._drain_waiters = self._drain_waiters, []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    async def join(self):
+        """等待队列中的消息全部交给 websocket（写任务退出时也返回），用于需要背压的大批量发送"""
+        if not self.queue or self._task is None or self._task.done():
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._drain_waiters.append(waiter)
+        await waiter
+
+    @staticmethod
+    def encode(batch: List[Frame]) -> str:
+        """编码一帧：单条消息原样发送，多条消息合并为 /batch"""
+        if len(batch) == 1:
+            return encode(batch[0])
+        return encode_batch(batch)
+
+    async def close(self):
+        """停止入队并在 drain_timeout 内发送完已排队的消息；SPILL_OFFLINE 策略下未发送的重要消息转存离线"""
+        self.closed = True
+        if self._task is not None:
+            self._wakeup.set()
+            try:
+                # 超时后 wait_for 会取消写任务并等待其退出
+                await asyncio.wait_for(self._task, self.drain_timeout)
+            except asyncio.TimeoutError:
+                pass
+
+        if self.policy == OverflowPolicy.SPILL_OFFLINE and self.on_spill is not None:
+            for message in self.queue:
+                if not self.is_low_priority(message):
+                    self.spilled += 1
+                    self.on_spill(message)
+        self.queue.clear()
@@ -0,0 +1,73 @@
+# CryptoExecutor.py
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Any, Dict
+
+
+class CryptoExecutor:
+    """CPU 密集型操作（密码哈希、JWT 签名/验签）专用的有界线程池
+
+    同时在途的任务数不超过 max_workers + max_queue，超出的调用方在事件循环上等待，
+    避免登录风暴时无限堆积任务；排队深度等指标通过 get_stats() 暴露。
+    """
+
+    def __init__(self, max_workers: int = 4, max_queue: int = 1024):
+        self.logger = logging.getLogger("CryptoExecutor")
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="crypto")
+        self._slots = asyncio.Semaphore(max_workers + max_queue)
+        self._lock = threading.Lock()
+
+        # 指标
+        self.pending = 0  # 已提交但未完成（排队 + 执行中 + 等待名额）
+        self.running = 0  # 线程中正在执行
+        self.peak_queue_depth = 0
+        self.completed = 0
+        self.failed = 0
+
+    async def run(self, func: Callable[..., Any], *args) -> Any:
+        """在线程池中执行 func(*args)"""
+        self.pending += 1
+        queue_depth = self.pending - self.running
+        if queue_depth > self.peak_queue_depth:
+            self.peak_queue_depth = queue_depth
+
+        try:
+            async with self._slots:
+                loop = asyncio.get_running_loop()
+                result = await loop.run_in_executor(self.executor, self._call, func, args)
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.pending -= 1
+        self.completed += 1
+        return result
+
+    def _call(self, func: Callable[..., Any], args) -> Any:
+        with self._lock:
+            self.running += 1
+        try:
+            return func(*args)
+        finally:
+            with self._lock:
+                self.running -= 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取线程池统计信息"""
+        return {
+            "max_workers": self.max_workers,
+            "max_queue": self.max_queue,
+            "running": self.running,
+            "queue_depth": max(self.pending - self.running, 0),
+            "peak_queue_depth": self.peak_queue_depth,
+            "completed": self.completed,
+            "failed": self.failed
+        }
+
+    def shutdown(self):
+        """关闭线程池"""
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,93 @@
+# DedupeCache.py
+import asyncio
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple, Union
+
+from clock import coarse_clock
+
+
+class DedupeCache:
+    """发送去重缓存（有界、带时间窗口）
+
+    以 (sender_id, endpoint, client_msg_id) 为键记录已处理请求的响应，窗口内的重试直接重放原响应；
+    首次请求处理期间到达的重试等待首次请求完成后得到同一个响应。
+    """
+
+    def __init__(self, max_size: int = 100000, window: float = 300):
+        self.max_size = max_size
+        self.window = window
+        # key -> (过期时刻, 响应或处理中的 Future)，按插入顺序淘汰
+        self.entries: "OrderedDict[Hashable, Tuple[float, Union[Dict[str, Any], asyncio.Future]]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    async def acquire(self, key: Hashable) -> Optional[Dict[str, Any]]:
+        """获取 key 的原响应；首次出现时登记为处理中并返回 None，调用方随后必须 complete 或 release"""
+        entry = self.entries.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > coarse_clock.now:
+                self.hits += 1
+                if isinstance(value, asyncio.Future):
+                    # 首次请求失败时 Future 结果为 None，由本次重试重新处理
+                    value = await asyncio.shield(value)
+                    if value is None:
+                        return await self.acquire(key)
+                return value
+            del self.entries[key]
+
+        self.misses += 1
+        self.entries[key] = (coarse_clock.now + self.window, asyncio.get_running_loop().create_future())
+        self._evict()
+        return None
+
+    def complete(self, key: Hashable, response: Dict[str, Any]):
+        """记录 key 的响应，唤醒等待中的重试"""
+        entry = self.entries.get(key)
+        self.entries[key] = (coarse_clock.now + self.window, response)
+        if entry is not None and isinstance(entry[1], asyncio.Future) and not entry[1].done():
+            entry[1].set_result(response)
+
+    def release(self, key: Hashable):
+        """放弃 key 的登记（请求未成功处理），等待中的重试将重新处理"""
+        entry = self.entries.get(key)
+        if entry is not None and isinstance(entry[1], asyncio.Future):
+            del self.entries[key]
+            if not entry[1].done():
+                entry[1].set_result(None)
+
+    def _evict(self):
+        """淘汰过期记录，超过容量时再淘汰最早的已完成记录
+
+        处理中的记录不因容量淘汰（否则等待中的重试会被唤醒并重复处理），全部处理中时允许暂时超出容量。
+        """
+        entries = self.entries
+        now = coarse_clock.now
+        skipped = 0
+        while len(entries) > skipped:
+            key, (expires_at, value) = next(iter(entries.items()))
+            pending = isinstance(value, asyncio.Future) and not value.done()
+            if expires_at > now:
+                if len(entries) <= self.max_size:
+                    break
+                if pending:
+                    # 处理中的记录移到末尾，继续淘汰后面的已完成记录
+                    entries.move_to_end(key)
+                    skipped += 1
+                    continue
+            del entries[key]
+            if pending:
+                value.set_result(None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取去重统计"""
+        return {
+            "size": len(self.entries),
+            "max_size": self.max_size,
+            "window": self.window,
+            "hits": self.hits,
+            "misses": self.misses
+        }
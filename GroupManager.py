@@ -2,13 +2,16 @@
 import datetime
 import logging
 import uuid
-from typing import Dict, List, Optional, Any
+from collections import OrderedDict
+from typing import Callable, Dict, FrozenSet, List, Optional, Any, Tuple
 
 from pymongo import AsyncMongoClient
 
+from clock import coarse_clock
 from enums import GroupRole, GroupStatus
 from models import Group, GroupMember
 import config
+from MongoMonitor import mongo_monitor
 
 uri = config.Config.mongo_uri
 
@@ -16,11 +19,18 @@ uri = config.Config.mongo_uri
 class GroupManager:
     """群组管理器"""
 
-    def __init__(self):
+    def __init__(self, member_cache_size: int = 10000, member_cache_ttl: float = 60):
         self.logger = logging.getLogger("GroupManager")
-        self.dbclient = AsyncMongoClient(uri)
+        self.dbclient = AsyncMongoClient(uri, event_listeners=[mongo_monitor])
         self.db_groups = self.dbclient["IM"]["groups"]
         self.db_members = self.dbclient["IM"]["group_members"]
+        # group_id -> (过期时刻, 成员ID集合) 的 LRU 缓存，成员变动时失效；
+        # 其他节点上的成员变动通过 on_members_changed 广播失效，TTL 兜底广播丢失的情况
+        self.member_ids_cache: "OrderedDict[str, Tuple[float, FrozenSet[int]]]" = OrderedDict()
+        self.member_cache_size = member_cache_size
+        self.member_cache_ttl = member_cache_ttl
+        # 本节点成员变动时的回调（由服务器设置为向其他节点广播失效）
+        self.on_members_changed: Optional[Callable[[str], None]] = None
 
         # 创建索引
         # asyncio.run(self._create_indexes())
@@ -170,6 +180,7 @@ class GroupManager:
                 {"group_id": group_id},
                 {"$inc": {"member_count": 1}}
             )
+            self.invalidate_member_ids(group_id)
             self.logger.info(f"用户 {user_id} 加入群组 {group_id}, 角色: {role.value}")
             return True
         except Exception as e:
@@ -203,6 +214,7 @@ class GroupManager:
                 {"group_id": group_id},
                 {"$inc": {"member_count": -1}}
             )
+            self.invalidate_member_ids(group_id)
 
             self.logger.info(f"用户 {user_id} 从群组 {group_id} 移除")
             return True
@@ -250,6 +262,41 @@ class GroupManager:
             self.logger.error(f"获取群组成员失败: {e}")
             return []
 
+    async def get_member_ids(self, group_id: str) -> FrozenSet[int]:
+        """获取群组成员ID集合（带缓存）"""
+        cache = self.member_ids_cache
+        entry = cache.get(group_id)
+        if entry is not None:
+            if entry[0] > coarse_clock.now:
+                cache.move_to_end(group_id)
+                return entry[1]
+            del cache[group_id]
+        try:
+            cursor = self.db_members.find({"group_id": group_id}, {"user_id": 1, "_id": 0})
+            member_ids = frozenset(member["user_id"] for member in await cursor.to_list(length=None))
+        except Exception as e:
+            self.logger.error(f"获取群组成员失败: {e}")
+            return frozenset()
+        cache[group_id] = (coarse_clock.now + self.member_cache_ttl, member_ids)
+        while len(cache) > self.member_cache_size:
+            cache.popitem(last=False)
+        return member_ids
+
+    def invalidate_member_ids(self, group_id: str, broadcast: bool = True):
+        """成员变动后使缓存失效，broadcast 时通知其他节点"""
+        self.member_ids_cache.pop(group_id, None)
+        if broadcast and self.on_members_changed is not None:
+            self.on_members_changed(group_id)
+
+    async def get_user_group_ids(self, user_id: int) -> List[str]:
+        """获取用户加入的所有群组ID（只查询成员集合）"""
+        try:
+            cursor = self.db_members.find({"user_id": user_id}, {"group_id": 1, "_id": 0})
+            return [member["group_id"] for member in await cursor.to_list(length=None)]
+        except Exception as e:
+            self.logger.error(f"获取用户群组失败: {e}")
+            return []
+
     async def get_user_groups(self, user_id: int) -> List[Group]:
         """获取用户加入的所有群组"""
         try:
@@ -374,6 +421,7 @@ class GroupManager:
 
             # 删除所有成员记录
             await self.db_members.delete_many({"group_id": group_id})
+            self.invalidate_member_ids(group_id)
 
             self.logger.info(f"群组 {group_id} 已解散，操作者: {operator_id}")
             return True
@@ -2,48 +2,124 @@ import asyncio
 import datetime
 import json
 import logging
-from typing import Dict, Optional, Any, Callable
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Any, Callable, Set, Tuple
+from urllib.parse import urlsplit, parse_qs
 import websockets
 from websockets import ServerConnection
 from websockets.exceptions import ConnectionClosed
 from ConnectionManager import ConnectionManager
+from ConnectionWriter import ConnectionWriter
+from CryptoExecutor import CryptoExecutor
+from DedupeCache import DedupeCache
 from GroupManager import GroupManager
 from JWTSessionManager import JWTSessionManager
 from MessageManager import MessageManager
+from MetricsRegistry import MetricsRegistry, start_metrics_server
+from MongoMonitor import mongo_monitor
 from OfflineMessageStore import OfflineMessageStore
+from PresenceEngine import PresenceEngine
+from RateLimiter import RateLimiter
+from RoutingRegistry import RoutingRegistry
+from TokenRevocationStore import TokenRevocationStore
 from UserManager import UserManager
-from context import RequestContextManager
-from enums import UserStatus
+from clock import coarse_clock
+from context import AppContext, RequestContext, _request_ctx_var, set_app_context
+from enums import EnqueueResult, OverflowPolicy
+from frames import Frame, encode
+from middleware import Blueprint, DEFAULT_MIDDLEWARES, Middleware, RouteOptions, compile_handler
 
 
 class IMWebSocketServer:
     """IM WebSocket服务器"""
 
     def __init__(self, host: str = "0.0.0.0", port: int = 8765,
-                 heartbeat_timeout: int = 60, heartbeat_interval: int = 30):
+                 heartbeat_timeout: int = 60, heartbeat_interval: int = 30,
+                 node_id: Optional[str] = None,
+                 routing_registry: Optional[RoutingRegistry] = None,
+                 crypto_workers: int = 4, maintenance_interval: int = 60,
+                 send_queue_size: int = 256,
+                 overflow_policy: OverflowPolicy = OverflowPolicy.SPILL_OFFLINE,
+                 coalesce_delay: float = 0.002,
+                 presence_flush_interval: float = 1.0, presence_offline_grace: float = 5.0,
+                 presence_persist_interval: float = 30.0,
+                 dedupe_window: float = 300, dedupe_size: int = 100000,
+                 rate_limit_period: float = 60.0, slow_request_threshold: float = 0.5,
+                 metrics_host: str = "0.0.0.0", metrics_port: int = 0,
+                 slow_query_threshold: float = 0.1):
         self.logger = logging.getLogger("IMWebSocketServer")
+        # 进程级应用上下文（current_app），所有请求共享
+        self.app_context = AppContext(self)
+        set_app_context(self.app_context)
         self.host = host
         self.port = port
         self.heartbeat_timeout = heartbeat_timeout
         self.heartbeat_interval = heartbeat_interval
+        self.maintenance_interval = maintenance_interval
+        # 每个连接的出站队列长度及溢出策略
+        self.send_queue_size = send_queue_size
+        self.overflow_policy = overflow_policy
+        # 支持 /batch 的连接合并出站消息的等待时间（秒）
+        self.coalesce_delay = coalesce_delay
         # 初始化管理器
-        self.jwt_manager = JWTSessionManager()
-        self.user_manager = UserManager()
-        self.connection_manager = ConnectionManager()
+        self.crypto_executor = CryptoExecutor(max_workers=crypto_workers)
+        self.jwt_manager = JWTSessionManager(executor=self.crypto_executor,
+                                             revocation_store=TokenRevocationStore(persist=True))
+        self.user_manager = UserManager(executor=self.crypto_executor)
+        self.connection_manager = ConnectionManager(node_id=node_id, routing_registry=routing_registry,
+                                                    heartbeat_timeout=heartbeat_timeout)
+        self.node_id = self.connection_manager.node_id
+        self.routing_registry = self.connection_manager.routing_registry
         self.offline_store = OfflineMessageStore()
         self.group_manager = GroupManager()
+        self.group_manager.on_members_changed = self.broadcast_members_changed
         self.message_manager = MessageManager()
-
-        # 消息处理器路由
+        # 发送去重：(sender_id, client_msg_id) -> 首次的发送响应
+        self.send_dedupe = DedupeCache(max_size=dedupe_size, window=dedupe_window)
+        # 在线状态变更去抖、合并发布
+        self.presence = PresenceEngine(self, flush_interval=presence_flush_interval,
+                                       offline_grace=presence_offline_grace,
+                                       persist_interval=presence_persist_interval)
+
+        # 消息处理器路由（endpoint -> 已组装好中间件的调用链）
         self.handlers: Dict[str, Callable] = {
 
         }
+        # endpoint -> (原始处理器, 路由选项)，中间件或钩子变化时据此重新组装
+        self.routes: Dict[str, Tuple[Callable, RouteOptions]] = {}
+        self.middlewares: List[Middleware] = list(DEFAULT_MIDDLEWARES)
+        self.before_request_funcs: List[Callable] = []
+        self.after_request_funcs: List[Callable] = []
+        # 令牌桶限流，限额单位：次/rate_limit_period 秒
+        self.rate_limiter = RateLimiter(period=rate_limit_period)
+        # 超过该耗时（秒）的请求记录为慢请求，0 表示不记录
+        self.slow_request_threshold = slow_request_threshold
+        # 按 endpoint 统计的请求指标；metrics_port 非 0 时在该端口导出 Prometheus 格式
+        self.metrics = MetricsRegistry()
+        self.metrics_host = metrics_host
+        self.metrics_port = metrics_port
+        self.metrics_server: Optional[asyncio.AbstractServer] = None
+        self.metrics.register_gauge("im_connections", lambda: len(self.connection_manager.connections))
+        self.metrics.register_gauge("im_online_users", lambda: len(self.connection_manager.user_connections))
+        self.metrics.register_gauge("im_crypto_queue_depth",
+                                    lambda: self.crypto_executor.get_stats()["queue_depth"])
+        self.metrics.register_gauge("im_presence_pending", lambda: len(self.presence.pending))
+        # 所有管理器共用的 Mongo 命令监听器，超过该耗时（秒）的命令记录为慢查询，0 表示不记录
+        self.mongo_monitor = mongo_monitor
+        self.mongo_monitor.slow_threshold = slow_query_threshold
+        self.metrics.register_gauge("im_mongo_commands", lambda: self.mongo_monitor.total_calls)
+        self.metrics.register_gauge("im_mongo_slow_queries", lambda: self.mongo_monitor.slow_queries)
 
         # 心跳检查任务
         self.heartbeat_task: Optional[asyncio.Task] = None
+        # 周期维护任务（清理过期状态、同步共享数据）
+        self.maintenance_task: Optional[asyncio.Task] = None
+        # 后台任务引用（离线转存、断开慢连接等），避免被回收
+        self.background_tasks: Set[asyncio.Task] = set()
         self.running = False
 
     async def initialize(self):
+        await self.jwt_manager.initialize()
         await self.message_manager.initialize()
         await self.group_manager.initialize()
         await self.offline_store.initialize()
@@ -53,12 +129,22 @@ class IMWebSocketServer:
     async def start(self):
         """启动服务器"""
         self.running = True
+        coarse_clock.start()
 
         # 启动心跳检查任务
         self.heartbeat_task = asyncio.create_task(self.heartbeat_checker())
+        self.maintenance_task = asyncio.create_task(self.maintenance_loop())
+        self.presence.start()
+        if self.metrics_port:
+            self.metrics_server = await start_metrics_server(self.metrics, self.metrics_host, self.metrics_port)
+
+        # 登记本节点（路由被其他节点清理时按本节点在线用户重新登记），订阅其他节点转发给本节点的消息
+        await self.routing_registry.start(self.node_id, self.connection_manager.user_connections.keys)
+        await self.routing_registry.subscribe(self.node_id, self.handle_forwarded_message)
+        await self.routing_registry.subscribe_events(self.node_id, self.handle_node_event)
 
-        self.logger.info(f"启动IM WebSocket服务器: ws://{self.host}:{self.port}")
-        self.logger.info(f"心跳检查间隔: {self.heartbeat_interval}秒, 超时: {self.heartbeat_timeout}秒")
+        self.logger.info(f"启动IM WebSocket服务器: ws://{self.host}:{self.port} (节点: {self.node_id})")
+        self.logger.info(f"客户端心跳间隔: {self.heartbeat_interval}秒, 超时: {self.heartbeat_timeout}秒")
 
         try:
             async with websockets.serve(self.connection_handler, self.host, self.port):
@@ -73,28 +159,44 @@ class IMWebSocketServer:
         """停止服务器"""
         self.running = False
 
-        # 停止心跳检查任务
-        if self.heartbeat_task:
-            self.heartbeat_task.cancel()
-            try:
-                await self.heartbeat_task
-            except asyncio.CancelledError:
-                pass
+        # 停止心跳检查任务和维护任务
+        for task in (self.heartbeat_task, self.maintenance_task):
+            if task:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+
+        await self.presence.stop()
+        if self.metrics_server is not None:
+            self.metrics_server.close()
+            self.metrics_server = None
+        await self.routing_registry.close()
+        self.crypto_executor.shutdown()
+        coarse_clock.stop()
 
         self.logger.info("服务器已停止")
 
     async def connection_handler(self, websocket: ServerConnection):
         """处理客户端连接"""
         connection_id = self.connection_manager.add_connection(websocket)
+        connection = self.connection_manager.get_connection_by_id(connection_id)
+        features = self.get_client_features(websocket)
+        if features:
+            connection.client_info = {"features": sorted(features)}
+        connection.writer = self.create_writer(connection, batching="batch" in features)
+        connection.writer.start()
 
         try:
             # 发送连接成功消息
-            await self.send_message(websocket, {
+            await self.send_to_connection(connection, {
                 "endpoint": "/system/connected",
                 "data": {
                     "connection_id": connection_id,
                     "timestamp": int(datetime.datetime.now().timestamp()),
-                    "heartbeat_interval": self.heartbeat_interval
+                    "heartbeat_interval": self.heartbeat_interval,
+                    "batch": connection.writer.batching
                 },
                 "code": 200
             })
@@ -103,10 +205,10 @@ class IMWebSocketServer:
                 try:
                     await self.process_message(connection_id, message)
                 except json.JSONDecodeError:
-                    await self.send_error(websocket, "无效的JSON格式", 400, connection_id)
+                    await self.send_error_to_connection(connection, "无效的JSON格式", 400, connection_id)
                 except DeprecationWarning as e:
                     self.logger.error(f"处理消息时出错: {e}")
-                    await self.send_error(websocket, "服务器内部错误", 500, connection_id)
+                    await self.send_error_to_connection(connection, "服务器内部错误", 500, connection_id)
 
         except ConnectionClosed:
             self.logger.info(f"连接关闭: {connection_id}")
@@ -128,25 +230,18 @@ class IMWebSocketServer:
         handler = self.handlers.get(endpoint)
         if handler:
             try:
-                async with RequestContextManager(
-                        server=self,
-                        connection_id=connection_id,
-                        request_data=data,
-                        request_id=request_id
-                ):
+                with RequestContext(self, connection_id, data, request_id):
                     response = await handler()
                     await self._process_response(response, connection_id)
             except DeprecationWarning as e:
                 self.logger.error(f"处理器执行出错 ({endpoint}): {e}")
                 connection = self.connection_manager.get_connection_by_id(connection_id)
                 if connection:
-                    await self.send_error(connection.websocket,
-                                          f"处理器执行出错: {str(e)}", 500, request_id)
+                    await self.send_error_to_connection(connection, f"处理器执行出错: {str(e)}", 500, request_id)
         else:
             connection = self.connection_manager.get_connection_by_id(connection_id)
             if connection:
-                await self.send_error(connection.websocket,
-                                      f"未知的endpoint: {endpoint}", 404, request_id)
+                await self.send_error_to_connection(connection, f"未知的endpoint: {endpoint}", 404, request_id)
 
     async def _process_response(self, response: Dict[str, Any], connection_id: str):
         """处理路由返回的响应"""
@@ -156,13 +251,72 @@ class IMWebSocketServer:
         # 发送响应给客户端
         connection = self.connection_manager.get_connection_by_id(connection_id)
         if connection:
-            await connection.websocket.send(json.dumps(response))
+            await self.send_to_connection(connection, response)
+
+    @staticmethod
+    def get_client_features(websocket: ServerConnection) -> Set[str]:
+        """读取客户端在握手时声明的特性（X-IM-Features 请求头或 ?features= 查询参数）"""
+        handshake = getattr(websocket, "request", None)
+        if handshake is None:
+            return set()
+
+        values = [handshake.headers.get("X-IM-Features", "")]
+        values.extend(parse_qs(urlsplit(handshake.path).query).get("features", []))
+        return {feature.strip().lower() for value in values for feature in value.split(",") if feature.strip()}
+
+    def create_writer(self, connection, batching: bool = False) -> ConnectionWriter:
+        """创建连接的出站队列"""
+        return ConnectionWriter(
+            connection.websocket,
+            max_size=self.send_queue_size,
+            policy=self.overflow_policy,
+            on_spill=lambda message: self.spill_to_offline(connection, message),
+            on_disconnect=lambda: self.spawn(self.close_slow_connection(connection.connection_id)),
+            batching=batching,
+            coalesce_delay=self.coalesce_delay
+        )
+
+    def spawn(self, coro) -> asyncio.Task:
+        """创建后台任务并持有引用"""
+        task = asyncio.create_task(coro)
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+        return task
+
+    def spill_to_offline(self, connection, message: Frame):
+        """把无法及时发送的推送消息转存为离线消息"""
+        endpoint = message.get("endpoint", "")
+        # 请求响应和错误只对当前连接有意义，不转存
+        if endpoint == "/error" or endpoint.endswith("_response"):
+            return
+        if connection.user_id is None:
+            return
+        self.spawn(self.offline_store.add_offline_message(connection.user_id, message))
+
+    async def close_slow_connection(self, connection_id: str):
+        """断开出站队列溢出的慢连接"""
+        connection = self.connection_manager.get_connection_by_id(connection_id)
+        if not connection:
+            return
+        self.logger.warning(f"连接 {connection_id} 出站队列溢出，断开连接")
+        try:
+            await connection.websocket.close(code=1008, reason="slow consumer")
+        except Exception:
+            pass
+        await self.cleanup_connection(connection_id)
+
+    async def send_to_connection(self, connection, message: Frame) -> EnqueueResult:
+        """通过连接的出站队列发送消息（无队列时直接发送），只有 QUEUED 为真"""
+        if connection.writer is not None:
+            return connection.writer.enqueue(message)
+        await self.send_message(connection.websocket, message)
+        return EnqueueResult.QUEUED
 
     async def send_message(self, websocket: ServerConnection,
-                           message: Dict[str, Any]):
+                           message: Frame):
         """发送消息到客户端"""
         try:
-            await websocket.send(json.dumps(message))
+            await websocket.send(encode(message))
         except ConnectionClosed:
             self.logger.debug("连接已关闭，无法发送消息")
         except Exception as e:
@@ -172,6 +326,16 @@ class IMWebSocketServer:
                          message: str, code: int = 400,
                          request_id: Optional[str] = None):
         """发送错误响应"""
+        await self.send_message(websocket, self.error_frame(message, code, request_id))
+
+    async def send_error_to_connection(self, connection, message: str, code: int = 400,
+                                       request_id: Optional[str] = None) -> EnqueueResult:
+        """通过连接的出站队列发送错误响应"""
+        return await self.send_to_connection(connection, self.error_frame(message, code, request_id))
+
+    @staticmethod
+    def error_frame(message: str, code: int = 400, request_id: Optional[str] = None) -> Dict[str, Any]:
+        """构造错误响应"""
         error_msg = {
             "endpoint": "/error",
             "data": {
@@ -183,8 +347,21 @@ class IMWebSocketServer:
 
         if request_id:
             error_msg["request_id"] = request_id
+        return error_msg
+
+    async def authenticate_connection(self, connection_id: str, user_id: int,
+                                      token_payload: Optional[Dict[str, Any]] = None) -> bool:
+        """认证连接；同一连接切换用户时退订旧用户的联系人状态，旧用户在所有节点都离线时通知订阅者"""
+        connection = self.connection_manager.get_connection_by_id(connection_id)
+        previous_user_id = connection.user_id if connection else None
+        if not await self.connection_manager.authenticate_connection(connection_id, user_id, token_payload):
+            return False
 
-        await self.send_message(websocket, error_msg)
+        if previous_user_id is not None and previous_user_id != user_id:
+            self.presence.unsubscribe_connection(connection_id)
+            if not self.connection_manager.is_user_online(previous_user_id):
+                await self.release_user(previous_user_id)
+        return True
 
     async def cleanup_connection(self, connection_id: str):
         """清理连接资源"""
@@ -194,33 +371,118 @@ class IMWebSocketServer:
 
         user_id = connection.user_id
 
-        # 移除连接
+        # 移除连接并停止出站队列（用户ID仍记录在连接上，供离线转存使用）
         self.connection_manager.remove_connection(connection_id)
+        self.presence.unsubscribe_connection(connection_id)
+        if connection.writer is not None:
+            await connection.writer.close()
 
-        # 如果用户完全离线，更新状态
+        # 如果用户在本节点完全离线，注销路由并更新状态
         if user_id and not self.connection_manager.is_user_online(user_id):
-            await self.notify_user_offline(user_id)
+            await self.release_user(user_id)
+
+    async def release_user(self, user_id: int):
+        """用户在本节点完全离线：注销路由；其他节点上也没有连接时发布离线，并通知其他节点向其订阅者发布"""
+        await self.connection_manager.release_user(user_id)
+        if await self.connection_manager.is_user_online_anywhere(user_id):
+            return
+        await self.notify_user_offline(user_id)
+        self.spawn(self.routing_registry.broadcast(self.node_id, {"type": "user_offline", "user_id": user_id}))
 
     # 辅助方法
-    async def push_message_to_user(self, user_id: int, message: Dict[str, Any]) -> bool:
-        """推送消息给用户（所有设备）"""
+    async def push_message_to_user(self, user_id: int, message: Frame,
+                                   forward: bool = True) -> EnqueueResult:
+        """推送消息给用户（所有设备，包括连接在其他节点上的设备）
+
+        任一设备入队或转发成功即为 QUEUED；都没有入队但有设备的队列已满转存了离线消息时为 SPILLED，
+        调用方不应再重复存储离线消息。
+        """
         connections = self.connection_manager.get_user_connections(user_id)
 
-        if not connections:
-            return False
+        result = EnqueueResult.DROPPED
+        if forward:
+            # 计入当前请求的推送扇出
+            ctx = _request_ctx_var.get()
+            if ctx is not None:
+                ctx.fanout += 1
+            if await self.forward_message_to_user(user_id, message):
+                result = EnqueueResult.QUEUED
 
-        success = False
+        # 只入队，不等待发送完成
         for connection in connections:
             try:
-                await self.send_message(connection.websocket, message)
-                success = True
+                sent = await self.send_to_connection(connection, message)
+                if sent is EnqueueResult.QUEUED:
+                    result = sent
+                elif sent is EnqueueResult.SPILLED and result is EnqueueResult.DROPPED:
+                    result = sent
             except Exception as e:
                 self.logger.error(f"推送消息给用户 {user_id} 失败: {e}")
                 # 如果连接失败，标记为需要清理
                 self.connection_manager.remove_connection(connection.connection_id)
 
+        return result
+
+    async def push_message_to_users(self, user_ids: Iterable[int], message: Frame) -> Set[int]:
+        """推送同一条消息给多个用户，返回在线（已推送或转发）的用户
+
+        一次查询所有用户所在的节点，发往同一节点的用户合并为一次转发。
+        """
+        located = await self.connection_manager.locate_users(user_ids)
+        ctx = _request_ctx_var.get()
+        if ctx is not None:
+            ctx.fanout += len(located)
+
+        by_node: Dict[str, List[int]] = {}
+        for user_id, nodes in located.items():
+            for node_id in nodes:
+                if node_id != self.node_id:
+                    by_node.setdefault(node_id, []).append(user_id)
+        for node_id, node_users in by_node.items():
+            try:
+                await self.routing_registry.forward_many(node_id, node_users, message)
+            except Exception as e:
+                self.logger.error(f"转发消息到节点 {node_id} 失败: {e}")
+
+        for user_id, nodes in located.items():
+            if self.node_id in nodes:
+                await self.push_message_to_user(user_id, message, forward=False)
+        return set(located)
+
+    async def forward_message_to_user(self, user_id: int, message: Frame) -> bool:
+        """把消息转发到用户所在的其他节点"""
+        nodes = await self.routing_registry.get_nodes(user_id)
+        nodes.discard(self.node_id)
+
+        success = False
+        for node_id in nodes:
+            try:
+                if await self.routing_registry.forward(node_id, user_id, message):
+                    success = True
+            except Exception as e:
+                self.logger.error(f"转发消息到节点 {node_id} 失败: {e}")
         return success
 
+    async def handle_forwarded_message(self, user_id: int, message: Frame):
+        """处理其他节点转发来的消息，只推送给本节点连接"""
+        await self.push_message_to_user(user_id, message, forward=False)
+
+    def broadcast_members_changed(self, group_id: str):
+        """通知其他节点群成员已变动"""
+        self.spawn(self.routing_registry.broadcast(self.node_id, {"type": "group_members_changed",
+                                                                  "group_id": group_id}))
+
+    async def handle_node_event(self, event: Dict[str, Any]):
+        """处理其他节点广播的事件"""
+        event_type = event.get("type")
+        if event_type == "group_members_changed":
+            self.group_manager.invalidate_member_ids(event.get("group_id"), broadcast=False)
+        elif event_type == "user_offline":
+            # 用户已在所有节点离线，本节点曾发布的在线状态也要撤销
+            user_id = event.get("user_id")
+            if not self.connection_manager.is_user_online(user_id):
+                await self.notify_user_offline(user_id)
+
     async def push_offline_messages(self, user_id: int, websocket: ServerConnection):
         """推送离线消息给用户"""
         offline_messages = await self.offline_store.get_offline_messages(user_id)
@@ -238,7 +500,7 @@ class IMWebSocketServer:
                     sender_id = message.get("data", {}).get("sender_id")
                     message_id = message.get("data", {}).get("message_id")
 
-                    if sender_id and message_id and self.connection_manager.is_user_online(sender_id):
+                    if sender_id and message_id and await self.connection_manager.is_user_online_anywhere(sender_id):
                         delivery_message = {
                             "endpoint": "/message/delivery_receipt",
                             "data": {
@@ -254,57 +516,102 @@ class IMWebSocketServer:
         # 清空离线消息
         await self.offline_store.clear_offline_messages(user_id)
 
-    async def notify_user_online(self, user_id: int):
-        """通知联系人用户上线"""
-        user = await self.user_manager.get_user_by_id(user_id)
-        if not user:
-            return
+    async def resume_offline_messages(self, connection, last_msg_id: Optional[str] = None,
+                                      page_size: int = 500) -> int:
+        """断线重连后只续传 last_msg_id 之后的离线消息，返回续传条数
 
-        # 更新用户状态
-        user.status = UserStatus.ONLINE
-        user.last_seen = int(datetime.datetime.now().timestamp())
-
-        # 通知所有联系人
-        for contact_id in user.contact_list:
-            if self.connection_manager.is_user_online(contact_id):
-                presence_message = {
-                    "endpoint": "/presence/change",
-                    "data": {
-                        "user_id": user_id,
-                        "username": user.username,
-                        "nickname": user.nickname,
-                        "status": user.status.value,
-                        "last_seen": user.last_seen,
-                        "timestamp": int(datetime.datetime.now().timestamp())
-                    }
-                }
-                await self.push_message_to_user(contact_id, presence_message)
+        由 /reconnect 放到后台任务中运行。消息经连接的出站队列发送，与其他推送保持顺序；每页等出站队列
+        发完再删除离线记录，页大小不超过队列容量的一半，续传本身不会触发溢出。连接在续传中断开时
+        本页记录保留在离线存储中，下次重连会再次续传（至少一次）。
+        """
+        user_id = connection.user_id
+        writer = connection.writer
+        if writer is not None:
+            page_size = min(page_size, max(writer.max_size // 2, 1))
+        resumed = 0
+        # sender_id -> 已送达的 message_id，按发送者合并回执
+        receipts: Dict[int, List[str]] = defaultdict(list)
+
+        while True:
+            records = await self.offline_store.get_offline_messages_after(user_id, last_msg_id, limit=page_size)
+            if not records:
+                break
 
-    async def notify_user_offline(self, user_id: int):
-        """通知联系人用户离线"""
-        user = await self.user_manager.get_user_by_id(user_id)
-        if not user:
-            return
+            # 入队成功或已被出站队列转存离线的记录都可以删除，遇到被丢弃的消息停止
+            handled = []
+            for record in records:
+                result = await self.send_to_connection(connection, record["message"])
+                if result is EnqueueResult.DROPPED:
+                    break
+                handled.append((record, result))
+
+            if writer is not None:
+                await writer.join()
+                if writer.closed:
+                    self.logger.info(f"用户 {user_id} 的连接在续传中断开，剩余离线消息保留")
+                    break
+
+            if handled:
+                await self.offline_store.delete_offline_records(user_id, [record["_id"] for record, _ in handled])
+                resumed += len(handled)
+            for record, result in handled:
+                message = record["message"]
+                if result is EnqueueResult.QUEUED and message.get("endpoint") == "/message/receive":
+                    data = message.get("data", {})
+                    if data.get("sender_id") and data.get("message_id"):
+                        receipts[data["sender_id"]].append(data["message_id"])
+
+            if len(handled) < len(records) or len(records) < page_size:
+                break
+            # 续传位置之前的记录已在第一页删除，后续页直接从头读取
+            last_msg_id = None
 
-        # 更新用户状态
-        user.status = UserStatus.OFFLINE
-        user.last_seen = int(datetime.datetime.now().timestamp())
-
-        # 通知所有联系人
-        for contact_id in user.contact_list:
-            if self.connection_manager.is_user_online(contact_id):
-                presence_message = {
-                    "endpoint": "/presence/change",
-                    "data": {
-                        "user_id": user_id,
-                        "username": user.username,
-                        "nickname": user.nickname,
-                        "status": user.status.value,
-                        "last_seen": user.last_seen,
-                        "timestamp": int(datetime.datetime.now().timestamp())
-                    }
+        for sender_id, message_ids in receipts.items():
+            await self.push_message_to_user(sender_id, {
+                "endpoint": "/message/delivery_receipt",
+                "data": {
+                    "message_ids": message_ids,
+                    "timestamp": int(datetime.datetime.now().timestamp())
                 }
-                await self.push_message_to_user(contact_id, presence_message)
+            })
+
+        if resumed:
+            self.logger.info(f"为用户 {user_id} 续传 {resumed} 条离线消息")
+        return resumed
+
+    async def notify_user_online(self, user_id: int, username: str = "", nickname: str = ""):
+        """通知订阅者用户上线（由在线状态引擎去抖、合并后发布）"""
+        self.presence.mark_online(user_id, username, nickname)
+
+    async def notify_user_offline(self, user_id: int):
+        """通知订阅者用户离线（宽限期内重连则不通知）"""
+        self.presence.mark_offline(user_id)
+
+    async def get_online_group_members(self, group_id: str) -> List[int]:
+        """获取群组在线成员ID（成员缓存 + 路由注册表，不查询成员集合）"""
+        member_ids = await self.group_manager.get_member_ids(group_id)
+        online = await self.connection_manager.filter_online_anywhere(member_ids)
+        return [member_id for member_id in member_ids if member_id in online]
+
+    async def filter_visible_users(self, user_id: int, user_ids: Iterable[int]) -> Set[int]:
+        """从 user_ids 中筛选 user_id 可以查看在线状态的用户（自己、联系人、同群成员）"""
+        candidates = set(user_ids)
+        contact_ids = self.presence.get_contacts(user_id)
+        if contact_ids is None:
+            user = await self.user_manager.get_user_by_id(user_id)
+            contact_ids = user.contact_list if user else ()
+        visible = candidates.intersection(contact_ids)
+        if user_id in candidates:
+            visible.add(user_id)
+
+        remaining = candidates - visible
+        if remaining:
+            for group_id in await self.group_manager.get_user_group_ids(user_id):
+                visible |= remaining & await self.group_manager.get_member_ids(group_id)
+                remaining -= visible
+                if not remaining:
+                    break
+        return visible
 
     async def heartbeat_checker(self):
         """心跳检查任务"""
@@ -312,7 +619,7 @@ class IMWebSocketServer:
 
         while self.running:
             try:
-                await asyncio.sleep(self.heartbeat_interval)
+                await asyncio.sleep(self.connection_manager.heartbeat_wheel.tick)
                 await self.check_heartbeats()
             except asyncio.CancelledError:
                 break
@@ -321,42 +628,104 @@ class IMWebSocketServer:
 
         self.logger.info("心跳检查任务已停止")
 
-    def route(self, endpoint: str):
+    async def maintenance_loop(self):
+        """周期维护任务"""
+        while self.running:
+            try:
+                await asyncio.sleep(self.maintenance_interval)
+                await self.run_maintenance()
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                self.logger.error(f"周期维护出错: {e}")
+
+    async def run_maintenance(self):
+        """执行一次周期维护"""
+        # 淘汰过期的吊销记录，并同步其他进程新增的吊销记录
+        self.jwt_manager.revoked_tokens.purge_expired()
+        await self.jwt_manager.revoked_tokens.sync()
+
+    def route(self, endpoint: str, rate_limit: Optional[int] = None,
+              user_rate_limit: Optional[int] = None, require_auth: bool = False,
+              required_fields: Tuple[str, ...] = ()):
+        """注册处理器并组装中间件调用链
+
+        rate_limit 为每个连接、user_rate_limit 为每个用户（所有设备合计）的限额，
+        require_auth 要求登录，required_fields 为请求数据中的必填字段
+        """
+        options = RouteOptions(endpoint, require_auth, rate_limit, user_rate_limit, tuple(required_fields))
+
         def wrapper(func):
-            self.handlers[endpoint] = func
+            self.routes[endpoint] = (func, options)
+            self.handlers[endpoint] = compile_handler(self, func, options, self.middlewares)
+            return func
 
         return wrapper
 
+    def recompile_handlers(self):
+        """中间件或钩子变化后重新组装所有调用链"""
+        for endpoint, (func, options) in self.routes.items():
+            self.handlers[endpoint] = compile_handler(self, func, options, self.middlewares)
+
+    def use(self, middleware: Middleware):
+        """在最内层追加中间件"""
+        self.middlewares.append(middleware)
+        self.recompile_handlers()
+
+    def before_request(self, func: Callable) -> Callable:
+        """注册请求前钩子，返回非空值时作为响应直接返回"""
+        self.before_request_funcs.append(func)
+        self.recompile_handlers()
+        return func
+
+    def after_request(self, func: Callable) -> Callable:
+        """注册请求后钩子，接收并返回响应"""
+        self.after_request_funcs.append(func)
+        self.recompile_handlers()
+        return func
+
+    def register_blueprint(self, blueprint: Blueprint):
+        """注册蓝图中的钩子和路由"""
+        self.before_request_funcs.extend(blueprint.before_request_funcs)
+        self.after_request_funcs.extend(blueprint.after_request_funcs)
+        self.routes.update(blueprint.routes)
+        self.recompile_handlers()
+
     async def check_heartbeats(self):
-        """检查所有连接的心跳"""
-        current_time = datetime.datetime.now()
-        timeout_connections = []
-
-        for connection_id, connection in self.connection_manager.connections.items():
-            # 计算心跳时间差
-            time_diff = (current_time - connection.last_heartbeat).total_seconds()
-            # 如果心跳超时
-            if time_diff > self.heartbeat_timeout:
-                self.logger.warning(f"连接 {connection_id} 心跳超时 ({time_diff:.1f}s)")
-                timeout_connections.append(connection_id)
-        # 清理超时连接
+        """检查到期连接的心跳（只处理时间轮中已到期的连接）"""
+        timeout_connections = self.connection_manager.collect_heartbeat_timeouts()
+        if not timeout_connections:
+            return
+
+        self.logger.warning(f"{len(timeout_connections)} 个连接心跳超时")
+        # 关闭握手可能要等到 close_timeout，放到后台任务中，不阻塞时间轮
         for connection_id in timeout_connections:
-            connection = self.connection_manager.get_connection_by_id(connection_id)
-            if connection:
-                # 发送超时通知
-                try:
-                    timeout_message = {
-                        "endpoint": "/system/notification",
-                        "data": {
-                            "type": "connection_timeout",
-                            "message": "连接超时，请重新连接",
-                            "timestamp": int(datetime.datetime.now().timestamp())
-                        }
-                    }
-                    await self.send_message(connection.websocket, timeout_message)
-                    await asyncio.sleep(0.1)  # 等待消息发送
-                except:
-                    pass
+            self.spawn(self.close_timed_out_connection(connection_id))
 
-                # 清理连接
-                await self.cleanup_connection(connection_id)
+    async def close_timed_out_connection(self, connection_id: str):
+        """通知并关闭心跳超时的连接"""
+        connection = self.connection_manager.get_connection_by_id(connection_id)
+        if not connection:
+            return
+
+        # 发送超时通知
+        try:
+            timeout_message = {
+                "endpoint": "/system/notification",
+                "data": {
+                    "type": "connection_timeout",
+                    "message": "连接超时，请重新连接",
+                    "timestamp": int(datetime.datetime.now().timestamp())
+                }
+            }
+            await self.send_to_connection(connection, timeout_message)
+        except Exception:
+            pass
+
+        # 先清理连接（注销路由、更新在线状态，出站队列在 drain_timeout 内发出超时通知），不必等对端完成关闭握手
+        await self.cleanup_connection(connection_id)
+        try:
+            # close 会先发送完已排队的数据再发送关闭帧
+            await connection.websocket.close()
+        except Exception:
+            pass
@@ -1,37 +1,111 @@
-import datetime
 import logging
 import secrets
-from typing import Optional, Set, Dict, Any
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List, Tuple
 
 import jwt
 
+from CryptoExecutor import CryptoExecutor
+from TokenRevocationStore import TokenRevocationStore
+
 
 class JWTSessionManager:
     """JWT会话管理"""
 
-    def __init__(self, secret_key: Optional[str] = None, algorithm: str = 'HS256'):
+    def __init__(self, secret_key: Optional[str] = None, algorithm: str = 'HS256',
+                 executor: Optional[CryptoExecutor] = None, cache_size: int = 10000,
+                 revocation_store: Optional[TokenRevocationStore] = None):
         self.logger = logging.getLogger("JWTSessionManager")
+        # 签名/验签在线程池中执行，避免阻塞事件循环
+        self.executor = executor
 
         self.secret_key = secret_key or secrets.token_urlsafe(32)
         self.algorithm = algorithm
-        # 存储已吊销的Token（生产环境用Redis）
-        self.revoked_tokens: Set[str] = set()
+        # 已吊销的Token（jti只保留到exp）；默认只在内存中，需要持久化时由调用方传入开启持久化的存储
+        self.revoked_tokens = revocation_store or TokenRevocationStore()
+
+        # 已验证Token缓存（token -> payload），命中时跳过验签，直到 exp 或被吊销
+        self.cache_size = cache_size
+        self._verified_cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        # jti -> token，用于吊销时立即清除缓存
+        self._jti_to_token: Dict[str, str] = {}
 
-    def create_token(self, user_id: int, username: str, expires_in: int = 86400) -> str:
+    async def initialize(self):
+        await self.revoked_tokens.initialize()
+
+    def create_token(self, user_id: int, username: str, expires_in: int = 86400,
+                     scopes: Optional[List[str]] = None) -> str:
         """创建JWT Token"""
+        token, payload = self._encode(user_id, username, expires_in, scopes)
+        self._cache_payload(token, payload)
+        return token
+
+    def _encode(self, user_id: int, username: str, expires_in: int,
+                scopes: Optional[List[str]]) -> Tuple[str, Dict[str, Any]]:
+        """签发Token（不读写缓存，可在线程池中执行）"""
+        now = int(time.time())
         payload = {
             'user_id': user_id,
             'username': username,
-            'exp': datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=expires_in),
-            'iat': datetime.datetime.now(datetime.timezone.utc),
+            'exp': now + expires_in,
+            'iat': now,
             'jti': secrets.token_urlsafe(16),  # 唯一标识
+            'scopes': scopes if scopes is not None else ['user'],
         }
 
         token = jwt.encode(payload, self.secret_key, algorithm=self.algorithm)
+        return token, payload
+
+    async def create_token_async(self, user_id: int, username: str, expires_in: int = 86400,
+                                 scopes: Optional[List[str]] = None) -> str:
+        """在线程池中创建JWT Token"""
+        if self.executor is None:
+            return self.create_token(user_id, username, expires_in, scopes)
+
+        token, payload = await self.executor.run(self._encode, user_id, username, expires_in, scopes)
+        # 签发时已知payload，直接放入缓存，首次验证无需验签
+        self._cache_payload(token, payload)
         return token
 
-    def verify_token(self, token: str) -> Optional[Dict[str, Any]]:
-        """验证并解析Token"""
+    def _get_cached(self, token: str) -> Optional[Dict[str, Any]]:
+        """从缓存获取已验证的payload（返回副本，调用方修改不会影响缓存）"""
+        payload = self._verified_cache.get(token)
+        if payload is None:
+            return None
+
+        if payload.get('exp', 0) <= time.time() or payload.get('jti') in self.revoked_tokens:
+            self._evict(token)
+            return None
+
+        self._verified_cache.move_to_end(token)
+        return dict(payload)
+
+    def _cache_payload(self, token: str, payload: Dict[str, Any]):
+        """缓存已验证的payload（保存副本，scopes 转为元组，调用方修改返回的payload不会影响缓存）"""
+        if self.cache_size <= 0:
+            return
+
+        payload = dict(payload)
+        if isinstance(payload.get('scopes'), list):
+            payload['scopes'] = tuple(payload['scopes'])
+        self._verified_cache[token] = payload
+        jti = payload.get('jti')
+        if jti:
+            self._jti_to_token[jti] = token
+
+        while len(self._verified_cache) > self.cache_size:
+            oldest, _ = self._verified_cache.popitem(last=False)
+            self._evict(oldest)
+
+    def _evict(self, token: str):
+        """移除缓存项"""
+        payload = self._verified_cache.pop(token, None)
+        if payload:
+            self._jti_to_token.pop(payload.get('jti'), None)
+
+    def _decode(self, token: str) -> Optional[Dict[str, Any]]:
+        """验签并解析Token（不读写缓存，可在线程池中执行）"""
         try:
             payload = jwt.decode(token, self.secret_key, algorithms=[self.algorithm])
 
@@ -48,13 +122,46 @@ class JWTSessionManager:
             self.logger.debug(f"无效Token: {e}")
             return None
 
+    def verify_token(self, token: str) -> Optional[Dict[str, Any]]:
+        """验证并解析Token"""
+        payload = self._get_cached(token)
+        if payload is not None:
+            return payload
+
+        payload = self._decode(token)
+        if payload:
+            self._cache_payload(token, payload)
+        return payload
+
+    async def verify_token_async(self, token: str) -> Optional[Dict[str, Any]]:
+        """在线程池中验证并解析Token（缓存命中时不进入线程池）"""
+        if self.executor is None:
+            return self.verify_token(token)
+
+        payload = self._get_cached(token)
+        if payload is not None:
+            return payload
+
+        payload = await self.executor.run(self._decode, token)
+        if payload:
+            self._cache_payload(token, payload)
+        return payload
+
+    def is_revoked(self, jti: Optional[str]) -> bool:
+        """检查jti是否已吊销"""
+        return jti in self.revoked_tokens
+
     def revoke_token(self, token: str) -> bool:
         """吊销Token"""
         try:
             payload = jwt.decode(token, self.secret_key, algorithms=[self.algorithm], options={"verify_exp": False})
             jti = payload.get('jti')
             if jti:
-                self.revoked_tokens.add(jti)
+                self.revoked_tokens.add(jti, int(payload.get('exp', 0)))
+                # 立即使缓存失效
+                cached = self._jti_to_token.get(jti)
+                if cached:
+                    self._evict(cached)
                 return True
         except jwt.InvalidTokenError:
             pass
@@ -3,10 +3,12 @@ import uuid
 import datetime
 import asyncio
 from typing import Dict, List, Optional, Any
-from pymongo import AsyncMongoClient
+from pymongo import AsyncMongoClient, ReturnDocument
+from pymongo.errors import DuplicateKeyError
 from enums import MessageType
 import logging
 import config
+from MongoMonitor import mongo_monitor
 
 uri = config.Config.mongo_uri
 
@@ -14,10 +16,15 @@ uri = config.Config.mongo_uri
 class MessageManager:
     """消息管理器"""
 
+    # 按序号增量同步单次最多返回的消息数
+    MAX_SYNC_LIMIT = 500
+
     def __init__(self):
         self.logger = logging.getLogger("MessageManager")
-        self.dbclient = AsyncMongoClient(uri)
+        self.dbclient = AsyncMongoClient(uri, event_listeners=[mongo_monitor])
         self.db_messages = self.dbclient["IM"]["messages"]
+        # 序号计数器：user:<user_id> 为用户收件序号，group:<group_id> 为群消息序号
+        self.db_sequences = self.dbclient["IM"]["sequences"]
 
         # 创建索引
         # asyncio.run(self._create_indexes())
@@ -26,22 +33,58 @@ class MessageManager:
         await self._create_indexes()
 
     async def _create_indexes(self):
-        """创建数据库索引"""
-        try:
+        """创建数据库索引，每个索引单独创建，某个失败不影响其余索引"""
+        indexes = [
             # 复合索引，支持快速查询
-            await self.db_messages.create_index([("sender_id", 1), ("receiver_id", 1), ("timestamp", -1)])
-            await self.db_messages.create_index([("group_id", 1), ("timestamp", -1)])
-            await self.db_messages.create_index([("sender_id", 1), ("timestamp", -1)])
-            await self.db_messages.create_index([("receiver_id", 1), ("timestamp", -1)])
-            await self.db_messages.create_index("message_id", unique=True)
-            await self.db_messages.create_index("timestamp")
-
+            ([("sender_id", 1), ("receiver_id", 1), ("timestamp", -1)], {}),
+            ([("group_id", 1), ("timestamp", -1)], {}),
+            ([("sender_id", 1), ("timestamp", -1)], {}),
+            ([("receiver_id", 1), ("timestamp", -1)], {}),
+            ("message_id", {"unique": True}),
+            # 同一发送者的 client_msg_id 唯一，去重缓存未命中时（重启、其他节点）由数据库兜底
+            ([("sender_id", 1), ("client_msg_id", 1)],
+             {"unique": True, "partialFilterExpression": {"client_msg_id": {"$type": "string"}}}),
+            ("timestamp", {}),
+            # 按序号增量同步；序号在收件人/群内唯一，同一序号不会分给两条消息
+            ([("receiver_id", 1), ("seq", 1)],
+             {"unique": True, "partialFilterExpression": {"is_group": False, "seq": {"$type": "number"}}}),
+            ([("group_id", 1), ("seq", 1)],
+             {"unique": True, "partialFilterExpression": {"is_group": True, "seq": {"$type": "number"}}}),
+        ]
+        failed = 0
+        for keys, options in indexes:
+            try:
+                await self.db_messages.create_index(keys, **options)
+            except Exception as e:
+                failed += 1
+                self.logger.error(f"创建索引 {keys} 失败: {e}")
+
+        if failed:
+            self.logger.error(f"消息管理器索引创建完成，{failed} 个失败")
+        else:
             self.logger.debug("消息管理器索引创建完成")
+
+    async def next_sequence(self, key: str) -> int:
+        """获取计数器的下一个序号（单调递增）"""
+        counter = await self.db_sequences.find_one_and_update(
+            {"_id": key},
+            {"$inc": {"seq": 1}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        return counter["seq"]
+
+    async def release_sequence(self, key: str, seq: int) -> bool:
+        """归还刚分配但未使用的序号：只有计数器仍停在 seq（之后没有再分配）时才能回退"""
+        try:
+            result = await self.db_sequences.update_one({"_id": key, "seq": seq}, {"$inc": {"seq": -1}})
+            return result.modified_count > 0
         except Exception as e:
-            self.logger.error(f"创建索引失败: {e}")
+            self.logger.error(f"归还序号失败: {e}")
+            return False
 
     async def save_private_message(self, message_data: Dict[str, Any]) -> str:
-        """保存私聊消息"""
+        """保存私聊消息，分配接收者的收件序号并写回 message_data["seq"]"""
         try:
             message_id = message_data.get("message_id", str(uuid.uuid4()))
             timestamp = message_data.get("timestamp", int(datetime.datetime.now().timestamp()))
@@ -53,6 +96,7 @@ class MessageManager:
                 "type": message_data.get("type", MessageType.TEXT.value),
                 "content": message_data["content"],
                 "timestamp": timestamp,
+                "seq": message_data.get("seq"),
                 "client_msg_id": message_data.get("client_msg_id"),
                 "delivered": message_data.get("delivered", False),
                 "read": message_data.get("read", False),
@@ -60,7 +104,12 @@ class MessageManager:
                 "is_group": False
             }
 
-            await self.db_messages.insert_one(message_record)
+            saved = await self._insert_message(message_record, f"user:{message_record['receiver_id']}")
+            message_data.update(message_id=saved["message_id"], seq=saved.get("seq"),
+                                timestamp=saved["timestamp"])
+            if saved is not message_record:
+                # 重复发送，返回首次保存的消息
+                return saved["message_id"]
             self.logger.debug(f"保存私聊消息: {message_id}")
             return message_id
 
@@ -69,33 +118,75 @@ class MessageManager:
             return ""
 
     async def save_group_message(self, message_data: Dict[str, Any]) -> str:
-        """保存群聊消息"""
+        """保存群聊消息，分配群消息序号并写回 message_data["data"]["seq"]"""
         try:
-            message_id = message_data.get("message_id", str(uuid.uuid4()))
-            timestamp = message_data.get("timestamp", int(datetime.datetime.now().timestamp()))
+            data = message_data["data"]
+            message_id = data.get("message_id", message_data.get("message_id", str(uuid.uuid4())))
+            timestamp = data.get("timestamp", int(datetime.datetime.now().timestamp()))
 
             message_record = {
                 "message_id": message_id,
-                "sender_id": message_data.get("sender_id", message_data.get("data").get("sender_info").get("user_id")),
-                "group_id": message_data["data"]["group_id"],
-                "type": message_data.get("type", MessageType.TEXT.value),
-                "content": message_data["data"]["content"],
+                "sender_id": data.get("sender_id", data.get("sender_info", {}).get("user_id")),
+                "group_id": data["group_id"],
+                "type": data.get("type", MessageType.TEXT.value),
+                "content": data["content"],
                 "timestamp": timestamp,
-                "client_msg_id": message_data.get("client_msg_id"),
-                "at_users": message_data.get("at_users", []),
-                "at_all": message_data.get("at_all", False),
+                "seq": data.get("seq"),
+                "client_msg_id": data.get("client_msg_id"),
+                "at_users": data.get("at_users", []),
+                "at_all": data.get("at_all", False),
                 "created_at": datetime.datetime.now(),
                 "is_group": True
             }
 
-            result = await self.db_messages.insert_one(message_record)
-            self.logger.debug(f"保存群聊消息: {message_id} 群组: {message_data['data']['group_id']}")
+            saved = await self._insert_message(message_record, f"group:{message_record['group_id']}")
+            data.update(message_id=saved["message_id"], seq=saved.get("seq"), timestamp=saved["timestamp"])
+            if saved is not message_record:
+                # 重复发送，返回首次保存的消息
+                return saved["message_id"]
+            self.logger.debug(f"保存群聊消息: {message_id} 群组: {data['group_id']}")
             return message_id
 
         except DeprecationWarning as e:
             self.logger.error(f"保存群聊消息失败: {e}")
             return ""
 
+    async def _insert_message(self, message_record: Dict[str, Any], counter_key: str) -> Dict[str, Any]:
+        """写入消息记录并分配序号，返回实际保存的记录（重复发送时为首次保存的记录）
+
+        先按 (sender_id, client_msg_id) 查重，重复发送不分配序号；并发的重复发送由唯一索引兜底。
+        只有撞上唯一索引（写入确定没有生效）时才归还刚分配的序号；网络错误、超时等结果不确定的失败
+        可能已经写入，归还会让下一条消息拿到同一个序号，因此不归还。未归还的序号（以及计数器已被
+        后续消息继续分配、无法归还的序号）会留下空洞。按序号同步使用 seq > after_seq 的范围查询，
+        空洞只会被跳过，客户端不能把序号不连续当作丢消息。
+        """
+        existing = await self.find_duplicate(message_record)
+        if existing is not None:
+            return existing
+        allocated = None
+        if not message_record["seq"]:
+            allocated = message_record["seq"] = await self.next_sequence(counter_key)
+
+        try:
+            await self.db_messages.insert_one(message_record)
+        except DuplicateKeyError as e:
+            if allocated is not None and not await self.release_sequence(counter_key, allocated):
+                self.logger.warning(f"消息写入失败，序号 {counter_key}#{allocated} 无法归还: {e}")
+            existing = await self.find_duplicate(message_record)
+            if existing is not None:
+                return existing
+            raise
+        return message_record
+
+    async def find_duplicate(self, message_record: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """按 (sender_id, client_msg_id) 查找已保存的消息"""
+        if not isinstance(message_record.get("client_msg_id"), str):
+            return None
+        return await self.db_messages.find_one({
+            "sender_id": message_record["sender_id"],
+            "client_msg_id": message_record["client_msg_id"]
+        })
+
     async def get_private_messages(self, user1_id: int, user2_id: int,
                                    limit: int = 50, last_msg_id: Optional[str] = None,
                                    start_time: Optional[int] = None,
@@ -204,6 +295,52 @@ class MessageManager:
             self.logger.error(f"获取群聊历史消息失败: {e}")
             return []
 
+    async def get_private_messages_after_seq(self, user_id: int, after_seq: int = 0,
+                                             limit: int = 100) -> List[Dict[str, Any]]:
+        """获取用户收件序号大于 after_seq 的私聊消息（按序号升序）"""
+        try:
+            cursor = self.db_messages.find(
+                {"is_group": False, "receiver_id": user_id, "seq": {"$gt": after_seq}}
+            ).sort("seq", 1).limit(limit)
+            messages = await cursor.to_list(length=limit)
+            return [{
+                "message_id": msg["message_id"],
+                "seq": msg["seq"],
+                "sender_id": msg["sender_id"],
+                "receiver_id": msg["receiver_id"],
+                "type": msg["type"],
+                "content": msg["content"],
+                "timestamp": msg["timestamp"],
+                "client_msg_id": msg.get("client_msg_id")
+            } for msg in messages]
+        except Exception as e:
+            self.logger.error(f"按序号同步私聊消息失败: {e}")
+            return []
+
+    async def get_group_messages_after_seq(self, group_id: str, after_seq: int = 0,
+                                           limit: int = 100) -> List[Dict[str, Any]]:
+        """获取群消息序号大于 after_seq 的群聊消息（按序号升序）"""
+        try:
+            cursor = self.db_messages.find(
+                {"is_group": True, "group_id": group_id, "seq": {"$gt": after_seq}}
+            ).sort("seq", 1).limit(limit)
+            messages = await cursor.to_list(length=limit)
+            return [{
+                "message_id": msg["message_id"],
+                "seq": msg["seq"],
+                "group_id": msg["group_id"],
+                "sender_id": msg["sender_id"],
+                "type": msg["type"],
+                "content": msg["content"],
+                "timestamp": msg["timestamp"],
+                "client_msg_id": msg.get("client_msg_id"),
+                "at_users": msg.get("at_users", []),
+                "at_all": msg.get("at_all", False)
+            } for msg in messages]
+        except Exception as e:
+            self.logger.error(f"按序号同步群聊消息失败: {e}")
+            return []
+
     async def get_user_messages_by_time(self, user_id: int,
                                         start_time: int,
                                         end_time: int,
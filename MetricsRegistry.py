@@ -0,0 +1,179 @@
+# MetricsRegistry.py
+import asyncio
+import logging
+from bisect import bisect_left
+from typing import Any, Callable, Dict, List, Sequence
+
+# 请求耗时分桶（秒）
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+# 单个请求推送的接收者数分桶
+FANOUT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+# 单个请求的数据库命令数分桶
+DB_CALL_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50)
+
+
+class Histogram:
+    """固定分桶直方图（最后一个桶为 +Inf）"""
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds: Sequence[float]):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """按分桶上界估算分位数"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return self.bounds[index] if index < len(self.bounds) else float("inf")
+        return float("inf")
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+            "buckets": dict(zip([str(b) for b in self.bounds] + ["+Inf"], self.counts))
+        }
+
+
+class EndpointMetrics:
+    """单个 endpoint 的指标"""
+    __slots__ = ('requests', 'errors', 'latency', 'fanout', 'db_calls')
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.fanout = Histogram(FANOUT_BUCKETS)
+        self.db_calls = Histogram(DB_CALL_BUCKETS)
+
+
+class MetricsRegistry:
+    """请求指标：按 endpoint 统计请求数、错误数、耗时、推送扇出和数据库命令数"""
+
+    def __init__(self):
+        self.endpoints: Dict[str, EndpointMetrics] = {}
+        # 指标导出时采集的瞬时值: 名称 -> 取值函数
+        self.gauges: Dict[str, Callable[[], float]] = {}
+
+    def observe_request(self, endpoint: str, elapsed: float, error: bool,
+                        fanout: int = 0, db_calls: int = 0):
+        """记录一次请求"""
+        metrics = self.endpoints.get(endpoint)
+        if metrics is None:
+            metrics = self.endpoints[endpoint] = EndpointMetrics()
+        metrics.requests += 1
+        if error:
+            metrics.errors += 1
+        metrics.latency.observe(elapsed)
+        metrics.fanout.observe(fanout)
+        metrics.db_calls.observe(db_calls)
+
+    def register_gauge(self, name: str, func: Callable[[], float]):
+        """注册瞬时值指标"""
+        self.gauges[name] = func
+
+    def _collect_gauges(self) -> Dict[str, float]:
+        values = {}
+        for name, func in self.gauges.items():
+            try:
+                values[name] = float(func())
+            except Exception:
+                continue
+        return values
+
+    def snapshot(self) -> Dict[str, Any]:
+        """获取指标快照（供 /system/metrics 返回）"""
+        return {
+            "endpoints": {
+                endpoint: {
+                    "requests": metrics.requests,
+                    "errors": metrics.errors,
+                    "latency": metrics.latency.snapshot(),
+                    "fanout": metrics.fanout.snapshot(),
+                    "db_calls": metrics.db_calls.snapshot()
+                } for endpoint, metrics in self.endpoints.items()
+            },
+            "gauges": self._collect_gauges()
+        }
+
+    def render_prometheus(self) -> str:
+        """以 Prometheus 文本格式导出"""
+        lines: List[str] = [
+            "# HELP im_requests_total Requests handled per endpoint.",
+            "# TYPE im_requests_total counter"
+        ]
+        for endpoint, metrics in self.endpoints.items():
+            lines.append(f'im_requests_total{{endpoint="{endpoint}"}} {metrics.requests}')
+        lines += ["# HELP im_request_errors_total Failed requests per endpoint.",
+                  "# TYPE im_request_errors_total counter"]
+        for endpoint, metrics in self.endpoints.items():
+            lines.append(f'im_request_errors_total{{endpoint="{endpoint}"}} {metrics.errors}')
+
+        for name, attr, help_text in (
+                ("im_request_duration_seconds", "latency", "Request handling latency."),
+                ("im_request_fanout", "fanout", "Recipients pushed to per request."),
+                ("im_request_db_calls", "db_calls", "Database commands issued per request.")):
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+            for endpoint, metrics in self.endpoints.items():
+                self._render_histogram(lines, name, endpoint, getattr(metrics, attr))
+
+        for name, value in self._collect_gauges().items():
+            lines += [f"# TYPE {name} gauge", f"{name} {value}"]
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _render_histogram(lines: List[str], name: str, endpoint: str, histogram: Histogram):
+        cumulative = 0
+        for bound, count in zip(list(histogram.bounds) + ["+Inf"], histogram.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{endpoint="{endpoint}",le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_sum{{endpoint="{endpoint}"}} {histogram.sum}')
+        lines.append(f'{name}_count{{endpoint="{endpoint}"}} {histogram.count}')
+
+
+async def start_metrics_server(registry: MetricsRegistry, host: str = "0.0.0.0",
+                               port: int = 9100) -> asyncio.AbstractServer:
+    """在独立端口上提供 GET /metrics（Prometheus 文本格式）"""
+    logger = logging.getLogger("MetricsRegistry")
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = await reader.readline()
+            # 丢弃请求头
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            parts = request_line.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+                status, body = "200 OK", registry.render_prometheus().encode()
+            else:
+                status, body = "404 Not Found", b"not found\n"
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except Exception as e:
+            logger.error(f"指标请求处理失败: {e}")
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    logger.info(f"指标导出: http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,79 @@
+# MongoMonitor.py
+import logging
+from collections import defaultdict
+from typing import Any, Dict, Optional, Tuple
+
+from pymongo import monitoring
+
+from context import _request_ctx_var
+
+
+class MongoCommandMonitor(monitoring.CommandListener):
+    """Mongo 命令监听器
+
+    所有管理器的 AsyncMongoClient 共用同一个实例（event_listeners）。命令开始时在当前请求上下文中
+    累加 db_calls，按 endpoint 统计命令数；耗时超过 slow_threshold 秒的命令连同所属请求记录为慢查询。
+    异步驱动在发起命令的协程内同步回调 started，因此可以直接读取请求上下文。
+    """
+
+    def __init__(self, slow_threshold: float = 0.1, max_pending: int = 10000):
+        self.logger = logging.getLogger("MongoMonitor")
+        self.slow_threshold = slow_threshold
+        self.max_pending = max_pending
+        # (驱动 request_id, 连接地址) -> (请求 ID, endpoint)，命令结束时取出
+        self.pending: Dict[Tuple[int, Any], Tuple[Optional[str], Optional[str]]] = {}
+        # endpoint -> 命令数（请求外的命令记为 None）
+        self.calls_by_endpoint: Dict[Optional[str], int] = defaultdict(int)
+        # 命令名 -> 命令数
+        self.calls_by_command: Dict[str, int] = defaultdict(int)
+        self.total_calls = 0
+        self.failed_calls = 0
+        self.slow_queries = 0
+
+    def started(self, event: monitoring.CommandStartedEvent):
+        ctx = _request_ctx_var.get()
+        if ctx is not None:
+            ctx.db_calls += 1
+            request_id, endpoint = ctx.request_id, ctx.request_data.get("endpoint")
+        else:
+            request_id = endpoint = None
+
+        self.total_calls += 1
+        self.calls_by_endpoint[endpoint] += 1
+        self.calls_by_command[event.command_name] += 1
+        # 只有慢查询日志需要在结束时知道所属请求
+        if len(self.pending) < self.max_pending:
+            self.pending[(event.request_id, event.connection_id)] = (request_id, endpoint)
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent):
+        self._finish(event)
+
+    def failed(self, event: monitoring.CommandFailedEvent):
+        self.failed_calls += 1
+        request_id, endpoint = self._finish(event)
+        self.logger.error(f"Mongo 命令失败 {event.database_name}.{event.command_name} "
+                          f"(endpoint={endpoint}, request_id={request_id}): {event.failure}")
+
+    def _finish(self, event) -> Tuple[Optional[str], Optional[str]]:
+        request_id, endpoint = self.pending.pop((event.request_id, event.connection_id), (None, None))
+        elapsed = event.duration_micros / 1e6
+        if self.slow_threshold and elapsed >= self.slow_threshold:
+            self.slow_queries += 1
+            self.logger.warning(f"慢查询 {event.database_name}.{event.command_name}: {elapsed * 1000:.1f}ms "
+                                f"(endpoint={endpoint}, request_id={request_id})")
+        return request_id, endpoint
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取命令统计"""
+        return {
+            "total_calls": self.total_calls,
+            "failed": self.failed_calls,
+            "slow_queries": self.slow_queries,
+            "slow_threshold": self.slow_threshold,
+            "by_command": dict(self.calls_by_command),
+            "by_endpoint": {str(endpoint): count for endpoint, count in self.calls_by_endpoint.items()}
+        }
+
+
+# 进程内共享的监听器
+mongo_monitor = MongoCommandMonitor()
@@ -1,11 +1,13 @@
 # OfflineMessageStore.py
 import asyncio
 import datetime
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional
 import logging
 from pymongo import AsyncMongoClient
 import uuid
 import config
+from MongoMonitor import mongo_monitor
+from frames import Frame, unwrap
 
 uri = config.Config.mongo_uri
 
@@ -15,7 +17,7 @@ class OfflineMessageStore:
 
     def __init__(self):
         self.logger = logging.getLogger('OfflineMessageStore')
-        self.dbclient = AsyncMongoClient(uri)
+        self.dbclient = AsyncMongoClient(uri, event_listeners=[mongo_monitor])
         self.db = self.dbclient["IM"]["offline_messages"]
 
         # 创建索引
@@ -30,13 +32,16 @@ class OfflineMessageStore:
         try:
             await self.db.create_index("user_id")
             await self.db.create_index([("user_id", 1), ("timestamp", -1)])
+            # 断线重连时按消息ID定位续传位置
+            await self.db.create_index([("user_id", 1), ("message.data.message_id", 1)])
             self.logger.debug("离线消息存储索引创建完成")
         except Exception as e:
             self.logger.error(f"创建索引失败: {e}")
 
-    async def add_offline_message(self, user_id: int, message: Dict[str, Any]):
+    async def add_offline_message(self, user_id: int, message: Frame):
         """添加离线消息"""
         try:
+            message = unwrap(message)
             message_record = {
                 "message_id": str(uuid.uuid4()),
                 "user_id": user_id,
@@ -50,6 +55,27 @@ class OfflineMessageStore:
         except Exception as e:
             self.logger.error(f"添加离线消息失败: {e}")
 
+    async def add_offline_messages(self, user_ids: List[int], message: Frame):
+        """为多个用户添加同一条离线消息（一次写入，所有记录共享同一个消息对象）"""
+        if not user_ids:
+            return
+        try:
+            message = unwrap(message)
+            timestamp = message.get("data", {}).get("timestamp", 0)
+            created_at = datetime.datetime.now()
+            records = [{
+                "message_id": str(uuid.uuid4()),
+                "user_id": user_id,
+                "message": message,
+                "timestamp": timestamp,
+                "created_at": created_at
+            } for user_id in user_ids]
+
+            await self.db.insert_many(records, ordered=False)
+            self.logger.debug(f"为 {len(user_ids)} 个用户添加离线消息")
+        except Exception as e:
+            self.logger.error(f"批量添加离线消息失败: {e}")
+
     async def get_offline_messages(self, user_id: int) -> List[Dict[str, Any]]:
         """获取用户的离线消息"""
         try:
@@ -66,6 +92,35 @@ class OfflineMessageStore:
             self.logger.error(f"获取离线消息失败: {e}")
             return []
 
+    async def get_offline_messages_after(self, user_id: int, last_msg_id: Optional[str] = None,
+                                         limit: int = 500) -> List[Dict[str, Any]]:
+        """获取 last_msg_id 之后的离线消息记录（包含 _id，按时间顺序）
+
+        客户端已收到的记录（last_msg_id 及其之前）会被直接删除。
+        """
+        try:
+            if last_msg_id:
+                anchor = await self.db.find_one({"user_id": user_id, "message.data.message_id": last_msg_id},
+                                                {"timestamp": 1})
+                if anchor:
+                    delivered = {"$or": [{"timestamp": {"$lt": anchor["timestamp"]}},
+                                         {"timestamp": anchor["timestamp"], "_id": {"$lte": anchor["_id"]}}]}
+                    await self.db.delete_many({"user_id": user_id, **delivered})
+            cursor = self.db.find({"user_id": user_id}).sort([("timestamp", 1), ("_id", 1)]).limit(limit)
+            return await cursor.to_list(length=limit)
+        except Exception as e:
+            self.logger.error(f"获取离线消息失败: {e}")
+            return []
+
+    async def delete_offline_records(self, user_id: int, record_ids: List[Any]):
+        """删除已推送的离线消息记录"""
+        if not record_ids:
+            return
+        try:
+            await self.db.delete_many({"user_id": user_id, "_id": {"$in": record_ids}})
+        except Exception as e:
+            self.logger.error(f"删除离线消息失败: {e}")
+
     async def clear_offline_messages(self, user_id: int):
         """清空用户的离线消息"""
         try:
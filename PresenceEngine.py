@@ -0,0 +1,317 @@
+# PresenceEngine.py
+import asyncio
+import datetime
+import logging
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Any, Set, Tuple
+
+from pymongo import UpdateOne
+
+from TimerWheel import TimerWheel
+from clock import coarse_clock
+from enums import UserStatus
+from frames import EncodedFrame
+
+
+class PresenceEngine:
+    """在线状态变更引擎
+
+    上线/离线事件先记入待发布表，由周期任务统一发布：
+    - 去抖：离线事件延迟 offline_grace 秒生效，期间重新上线则两次变更相互抵消；
+      最终状态与上次发布的状态相同时不发布
+    - 合并：同一周期内发给同一接收者的多条变更合并为一个 /presence/digest
+    - 并发扇出：所有接收者的推送并发进行
+
+    接收者由内存中的关注索引（被关注用户 -> 订阅连接）决定，索引来自登录时的联系人列表
+    和 /presence/subscribe 的显式订阅，连接断开时自动清理；发布过程不读数据库。
+    索引只覆盖本节点的连接。
+
+    状态表（状态、自定义状态、last_seen）保存在内存中，带有效期的自定义状态由时间轮到期恢复，
+    变更只标记为脏数据，每隔 persist_interval 秒批量写回用户集合；离线用户的表项写回后即释放。
+    """
+
+    # 单次 /presence/subscribe 最多订阅的用户数
+    MAX_SUBSCRIBE_BATCH = 200
+    # 自定义状态的最大长度（会写回用户集合并推送给所有订阅者）
+    MAX_CUSTOM_STATUS_LENGTH = 64
+
+    def __init__(self, server, flush_interval: float = 1.0, offline_grace: float = 5.0,
+                 persist_interval: float = 30.0):
+        self.logger = logging.getLogger("PresenceEngine")
+        self.server = server
+        self.flush_interval = flush_interval
+        self.offline_grace = offline_grace
+        self.persist_interval = persist_interval
+        # user_id -> (状态, 生效时刻, last_seen)
+        self.pending: Dict[int, Tuple[UserStatus, float, int]] = {}
+        # 状态表：user_id -> 最近一次发布的状态（未记录即离线）
+        self.published: Dict[int, UserStatus] = {}
+        # user_id -> 自定义状态文字
+        self.custom_status: Dict[int, str] = {}
+        # user_id -> 最近一次状态变化的时间戳
+        self.last_seen: Dict[int, int] = {}
+        # 自定义状态有效期（user_id -> 到期时刻）
+        self.expiry_wheel = TimerWheel(tick=1.0)
+        # 待写回数据库的 user_id
+        self.dirty: Set[int] = set()
+        self._last_persist = coarse_clock.now
+        # user_id -> (username, nickname)，登录时记录，用于生成通知内容
+        self.profiles: Dict[int, Tuple[str, str]] = {}
+        # user_id -> 联系人ID，登录时记录，重连时无需再查询数据库
+        self.contacts: Dict[int, Tuple[int, ...]] = {}
+        # 关注索引：被关注的 user_id -> {订阅者 connection_id}
+        self.subscribers: Dict[int, Set[str]] = {}
+        # 反向索引：connection_id -> {被关注的 user_id}，用于断开时清理
+        self.subscriptions: Dict[str, Set[int]] = {}
+        self.task: Optional[asyncio.Task] = None
+        self.suppressed = 0
+        self.changes_published = 0
+        self.pushes_sent = 0
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        await self.persist()
+
+    def subscribe(self, connection_id: str, user_ids: Iterable[int]):
+        """连接订阅一组用户的状态变更"""
+        watched = self.subscriptions.get(connection_id)
+        if watched is None:
+            watched = self.subscriptions[connection_id] = set()
+        for user_id in user_ids:
+            if user_id in watched:
+                continue
+            watched.add(user_id)
+            subscribers = self.subscribers.get(user_id)
+            if subscribers is None:
+                self.subscribers[user_id] = {connection_id}
+            else:
+                subscribers.add(connection_id)
+
+    def subscribe_contacts(self, connection_id: str, user_id: int, contact_ids: Iterable[int]):
+        """连接订阅用户的联系人，并记录联系人列表"""
+        contact_ids = self.contacts[user_id] = tuple(contact_ids)
+        self.subscribe(connection_id, contact_ids)
+
+    def get_contacts(self, user_id: int) -> Optional[Tuple[int, ...]]:
+        """获取已记录的联系人列表（用户离线发布后不再保留）"""
+        return self.contacts.get(user_id)
+
+    def unsubscribe_connection(self, connection_id: str):
+        """移除连接的全部订阅"""
+        for user_id in self.subscriptions.pop(connection_id, ()):
+            subscribers = self.subscribers.get(user_id)
+            if subscribers is None:
+                continue
+            subscribers.discard(connection_id)
+            if not subscribers:
+                del self.subscribers[user_id]
+
+    def get_status(self, user_id: int) -> UserStatus:
+        """获取已发布的用户状态"""
+        return self.published.get(user_id, UserStatus.OFFLINE)
+
+    def get_presence(self, user_id: int) -> Dict[str, Any]:
+        """获取用户的状态信息"""
+        return {
+            "user_id": user_id,
+            "status": self.get_status(user_id).value,
+            "custom_status": self.custom_status.get(user_id, ""),
+            "last_seen": self.last_seen.get(user_id, 0)
+        }
+
+    def set_status(self, user_id: int, status: UserStatus, custom_status: str = "",
+                   expires_in: int = 0):
+        """用户主动设置状态，expires_in 秒后恢复为在线（0 表示不过期）；自定义状态不合法时抛出 ValueError"""
+        if not isinstance(custom_status, str) or len(custom_status) > self.MAX_CUSTOM_STATUS_LENGTH:
+            raise ValueError(f"自定义状态必须是不超过 {self.MAX_CUSTOM_STATUS_LENGTH} 个字符的字符串")
+        if custom_status:
+            self.custom_status[user_id] = custom_status
+        else:
+            self.custom_status.pop(user_id, None)
+        if expires_in > 0:
+            self.expiry_wheel.schedule(user_id, coarse_clock.now + expires_in)
+        else:
+            self.expiry_wheel.cancel(user_id)
+        # 主动设置的状态立即发布，即使状态值未变（自定义状态可能变化）
+        self._mark(user_id, status, coarse_clock.now, force=True)
+
+    def expire_statuses(self, now: Optional[float] = None):
+        """把已过期的自定义状态恢复为在线"""
+        now = coarse_clock.now if now is None else now
+        for user_id in self.expiry_wheel.advance(now):
+            self.custom_status.pop(user_id, None)
+            pending = self.pending.get(user_id)
+            status = pending[0] if pending is not None else self.published.get(user_id, UserStatus.OFFLINE)
+            if status == UserStatus.OFFLINE:
+                # 已离线，只清理自定义状态
+                self.dirty.add(user_id)
+                continue
+            self._mark(user_id, UserStatus.ONLINE, now, force=True)
+
+    def mark_online(self, user_id: int, username: str = "", nickname: str = ""):
+        """记录用户上线，下一个周期发布"""
+        if username or nickname:
+            self.profiles[user_id] = (username, nickname)
+        if user_id in self.published:
+            # 已在线（包括离开、忙碌等状态），只抵消宽限期内尚未发布的离线
+            pending = self.pending.get(user_id)
+            if pending is not None and pending[0] == UserStatus.OFFLINE:
+                del self.pending[user_id]
+                self.suppressed += 1
+            return
+        self._mark(user_id, UserStatus.ONLINE, coarse_clock.now)
+
+    def mark_offline(self, user_id: int):
+        """记录用户离线，宽限期后发布"""
+        self._mark(user_id, UserStatus.OFFLINE, coarse_clock.now + self.offline_grace)
+
+    def _mark(self, user_id: int, status: UserStatus, due: float, force: bool = False):
+        if not force and self.published.get(user_id, UserStatus.OFFLINE) == status:
+            # 与已发布状态一致（例如宽限期内重连），抵消尚未发布的变更
+            if self.pending.pop(user_id, None) is not None:
+                self.suppressed += 1
+            return
+        self.pending[user_id] = (status, due, int(datetime.datetime.now().timestamp()))
+
+    async def run(self):
+        """周期发布任务"""
+        while True:
+            try:
+                await asyncio.sleep(self.flush_interval)
+                await self.flush()
+                if coarse_clock.now - self._last_persist >= self.persist_interval:
+                    self._last_persist = coarse_clock.now
+                    await self.persist()
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                self.logger.error(f"发布在线状态失败: {e}")
+
+    def collect_due(self, now: Optional[float] = None) -> List[Tuple[int, UserStatus, int]]:
+        """取出已到生效时刻的变更，并记为已发布"""
+        now = coarse_clock.now if now is None else now
+        due = [(user_id, status, last_seen) for user_id, (status, deadline, last_seen) in self.pending.items()
+               if deadline <= now]
+        for user_id, status, last_seen in due:
+            del self.pending[user_id]
+            if status == UserStatus.OFFLINE:
+                self.published.pop(user_id, None)
+            else:
+                self.published[user_id] = status
+            self.last_seen[user_id] = last_seen
+            self.dirty.add(user_id)
+        return due
+
+    async def flush(self, now: Optional[float] = None):
+        """发布一个周期内到期的状态变更"""
+        self.expire_statuses(now)
+        profiles = self.profiles
+        due = []
+        for user_id, status, last_seen in self.collect_due(now):
+            # 离线发布后不再需要资料
+            if status == UserStatus.OFFLINE:
+                profile = profiles.pop(user_id, ("", ""))
+                self.contacts.pop(user_id, None)
+            else:
+                profile = profiles.get(user_id, ("", ""))
+            due.append((user_id, status, last_seen, profile))
+        if not due:
+            return
+
+        # 订阅连接 -> 变更列表
+        digests: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        # 只有一条变更的接收者共享同一个已编码帧
+        single_frames: Dict[int, EncodedFrame] = {}
+        timestamp = int(datetime.datetime.now().timestamp())
+        for user_id, status, last_seen, (username, nickname) in due:
+            subscribers = self.subscribers.get(user_id)
+            if not subscribers:
+                continue
+            change = {
+                "user_id": user_id,
+                "username": username,
+                "nickname": nickname,
+                "status": status.value,
+                "custom_status": self.custom_status.get(user_id, ""),
+                "last_seen": last_seen,
+                "timestamp": timestamp
+            }
+            single_frames[user_id] = EncodedFrame({"endpoint": "/presence/change", "data": change})
+            for connection_id in subscribers:
+                digests[connection_id].append(change)
+        self.changes_published += len(due)
+
+        get_connection = self.server.connection_manager.get_connection_by_id
+        pushes = []
+        for connection_id, changes in digests.items():
+            connection = get_connection(connection_id)
+            if connection is None:
+                continue
+            if len(changes) == 1:
+                message = single_frames[changes[0]["user_id"]]
+            else:
+                message = {
+                    "endpoint": "/presence/digest",
+                    "data": {
+                        "changes": changes,
+                        "count": len(changes),
+                        "timestamp": timestamp
+                    }
+                }
+            pushes.append(self.server.send_to_connection(connection, message))
+
+        results = await asyncio.gather(*pushes, return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                self.logger.error(f"推送在线状态失败: {result}")
+            elif result:
+                self.pushes_sent += 1
+
+    async def persist(self):
+        """把脏的状态表项批量写回用户集合"""
+        if not self.dirty:
+            return
+        dirty, self.dirty = self.dirty, set()
+        operations = [UpdateOne({"user_id": user_id}, {"$set": {
+            "status": self.get_status(user_id).value,
+            "custom_status": self.custom_status.get(user_id, ""),
+            "last_seen": self.last_seen.get(user_id, 0)
+        }}) for user_id in dirty]
+        try:
+            await self.server.user_manager.db.bulk_write(operations, ordered=False)
+        except Exception as e:
+            # 写回失败的项留到下一次
+            self.dirty |= dirty
+            self.logger.error(f"写回在线状态失败: {e}")
+            return
+
+        # 已写回的离线用户不再保留自定义状态和 last_seen（与资料、联系人一样离线后释放）
+        for user_id in dirty:
+            if user_id not in self.published and user_id not in self.pending:
+                self.custom_status.pop(user_id, None)
+                self.last_seen.pop(user_id, None)
+                self.expiry_wheel.cancel(user_id)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取在线状态发布统计"""
+        return {
+            "pending": len(self.pending),
+            "online_users": len(self.published),
+            "custom_statuses": len(self.custom_status),
+            "dirty": len(self.dirty),
+            "watched_users": len(self.subscribers),
+            "subscribed_connections": len(self.subscriptions),
+            "suppressed": self.suppressed,
+            "changes_published": self.changes_published,
+            "pushes_sent": self.pushes_sent
+        }
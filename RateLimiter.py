@@ -0,0 +1,61 @@
+# RateLimiter.py
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional
+
+from clock import coarse_clock
+
+
+class RateLimiter:
+    """令牌桶限流器
+
+    每个 key（连接或用户 + endpoint）一个令牌桶，容量为 rate，每 period 秒补满。
+    桶按最近使用排序，闲置超过 period 的桶（已补满，等价于新桶）会被淘汰，
+    总数不超过 max_buckets；每次判断都是 O(1)。
+    """
+
+    def __init__(self, period: float = 60.0, max_buckets: int = 100000):
+        self.period = period
+        self.max_buckets = max_buckets
+        # key -> [剩余令牌, 上次更新时刻]
+        self.buckets: "OrderedDict[Hashable, List[float]]" = OrderedDict()
+        self.allowed = 0
+        self.rejected = 0
+
+    def allow(self, key: Hashable, rate: float, now: Optional[float] = None) -> bool:
+        """消耗一个令牌，令牌不足时返回 False"""
+        now = coarse_clock.now if now is None else now
+        buckets = self.buckets
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = [rate, now]
+            self._evict(now)
+        else:
+            buckets.move_to_end(key)
+            tokens = bucket[0] + (now - bucket[1]) * rate / self.period
+            bucket[0] = tokens if tokens < rate else rate
+            bucket[1] = now
+
+        if bucket[0] < 1:
+            self.rejected += 1
+            return False
+        bucket[0] -= 1
+        self.allowed += 1
+        return True
+
+    def _evict(self, now: float):
+        """淘汰闲置的桶，超过容量时淘汰最久未使用的桶"""
+        buckets = self.buckets
+        idle_before = now - self.period
+        while buckets:
+            key, bucket = next(iter(buckets.items()))
+            if bucket[1] > idle_before and len(buckets) <= self.max_buckets:
+                break
+            del buckets[key]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取限流统计"""
+        return {
+            "buckets": len(self.buckets),
+            "allowed": self.allowed,
+            "rejected": self.rejected
+        }
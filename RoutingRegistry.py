@@ -0,0 +1,374 @@
+# RoutingRegistry.py
+import abc
+import asyncio
+import json
+import logging
+from typing import Any, Dict, List, Set, FrozenSet, Callable, Awaitable, Iterable, Optional
+
+from frames import Frame, encode
+
+# 节点收到转发消息时的回调: (user_id, message) -> None
+ForwardCallback = Callable[[int, Frame], Awaitable[None]]
+# 节点收到其他节点广播事件时的回调: (event) -> None
+EventCallback = Callable[[Dict[str, Any]], Awaitable[None]]
+# 返回本节点当前在线用户的函数（路由被其他节点清理后用于重新登记）
+LocalUsersProvider = Callable[[], Iterable[int]]
+
+
+class RoutingRegistry(abc.ABC):
+    """跨节点路由注册表接口（user_id -> node_id）
+
+    每个服务器实例（节点）在用户认证时登记 user_id 所在节点，
+    用户在本节点完全下线时注销；其他节点据此把消息转发到目标节点实时投递。
+    """
+
+    @abc.abstractmethod
+    async def register(self, user_id: int, node_id: str):
+        """登记用户所在节点"""
+
+    @abc.abstractmethod
+    async def unregister(self, user_id: int, node_id: str):
+        """注销用户在某节点的路由"""
+
+    @abc.abstractmethod
+    async def get_nodes(self, user_id: int) -> Set[str]:
+        """获取用户当前所在的所有节点"""
+
+    async def get_nodes_batch(self, user_ids: Iterable[int]) -> Dict[int, Set[str]]:
+        """批量获取用户所在的节点，不在线的用户不出现在结果中（默认逐个查询，实现可以合并为一次往返）"""
+        located = {}
+        for user_id in user_ids:
+            nodes = await self.get_nodes(user_id)
+            if nodes:
+                located[user_id] = nodes
+        return located
+
+    async def get_online_users(self, user_ids: Iterable[int]) -> Set[int]:
+        """批量获取在任意节点在线的用户"""
+        return set(await self.get_nodes_batch(user_ids))
+
+    @abc.abstractmethod
+    async def forward(self, node_id: str, user_id: int, message: Frame) -> bool:
+        """把消息转发到指定节点，由该节点推送给本地连接"""
+
+    async def forward_many(self, node_id: str, user_ids: List[int], message: Frame) -> bool:
+        """把同一条消息转发给指定节点上的多个用户（默认逐个转发，实现可以合并为一次发布）"""
+        success = False
+        for user_id in user_ids:
+            if await self.forward(node_id, user_id, message):
+                success = True
+        return success
+
+    @abc.abstractmethod
+    async def subscribe(self, node_id: str, callback: ForwardCallback):
+        """订阅发往本节点的转发消息"""
+
+    async def broadcast(self, node_id: str, event: Dict[str, Any]):
+        """向除 node_id 以外的所有节点广播事件（如缓存失效），单节点部署时无需实现"""
+
+    async def subscribe_events(self, node_id: str, callback: EventCallback):
+        """订阅其他节点广播的事件"""
+
+    async def start(self, node_id: str, local_users: Optional[LocalUsersProvider] = None):
+        """节点启动时调用（如开始定期续期本节点的存活标记）"""
+
+    async def close(self):
+        """释放资源"""
+
+
+class InMemoryRoutingRegistry(RoutingRegistry):
+    """进程内路由注册表（默认实现）
+
+    单实例部署时等价于本地映射；同一进程内的多个服务器实例共享同一个注册表对象时，
+    也可以相互转发消息。
+    """
+
+    def __init__(self):
+        self.logger = logging.getLogger("InMemoryRoutingRegistry")
+        # user_id -> frozenset{node_id}；绝大多数用户只在一个节点，单节点集合在用户间共享
+        self.routes: Dict[int, FrozenSet[str]] = {}
+        self._single_node: Dict[str, FrozenSet[str]] = {}
+        # node_id -> 转发回调
+        self.subscribers: Dict[str, ForwardCallback] = {}
+        # node_id -> 广播事件回调
+        self.event_subscribers: Dict[str, EventCallback] = {}
+
+    def _nodes_of(self, nodes: Set[str]) -> FrozenSet[str]:
+        if len(nodes) == 1:
+            node_id = next(iter(nodes))
+            shared = self._single_node.get(node_id)
+            if shared is None:
+                shared = self._single_node[node_id] = frozenset(nodes)
+            return shared
+        return frozenset(nodes)
+
+    async def register(self, user_id: int, node_id: str):
+        nodes = self.routes.get(user_id)
+        if nodes is None:
+            self.routes[user_id] = self._nodes_of({node_id})
+        elif node_id not in nodes:
+            self.routes[user_id] = self._nodes_of(nodes | {node_id})
+
+    async def unregister(self, user_id: int, node_id: str):
+        nodes = self.routes.get(user_id)
+        if not nodes or node_id not in nodes:
+            return
+        remaining = nodes - {node_id}
+        if remaining:
+            self.routes[user_id] = self._nodes_of(remaining)
+        else:
+            del self.routes[user_id]
+
+    async def get_nodes(self, user_id: int) -> Set[str]:
+        return set(self.routes.get(user_id, ()))
+
+    async def get_nodes_batch(self, user_ids: Iterable[int]) -> Dict[int, Set[str]]:
+        routes = self.routes
+        return {user_id: set(routes[user_id]) for user_id in user_ids if user_id in routes}
+
+    async def get_online_users(self, user_ids: Iterable[int]) -> Set[int]:
+        routes = self.routes
+        return {user_id for user_id in user_ids if user_id in routes}
+
+    async def forward(self, node_id: str, user_id: int, message: Frame) -> bool:
+        callback = self.subscribers.get(node_id)
+        if callback is None:
+            return False
+        await callback(user_id, message)
+        return True
+
+    async def subscribe(self, node_id: str, callback: ForwardCallback):
+        self.subscribers[node_id] = callback
+
+    async def broadcast(self, node_id: str, event: Dict[str, Any]):
+        for subscriber_id, callback in list(self.event_subscribers.items()):
+            if subscriber_id != node_id:
+                await callback(event)
+
+    async def subscribe_events(self, node_id: str, callback: EventCallback):
+        self.event_subscribers[node_id] = callback
+
+    async def close(self):
+        self.subscribers.clear()
+        self.event_subscribers.clear()
+
+
+class RedisRoutingRegistry(RoutingRegistry):
+    """基于 Redis 的路由注册表
+
+    只依赖 redis.asyncio 客户端的一小部分接口（sadd/srem/smembers/set/mget/delete/publish/pubsub/pipeline），
+    因此测试时可以用实现了相同方法的本地替身对象代替真实的 Redis。
+
+    每个节点用带 TTL 的存活标记（每 node_ttl/3 秒续期）表明自己在线，并在 node_users 集合中记录本节点登记的用户。
+    续期时发现存活标记已过期的节点（进程崩溃、未正常注销路由），查询时先排除，再由发现的节点清理其全部路由。
+    仍在运行的节点错过续期（GC 停顿、Redis 变慢）时，下次续期发现自己的存活标记已过期或已被清理，
+    会重新登记本节点在线用户的路由。
+    """
+
+    def __init__(self, client, key_prefix: str = "im:route:", channel_prefix: str = "im:node:",
+                 node_prefix: str = "im:nodes:", node_ttl: int = 30, broadcast_channel: str = "im:broadcast"):
+        self.logger = logging.getLogger("RedisRoutingRegistry")
+        self.client = client
+        self.key_prefix = key_prefix
+        self.channel_prefix = channel_prefix
+        self.node_prefix = node_prefix
+        self.node_ttl = node_ttl
+        self.broadcast_channel = broadcast_channel
+        self.node_id: Optional[str] = None
+        self._local_users: Optional[LocalUsersProvider] = None
+        # 最近一次续期时发现的失效节点
+        self.dead_nodes: Set[str] = set()
+        self._pubsub = None
+        self._listen_task: Optional[asyncio.Task] = None
+        # 频道 -> 消息处理函数（转发频道和广播频道共用一个 pubsub 连接）
+        self._handlers: Dict[str, Callable[[Dict[str, Any]], Awaitable[None]]] = {}
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    def _route_key(self, user_id: int) -> str:
+        return f"{self.key_prefix}{user_id}"
+
+    def _channel(self, node_id: str) -> str:
+        return f"{self.channel_prefix}{node_id}"
+
+    def _alive_key(self, node_id: str) -> str:
+        return f"{self.node_prefix}alive:{node_id}"
+
+    def _node_users_key(self, node_id: str) -> str:
+        return f"{self.node_prefix}users:{node_id}"
+
+    @property
+    def _nodes_key(self) -> str:
+        return f"{self.node_prefix}all"
+
+    @staticmethod
+    def _decode(value) -> str:
+        return value.decode() if isinstance(value, bytes) else value
+
+    async def register(self, user_id: int, node_id: str):
+        pipe = self.client.pipeline(transaction=False)
+        pipe.sadd(self._route_key(user_id), node_id)
+        pipe.sadd(self._node_users_key(node_id), user_id)
+        await pipe.execute()
+
+    async def unregister(self, user_id: int, node_id: str):
+        pipe = self.client.pipeline(transaction=False)
+        pipe.srem(self._route_key(user_id), node_id)
+        pipe.srem(self._node_users_key(node_id), user_id)
+        await pipe.execute()
+
+    async def get_nodes(self, user_id: int) -> Set[str]:
+        members = await self.client.smembers(self._route_key(user_id))
+        return {self._decode(m) for m in members} - self.dead_nodes
+
+    async def get_nodes_batch(self, user_ids: Iterable[int]) -> Dict[int, Set[str]]:
+        user_ids = list(user_ids)
+        if not user_ids:
+            return {}
+        # 一次往返查询所有用户的路由
+        pipe = self.client.pipeline(transaction=False)
+        for user_id in user_ids:
+            pipe.smembers(self._route_key(user_id))
+        results = await pipe.execute()
+        dead_nodes = self.dead_nodes
+        located = {}
+        for user_id, members in zip(user_ids, results):
+            nodes = {self._decode(m) for m in members} - dead_nodes
+            if nodes:
+                located[user_id] = nodes
+        return located
+
+    async def start(self, node_id: str, local_users: Optional[LocalUsersProvider] = None):
+        """登记本节点并开始定期续期存活标记"""
+        self.node_id = node_id
+        self._local_users = local_users
+        await self.refresh()
+        self._refresh_task = asyncio.create_task(self._refresh_loop())
+
+    async def refresh(self):
+        """续期本节点的存活标记，找出并清理存活标记已过期的节点"""
+        node_id = self.node_id
+        members = {self._decode(n) for n in await self.client.smembers(self._nodes_key)}
+        nodes = list(members | {node_id})
+        flags = dict(zip(nodes, await self.client.mget([self._alive_key(n) for n in nodes])))
+
+        await self.client.set(self._alive_key(node_id), 1, ex=self.node_ttl)
+        await self.client.sadd(self._nodes_key, node_id)
+        if flags[node_id] is None or node_id not in members:
+            # 本节点的存活标记已过期，其他节点可能已清理本节点的路由
+            await self._restore_routes()
+
+        dead_nodes = {n for n, flag in flags.items() if flag is None and n != node_id}
+        self.dead_nodes = dead_nodes
+        for dead_node in dead_nodes:
+            await self._purge_node(dead_node)
+
+    async def _restore_routes(self):
+        """重新登记本节点在线用户的路由"""
+        if self._local_users is None:
+            return
+        users = list(self._local_users())
+        if not users:
+            return
+        pipe = self.client.pipeline(transaction=False)
+        for user_id in users:
+            pipe.sadd(self._route_key(user_id), self.node_id)
+        pipe.sadd(self._node_users_key(self.node_id), *users)
+        await pipe.execute()
+        self.logger.warning(f"节点 {self.node_id} 存活标记已过期，重新登记 {len(users)} 条路由")
+
+    async def _purge_node(self, node_id: str):
+        """清理失效节点登记的全部路由（多个节点同时清理是幂等的）"""
+        users = await self.client.smembers(self._node_users_key(node_id))
+        pipe = self.client.pipeline(transaction=False)
+        for user_id in users:
+            pipe.srem(self._route_key(self._decode(user_id)), node_id)
+        pipe.delete(self._node_users_key(node_id))
+        pipe.srem(self._nodes_key, node_id)
+        await pipe.execute()
+        self.logger.warning(f"节点 {node_id} 存活标记已过期，清理 {len(users)} 条路由")
+
+    async def _refresh_loop(self):
+        """定期续期存活标记"""
+        while True:
+            await asyncio.sleep(self.node_ttl / 3)
+            try:
+                await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.error(f"续期节点存活标记失败: {e}")
+
+    async def forward(self, node_id: str, user_id: int, message: Frame) -> bool:
+        # 复用已编码的消息帧
+        payload = '{"user_id": ' + json.dumps(user_id) + ', "message": ' + encode(message) + '}'
+        receivers = await self.client.publish(self._channel(node_id), payload)
+        return bool(receivers)
+
+    async def forward_many(self, node_id: str, user_ids: List[int], message: Frame) -> bool:
+        # 同一节点的多个接收者合并为一次发布
+        payload = '{"user_ids": ' + json.dumps(user_ids) + ', "message": ' + encode(message) + '}'
+        receivers = await self.client.publish(self._channel(node_id), payload)
+        return bool(receivers)
+
+    async def subscribe(self, node_id: str, callback: ForwardCallback):
+        async def handle(payload: Dict[str, Any]):
+            message = payload["message"]
+            user_ids = payload["user_ids"] if "user_ids" in payload else (payload["user_id"],)
+            for user_id in user_ids:
+                await callback(int(user_id), message)
+
+        await self._subscribe_channel(self._channel(node_id), handle)
+
+    async def broadcast(self, node_id: str, event: Dict[str, Any]):
+        await self.client.publish(self.broadcast_channel, json.dumps({"origin": node_id, "event": event}))
+
+    async def subscribe_events(self, node_id: str, callback: EventCallback):
+        async def handle(payload: Dict[str, Any]):
+            # 忽略本节点发出的广播
+            if payload.get("origin") != node_id:
+                await callback(payload["event"])
+
+        await self._subscribe_channel(self.broadcast_channel, handle)
+
+    async def _subscribe_channel(self, channel: str, handler: Callable[[Dict[str, Any]], Awaitable[None]]):
+        if self._pubsub is None:
+            self._pubsub = self.client.pubsub()
+        self._handlers[channel] = handler
+        await self._pubsub.subscribe(channel)
+        if self._listen_task is None:
+            self._listen_task = asyncio.create_task(self._listen())
+
+    async def _listen(self):
+        """监听转发频道和广播频道"""
+        async for item in self._pubsub.listen():
+            if item.get("type") != "message":
+                continue
+            handler = self._handlers.get(self._decode(item.get("channel")))
+            if handler is None:
+                continue
+            try:
+                await handler(json.loads(item["data"]))
+            except Exception as e:
+                self.logger.error(f"处理频道消息失败: {e}")
+
+    async def close(self):
+        if self._refresh_task:
+            self._refresh_task.cancel()
+            try:
+                await self._refresh_task
+            except asyncio.CancelledError:
+                pass
+        if self.node_id is not None:
+            # 正常退出时立即让其他节点把本节点视为失效并清理路由
+            try:
+                await self.client.delete(self._alive_key(self.node_id))
+            except Exception as e:
+                self.logger.error(f"删除节点存活标记失败: {e}")
+        if self._listen_task:
+            self._listen_task.cancel()
+            try:
+                await self._listen_task
+            except asyncio.CancelledError:
+                pass
+        if self._pubsub is not None:
+            await self._pubsub.close()
@@ -0,0 +1,75 @@
+# TimerWheel.py
+import math
+import time
+from typing import Dict, Hashable, List, Set, Callable
+
+
+class TimerWheel:
+    """哈希时间轮
+
+    按到期时间把 key 散列到固定数量的槽中，推进时只检查经过的槽，
+    每次推进的开销与到期 key 数量成正比，而不是与全部 key 数量成正比。
+    超过一圈的到期时间在经过对应槽时保留，等下一圈再检查。
+    """
+
+    def __init__(self, tick: float = 1.0, slots: int = 512,
+                 clock: Callable[[], float] = time.monotonic):
+        self.tick = tick
+        self.slots = slots
+        self.clock = clock
+        self._wheel: List[Set[Hashable]] = [set() for _ in range(slots)]
+        # key -> 到期 tick（槽位 = 到期 tick % slots）
+        self._timers: Dict[Hashable, int] = {}
+        # 最近一次推进到的 tick
+        self._current_tick = self._tick_of(clock())
+
+    def __len__(self) -> int:
+        return len(self._timers)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._timers
+
+    def _tick_of(self, moment: float) -> int:
+        return math.floor(moment / self.tick)
+
+    def schedule(self, key: Hashable, deadline: float):
+        """设置（或重设）key 的到期时间"""
+        self.cancel(key)
+        # 不早于下一个 tick，保证已推进过的槽不会漏掉
+        expire_tick = max(math.ceil(deadline / self.tick), self._current_tick + 1)
+        self._wheel[expire_tick % self.slots].add(key)
+        self._timers[key] = expire_tick
+
+    def cancel(self, key: Hashable):
+        """取消 key 的定时"""
+        expire_tick = self._timers.pop(key, None)
+        if expire_tick is not None:
+            self._wheel[expire_tick % self.slots].discard(key)
+
+    def deadline(self, key: Hashable) -> float:
+        """获取 key 的到期时间（按 tick 取整），不存在时返回 inf"""
+        expire_tick = self._timers.get(key)
+        return expire_tick * self.tick if expire_tick is not None else math.inf
+
+    def advance(self, now: float = None) -> List[Hashable]:
+        """推进时间轮到 now，返回已到期（并已移除）的 key"""
+        now = self.clock() if now is None else now
+        target_tick = self._tick_of(now)
+        if target_tick <= self._current_tick:
+            return []
+
+        expired = []
+        timers = self._timers
+        # 跨度超过一圈时每个槽只需检查一次
+        steps = min(target_tick - self._current_tick, self.slots)
+        for step in range(1, steps + 1):
+            bucket = self._wheel[(self._current_tick + step) % self.slots]
+            if not bucket:
+                continue
+            for key in [k for k in bucket if timers[k] <= target_tick]:
+                bucket.discard(key)
+                del timers[key]
+                expired.append(key)
+
+        self._current_tick = target_tick
+        return expired
@@ -0,0 +1,141 @@
+# TokenRevocationStore.py
+import asyncio
+import datetime
+import heapq
+import logging
+import time
+from typing import Dict, List, Tuple, Set, Optional
+
+from pymongo import AsyncMongoClient
+import config
+from MongoMonitor import mongo_monitor
+
+uri = config.Config.mongo_uri
+
+
+class TokenRevocationStore:
+    """Token吊销存储
+
+    每个 jti 只保留到对应 Token 的 exp，过期项通过最小堆按到期顺序淘汰，
+    内存占用只与"未过期的已吊销 Token"数量相关；成员检查为内存中 O(1) 的字典查找。
+    持久化需显式开启（persist=True，构造时即创建 Mongo 客户端），开启后写入 Mongo（TTL 索引自动清理），重启后加载，多进程之间定期同步。
+    created_at 由写入方的时钟打上，且写入可能晚于打戳时间才提交，因此增量同步会回看
+    sync_overlap 秒，重复读到的 jti 直接跳过。
+    """
+
+    def __init__(self, persist: bool = False, sync_overlap: float = 60.0):
+        self.logger = logging.getLogger("TokenRevocationStore")
+        # jti -> exp（秒级时间戳）
+        self._entries: Dict[str, int] = {}
+        # (exp, jti) 最小堆
+        self._heap: List[Tuple[int, str]] = []
+
+        self.persist = persist
+        self.dbclient: Optional[AsyncMongoClient] = None
+        self.db = None
+        if persist:
+            self.dbclient = AsyncMongoClient(uri, event_listeners=[mongo_monitor])
+            self.db = self.dbclient["IM"]["revoked_tokens"]
+
+        # 增量同步的回看窗口（秒），需覆盖进程间时钟偏差和写入提交延迟
+        self.sync_overlap = sync_overlap
+        # 上次从数据库同步的时间
+        self._last_sync: Optional[datetime.datetime] = None
+        # 持有后台写入任务的引用，避免被回收
+        self._pending_writes: Set[asyncio.Task] = set()
+
+    def __contains__(self, jti: Optional[str]) -> bool:
+        exp = self._entries.get(jti)
+        return exp is not None and exp > time.time()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    async def initialize(self):
+        if self.db is None:
+            return
+        try:
+            await self.db.create_index("jti", unique=True)
+            # Mongo 在 expires_at 到达后自动删除文档
+            await self.db.create_index("expires_at", expireAfterSeconds=0)
+            self.logger.debug("Token吊销存储索引创建完成")
+        except Exception as e:
+            self.logger.error(f"创建索引失败: {e}")
+        await self.sync()
+
+    def add(self, jti: str, exp: int):
+        """吊销 jti，保留到 exp"""
+        now = time.time()
+        self.purge_expired(now)
+        if exp <= now:
+            # 已过期的Token本身就无法通过验证，无需记录
+            return
+
+        self._remember(jti, exp)
+        if self.db is not None:
+            try:
+                task = asyncio.get_running_loop().create_task(self._persist(jti, exp))
+            except RuntimeError:
+                return
+            self._pending_writes.add(task)
+            task.add_done_callback(self._pending_writes.discard)
+
+    def _remember(self, jti: str, exp: int) -> bool:
+        """只写内存，返回是否为新记录"""
+        if self._entries.get(jti) == exp:
+            return False
+        self._entries[jti] = exp
+        heapq.heappush(self._heap, (exp, jti))
+        return True
+
+    def purge_expired(self, now: Optional[float] = None) -> int:
+        """淘汰已过期的吊销记录"""
+        now = time.time() if now is None else now
+        purged = 0
+        while self._heap and self._heap[0][0] <= now:
+            exp, jti = heapq.heappop(self._heap)
+            if self._entries.get(jti) == exp:
+                del self._entries[jti]
+                purged += 1
+        return purged
+
+    async def _persist(self, jti: str, exp: int):
+        """写入数据库"""
+        try:
+            await self.db.update_one(
+                {"jti": jti},
+                {"$set": {
+                    "jti": jti,
+                    "exp": exp,
+                    "expires_at": datetime.datetime.fromtimestamp(exp, datetime.timezone.utc),
+                    "created_at": datetime.datetime.now(datetime.timezone.utc)
+                }},
+                upsert=True
+            )
+        except Exception as e:
+            self.logger.error(f"持久化吊销记录失败: {e}")
+
+    async def sync(self):
+        """从数据库加载其他进程新增的吊销记录"""
+        if self.db is None:
+            return
+        try:
+            query = {"exp": {"$gt": int(time.time())}}
+            if self._last_sync is not None:
+                since = self._last_sync - datetime.timedelta(seconds=self.sync_overlap)
+                query["created_at"] = {"$gte": since}
+            sync_time = datetime.datetime.now(datetime.timezone.utc)
+
+            cursor = self.db.find(query, {"jti": 1, "exp": 1})
+            loaded = 0
+            async for doc in cursor:
+                # 回看窗口内已同步过的 jti 不重复入堆
+                if self._remember(doc["jti"], int(doc["exp"])):
+                    loaded += 1
+
+            self._last_sync = sync_time
+            self.purge_expired()
+            if loaded:
+                self.logger.debug(f"同步吊销记录 {loaded} 条")
+        except Exception as e:
+            self.logger.error(f"同步吊销记录失败: {e}")
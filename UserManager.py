@@ -1,9 +1,11 @@
 import hashlib
 from typing import Dict, Optional, List
 
+from CryptoExecutor import CryptoExecutor
 from models import User
 from pymongo import AsyncMongoClient
 import config
+from MongoMonitor import mongo_monitor
 
 uri = config.Config.mongo_uri
 
@@ -11,12 +13,14 @@ uri = config.Config.mongo_uri
 class UserManager:
     """用户管理"""
 
-    def __init__(self):
+    def __init__(self, executor: Optional[CryptoExecutor] = None):
+        # 密码哈希在线程池中执行，避免阻塞事件循环
+        self.executor = executor
         # 内存存储用户数据（生产环境用数据库）
         # self.users: Dict[int, User] = {}
         self.username_to_id: Dict[str, int] = {}
         # self._initialize_sample_users()
-        self.dbclient = AsyncMongoClient(uri)
+        self.dbclient = AsyncMongoClient(uri, event_listeners=[mongo_monitor])
         self.db = self.dbclient["IM"]["user"]
 
     def _initialize_sample_users(self):
@@ -74,16 +78,20 @@ class UserManager:
         # 这里使用简单的SHA256，生产环境请用bcrypt或argon2
         return hashlib.sha256((password + salt).encode()).hexdigest()
 
+    @classmethod
+    def _check_password(cls, stored_password: str, password: str, salt: str) -> bool:
+        """比较密码哈希（在线程池中执行）"""
+        return cls.hash_password(password, salt) == cls.hash_password(stored_password, salt)
+
     async def verify_password(self, user_id: int, password: str) -> bool:
         """验证密码"""
         res = await self.db.find_one({"user_id": user_id})
-        user = User(
-            user_id=user_id, password_hash=self.hash_password(res["password"], str(user_id)), )
-        if not user:
+        if not res:
             return False
 
-        password_hash = self.hash_password(password, str(user_id))
-        return password_hash == user.password_hash
+        if self.executor is None:
+            return self._check_password(res["password"], password, str(user_id))
+        return await self.executor.run(self._check_password, res["password"], password, str(user_id))
 
     async def get_user_by_username(self, username: str) -> Optional[User]:
         """根据用户名获取用户"""
@@ -96,8 +104,9 @@ class UserManager:
     async def get_user_by_id(self, user_id: int) -> Optional[User]:
         """根据ID获取用户"""
         res = await self.db.find_one({"user_id": user_id})
+        # 不在查询路径上计算密码哈希，密码校验统一走 verify_password
         return User(user_id=user_id, username=res.get("username", ""), nickname=res["nickname"],
-                    password_hash=self.hash_password(res["password"], str(user_id)), avatar=res["avatar"],
+                    avatar=res["avatar"],
                     department=res["department"], tags=res["tags"], contact_list=res["contacts"])
 
     async def get_user_contacts(self, user_id: int) -> List[User]:
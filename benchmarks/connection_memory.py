@@ -0,0 +1,99 @@
+"""
+连接注册表内存基准：对比旧版 ClientConnection / ConnectionManager 布局与当前实现的每连接字节数
+
+用法：
+    python benchmarks/connection_memory.py [--connections 100000] [--devices-per-user 2]
+"""
+import argparse
+import asyncio
+import datetime
+import gc
+import logging
+import os
+import sys
+import tracemalloc
+import uuid
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Any
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ConnectionManager import ConnectionManager  # noqa: E402
+
+
+@dataclass
+class LegacyClientConnection:
+    """旧版连接记录：普通 dataclass + datetime 时间戳 + client_info 字典"""
+    connection_id: str
+    websocket: Any
+    user_id: Optional[int] = None
+    device_id: Optional[str] = None
+    authenticated: bool = False
+    last_heartbeat: datetime.datetime = field(default_factory=datetime.datetime.now)
+    last_activity: datetime.datetime = field(default_factory=datetime.datetime.now)
+    created_at: datetime.datetime = field(default_factory=datetime.datetime.now)
+    client_info: Dict[str, Any] = field(default_factory=dict)
+
+
+class LegacyConnectionManager:
+    """旧版注册表：三个并行字典，用户索引为列表"""
+
+    def __init__(self):
+        self.connections: Dict[str, LegacyClientConnection] = {}
+        self.user_connections: Dict[int, List[str]] = {}
+        self.connection_to_user: Dict[str, int] = {}
+
+    def add_connection(self, websocket) -> str:
+        connection_id = str(uuid.uuid4())
+        self.connections[connection_id] = LegacyClientConnection(connection_id=connection_id, websocket=websocket)
+        return connection_id
+
+    async def authenticate_connection(self, connection_id: str, user_id: int):
+        connection = self.connections[connection_id]
+        connection.user_id = user_id
+        connection.authenticated = True
+        connection.last_activity = datetime.datetime.now()
+        self.user_connections.setdefault(user_id, []).append(connection_id)
+        self.connection_to_user[connection_id] = user_id
+
+
+async def populate(manager, count: int, devices_per_user: int):
+    websocket = object()  # 所有连接共享同一个占位对象，只统计注册表本身
+    for i in range(count):
+        connection_id = manager.add_connection(websocket)
+        await manager.authenticate_connection(connection_id, i // devices_per_user)
+
+
+def measure(factory, count: int, devices_per_user: int) -> float:
+    """返回每连接占用字节数"""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    manager = factory()
+    asyncio.run(populate(manager, count, devices_per_user))
+    gc.collect()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    total = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    del manager
+    return total / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--connections", type=int, default=100000)
+    parser.add_argument("--devices-per-user", type=int, default=2)
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+
+    legacy = measure(LegacyConnectionManager, args.connections, args.devices_per_user)
+    current = measure(ConnectionManager, args.connections, args.devices_per_user)
+
+    print(f"connections: {args.connections}, devices per user: {args.devices_per_user}")
+    print(f"legacy : {legacy:8.1f} bytes/connection")
+    print(f"current: {current:8.1f} bytes/connection ({(1 - current / legacy) * 100:+.1f}% saved)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+"""
+分发热路径微基准：在单进程内用假连接测量每帧的固定开销
+
+    json.loads → process_message → RequestContext 进入/退出 → request 代理属性访问
+    → 中间件调用链 + 处理器 → encode(json.dumps) → 出站队列 → send
+
+每一段单独计时，另有完整 process_message（空处理器 / 心跳处理器）的端到端计时；
+每项重复 --repeat 次取最快一次，结果可写入 JSON 并与之前的结果对比。
+
+用法：
+    python benchmarks/dispatch.py [--iterations 50000] [--repeat 5] [--output result.json] [--compare old.json]
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+import os
+import platform
+import sys
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+import memory_mongo  # noqa: E402
+
+memory_mongo.install()
+
+from ConnectionWriter import ConnectionWriter  # noqa: E402
+from context import RequestContext, _request_ctx_var  # noqa: E402
+from frames import encode  # noqa: E402
+from global_proxy import request  # noqa: E402
+from loadgen import change, git_commit  # noqa: E402
+from router import server  # noqa: E402
+
+REQUEST = {
+    "endpoint": "/bench/noop",
+    "data": {"receiver_id": 2, "type": "text", "content": {"text": "x" * 64}, "client_msg_id": "c1"},
+    "request_id": "r1"
+}
+RESPONSE = {
+    "endpoint": "/bench/noop_response",
+    "data": {"client_msg_id": "c1", "server_msg_id": "m1", "delivered": True, "timestamp": 1700000000},
+    "code": 200
+}
+
+
+class NullWebSocket:
+    """只统计发送次数的假连接"""
+
+    def __init__(self):
+        self.sent = 0
+
+    async def send(self, text: str):
+        self.sent += 1
+
+    async def close(self, *args, **kwargs):
+        pass
+
+
+@server.route("/bench/noop")
+async def handle_bench_noop():
+    """空处理器：读取请求数据并返回固定响应"""
+    request.data.get("client_msg_id")
+    return RESPONSE
+
+
+def time_sync(func: Callable[[], Any], iterations: int) -> float:
+    started = time.perf_counter_ns()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter_ns() - started) / iterations
+
+
+async def time_async(func: Callable[[], Awaitable[Any]], iterations: int) -> float:
+    started = time.perf_counter_ns()
+    for _ in range(iterations):
+        await func()
+    return (time.perf_counter_ns() - started) / iterations
+
+
+async def run(iterations: int, repeat: int) -> Dict[str, float]:
+    websocket = NullWebSocket()
+    connection_id = server.connection_manager.add_connection(websocket)
+    connection = server.connection_manager.get_connection_by_id(connection_id)
+    # 队列足够大，计时循环内不会触发溢出策略
+    connection.writer = ConnectionWriter(websocket, max_size=iterations + 1)
+    connection.writer.start()
+
+    raw = json.dumps(REQUEST)
+    heartbeat_raw = json.dumps({"endpoint": "/heartbeat", "data": {"timestamp": 1700000000}})
+    handler = server.handlers["/bench/noop"]
+
+    def context_only():
+        with RequestContext(server, connection_id, REQUEST, "r1"):
+            pass
+
+    async def handler_chain():
+        with RequestContext(server, connection_id, REQUEST, "r1"):
+            await handler()
+
+    def in_context(func: Callable[[], Any]) -> float:
+        with RequestContext(server, connection_id, REQUEST, "r1"):
+            return time_sync(func, iterations)
+
+    async def drained(raw_message: str) -> float:
+        # 包含出站队列把消息交给 websocket 的时间
+        sent = websocket.sent
+        started = time.perf_counter_ns()
+        for _ in range(iterations):
+            await server.process_message(connection_id, raw_message)
+        while websocket.sent < sent + iterations:
+            await asyncio.sleep(0)
+        return (time.perf_counter_ns() - started) / iterations
+
+    cases = {
+        "json.loads": lambda: time_sync(lambda: json.loads(raw), iterations),
+        "encode (json.dumps)": lambda: time_sync(lambda: encode(RESPONSE), iterations),
+        "context enter/exit": lambda: time_sync(context_only, iterations),
+        "ContextVar.get": lambda: in_context(_request_ctx_var.get),
+        "request.data": lambda: in_context(lambda: request.data),
+        "request.server": lambda: in_context(lambda: request.server),
+        "request.connection_id": lambda: in_context(lambda: request.connection_id),
+        "request.user_id": lambda: in_context(lambda: request.user_id),
+        "context + handler chain": lambda: time_async(handler_chain, iterations),
+        "process_message (noop)": lambda: drained(raw),
+        "process_message (heartbeat)": lambda: drained(heartbeat_raw),
+    }
+
+    results = {}
+    for name, case in cases.items():
+        timings = []
+        for _ in range(repeat):
+            timing = case()
+            timings.append(await timing if asyncio.iscoroutine(timing) else timing)
+        results[name] = round(min(timings), 1)
+
+    await connection.writer.close()
+    server.connection_manager.remove_connection(connection_id)
+    return results
+
+
+def print_report(results: Dict[str, float], baseline: Optional[Dict[str, Any]] = None):
+    base = (baseline or {}).get("results", {})
+    print(f"\n{'case':<32}{'ns/op':>12}{'ops/s':>14}" + (f"{'Δ':>8}" if base else ""))
+    for name, ns in results.items():
+        line = f"{name:<32}{ns:>12}{int(1e9 / ns) if ns else 0:>14}"
+        if name in base:
+            line += f"{change(ns, base[name]):>8}"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="分发热路径微基准")
+    parser.add_argument("--iterations", type=int, default=50000, help="每次计时的循环次数")
+    parser.add_argument("--repeat", type=int, default=5, help="重复次数，取最快一次")
+    parser.add_argument("--uvloop", action="store_true", help="使用 uvloop 事件循环")
+    parser.add_argument("--output", help="结果 JSON 文件")
+    parser.add_argument("--compare", help="与之前的结果 JSON 对比")
+    args = parser.parse_args()
+
+    if args.uvloop:
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    logging.disable(logging.WARNING)
+
+    results = asyncio.run(run(args.iterations, args.repeat))
+    result = {
+        "meta": {
+            "commit": git_commit(),
+            "time": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "iterations": args.iterations,
+            "repeat": args.repeat
+        },
+        "results": results
+    }
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(results, baseline)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已写入 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
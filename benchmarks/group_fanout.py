@@ -0,0 +1,92 @@
+"""
+群消息扇出基准：对比逐接收者编码消息字典与共享 EncodedFrame 的扇出开销
+
+用法：
+    python benchmarks/group_fanout.py [--members 500] [--messages 200] [--content-size 200]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ConnectionWriter import ConnectionWriter  # noqa: E402
+from frames import EncodedFrame  # noqa: E402
+
+
+class NullWebSocket:
+    """只统计发送字节数的假连接"""
+
+    def __init__(self):
+        self.bytes_sent = 0
+
+    async def send(self, text: str):
+        self.bytes_sent += len(text)
+
+
+def build_group_message(index: int, content_size: int):
+    return {
+        "endpoint": "/group/message/receive",
+        "data": {
+            "message_id": str(uuid.uuid4()),
+            "group_id": "g_bench",
+            "group_name": "benchmark",
+            "sender_id": 1,
+            "sender_info": {"user_id": 1, "username": "bench", "nickname": "Bench", "avatar": "a.png",
+                            "group_role": "member"},
+            "type": "text",
+            "content": {"text": "x" * content_size, "seq": index},
+            "timestamp": int(time.time()),
+            "client_msg_id": str(uuid.uuid4()),
+            "at_users": [],
+            "at_all": False,
+            "is_system": False
+        }
+    }
+
+
+async def run(members: int, messages: int, content_size: int, shared: bool) -> float:
+    writers = [ConnectionWriter(NullWebSocket(), max_size=messages + 1) for _ in range(members)]
+    for writer in writers:
+        writer.start()
+
+    payloads = [build_group_message(i, content_size) for i in range(messages)]
+    started = time.perf_counter()
+    for payload in payloads:
+        message = EncodedFrame(payload) if shared else payload
+        for writer in writers:
+            writer.enqueue(message)
+        await asyncio.sleep(0)
+
+    # 等待所有写任务发送完毕
+    while any(writer.queue for writer in writers):
+        await asyncio.sleep(0)
+    elapsed = time.perf_counter() - started
+
+    for writer in writers:
+        await writer.close()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--members", type=int, default=500)
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--content-size", type=int, default=200)
+    args = parser.parse_args()
+
+    deliveries = args.members * args.messages
+    per_recipient = asyncio.run(run(args.members, args.messages, args.content_size, shared=False))
+    shared = asyncio.run(run(args.members, args.messages, args.content_size, shared=True))
+
+    print(f"members: {args.members}, messages: {args.messages}, deliveries: {deliveries}")
+    print(f"per-recipient encode: {per_recipient:.3f}s ({deliveries / per_recipient:,.0f} deliveries/s)")
+    print(f"shared EncodedFrame : {shared:.3f}s ({deliveries / shared:,.0f} deliveries/s, "
+          f"{per_recipient / shared:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,474 @@
+"""
+端到端压测：模拟 N 个 WebSocket 客户端，按比例混合登录、心跳、私聊、群聊（不同群规模）、历史查询和重连风暴，
+统计每个 endpoint 的吞吐和 p50/p90/p99 延迟，结果写入 JSON，便于跨提交对比性能回退。
+
+默认在本进程内启动服务器并使用内存版 Mongo（benchmarks/memory_mongo.py），不依赖任何外部服务；
+--mongo-uri 使用真实 MongoDB，--url 压测已在运行的服务器（需同时给出 --mongo-uri 用于准备测试用户，或 --no-seed）。
+
+用法：
+    python benchmarks/loadgen.py [--clients 200] [--duration 30] [--group-sizes 10,100,500]
+                                 [--mix heartbeat=20,send=40,group_send=20,history=10,login=5,reconnect=5]
+                                 [--storm-every 10 --storm-fraction 0.2] [--output result.json]
+                                 [--compare baseline.json]
+"""
+import argparse
+import asyncio
+import contextlib
+import datetime
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Set
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+import websockets  # noqa: E402
+
+# 操作名 -> 请求 endpoint
+OPERATIONS = {
+    "login": "/auth/login",
+    "heartbeat": "/heartbeat",
+    "send": "/message/send",
+    "group_send": "/group/message/send",
+    "history": "/history/get",
+    "reconnect": "/reconnect",
+}
+DEFAULT_MIX = "heartbeat=20,send=40,group_send=20,history=10,login=5,reconnect=5"
+PASSWORD = "bench123"
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class Stats:
+    """按 endpoint 记录延迟和错误"""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self.timeouts: Dict[str, int] = {}
+        self.pushes_received = 0
+
+    def record(self, endpoint: str, elapsed: float, ok: bool):
+        self.latencies.setdefault(endpoint, []).append(elapsed)
+        if not ok:
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+    def timeout(self, endpoint: str):
+        self.timeouts[endpoint] = self.timeouts.get(endpoint, 0) + 1
+
+    def summary(self, duration: float) -> Dict[str, Any]:
+        endpoints = {}
+        for endpoint in sorted(set(self.latencies) | set(self.timeouts)):
+            latencies = self.latencies.get(endpoint, [])
+            endpoints[endpoint] = {
+                "requests": len(latencies),
+                "errors": self.errors.get(endpoint, 0),
+                "timeouts": self.timeouts.get(endpoint, 0),
+                "throughput": round(len(latencies) / duration, 2) if duration else 0.0,
+                "p50_ms": round(percentile(latencies, 0.5) * 1000, 3),
+                "p90_ms": round(percentile(latencies, 0.9) * 1000, 3),
+                "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+                "max_ms": round(max(latencies) * 1000, 3) if latencies else 0.0
+            }
+        total = sum(len(v) for v in self.latencies.values())
+        return {
+            "duration": round(duration, 3),
+            "total_requests": total,
+            "throughput": round(total / duration, 2) if duration else 0.0,
+            "pushes_received": self.pushes_received,
+            "endpoints": endpoints
+        }
+
+
+class BenchClient:
+    """模拟客户端：一次只有一个请求在途，按响应 endpoint 匹配请求"""
+
+    def __init__(self, url: str, user_id: int, stats: Stats, timeout: float):
+        self.url = url
+        self.user_id = user_id
+        self.stats = stats
+        self.timeout = timeout
+        self.websocket = None
+        self.reader: Optional[asyncio.Task] = None
+        self.token: Optional[str] = None
+        self.groups: List[str] = []
+        self.last_msg_id: Optional[str] = None
+        self.reconnect_requested = False
+        # 正在等待的响应 endpoint 集合及其 Future
+        self._expected: Set[str] = set()
+        self._waiter: Optional[asyncio.Future] = None
+
+    async def connect(self):
+        self.websocket = await websockets.connect(self.url, max_size=None, open_timeout=self.timeout, proxy=None)
+        connected = asyncio.get_running_loop().create_future()
+        self._expected, self._waiter = {"/system/connected"}, connected
+        self.reader = asyncio.create_task(self._read())
+        await asyncio.wait_for(connected, self.timeout)
+
+    async def close(self):
+        if self.websocket is not None:
+            await self.websocket.close()
+        if self.reader is not None:
+            self.reader.cancel()
+            with contextlib.suppress(asyncio.CancelledError, Exception):
+                await self.reader
+
+    async def _read(self):
+        try:
+            async for raw in self.websocket:
+                frames = json.loads(raw)
+                frames = frames["data"]["messages"] if frames.get("endpoint") == "/batch" else [frames]
+                for frame in frames:
+                    self._dispatch(frame)
+        except websockets.ConnectionClosed:
+            pass
+
+    def _dispatch(self, frame: Dict[str, Any]):
+        endpoint = frame.get("endpoint")
+        waiter = self._waiter
+        if waiter is not None and not waiter.done() and endpoint in self._expected:
+            waiter.set_result(frame)
+            return
+        self.stats.pushes_received += 1
+        data = frame.get("data") or {}
+        if endpoint in ("/message/receive", "/group/message/receive") and data.get("message_id"):
+            self.last_msg_id = data["message_id"]
+
+    async def request(self, endpoint: str, data: Dict[str, Any], record: bool = True) -> Optional[Dict[str, Any]]:
+        """发送请求并等待响应（<endpoint>_response 或 /error）"""
+        waiter = asyncio.get_running_loop().create_future()
+        self._expected, self._waiter = {endpoint + "_response", "/error"}, waiter
+        started = time.perf_counter()
+        try:
+            await self.websocket.send(json.dumps({"endpoint": endpoint, "data": data,
+                                                  "request_id": uuid.uuid4().hex}))
+            response = await asyncio.wait_for(waiter, self.timeout)
+        except (asyncio.TimeoutError, websockets.ConnectionClosed):
+            if record:
+                self.stats.timeout(endpoint)
+            return None
+        finally:
+            self._waiter = None
+        if record:
+            code = response.get("code") or (response.get("data") or {}).get("code") or 200
+            ok = response.get("endpoint") != "/error" and code < 400
+            self.stats.record(endpoint, time.perf_counter() - started, ok)
+        return response
+
+    async def login(self, record: bool = True) -> bool:
+        response = await self.request("/auth/login", {"userid": self.user_id, "password": PASSWORD}, record)
+        if response and response.get("code") == 200:
+            self.token = response["data"]["token"]
+            return True
+        return False
+
+    async def reconnect(self):
+        """断开后用新连接重连，并续传断线期间的消息"""
+        await self.close()
+        await self.connect()
+        await self.request("/reconnect", {"token": self.token, "last_msg_id": self.last_msg_id})
+
+
+async def seed(user_manager, group_sizes: List[int], clients: int, user_id_base: int, contacts: int):
+    """写入测试用户（幂等）"""
+    ids = [user_id_base + i for i in range(clients)]
+    for index, user_id in enumerate(ids):
+        contact_ids = [ids[(index + k) % clients] for k in range(1, min(contacts, clients - 1) + 1)]
+        await user_manager.db.update_one({"user_id": user_id}, {"$set": {
+            "user_id": user_id,
+            "username": f"bench{user_id}",
+            "nickname": f"Bench {user_id}",
+            "password": PASSWORD,
+            "department": "bench",
+            "tags": [],
+            "avatar": "",
+            "contacts": contact_ids
+        }}, upsert=True)
+    return ids
+
+
+async def create_groups(clients: List[BenchClient], group_sizes: List[int]):
+    """每种规模创建一个群，群主为第 i 个客户端，成员为其后连续的客户端"""
+    for index, size in enumerate(group_sizes):
+        owner = clients[index % len(clients)]
+        members = [clients[(index + k) % len(clients)] for k in range(min(size, len(clients)))]
+        response = await owner.request("/group/create", {
+            "name": f"bench-{size}",
+            "initial_members": [member.user_id for member in members[1:]]
+        }, record=False)
+        if not response or response.get("code") != 200:
+            raise RuntimeError(f"创建 {size} 人群失败: {response}")
+        for member in members:
+            member.groups.append(response["data"]["group_id"])
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    weights = {}
+    for item in mix.split(","):
+        name, _, weight = item.partition("=")
+        if name.strip() not in OPERATIONS:
+            raise SystemExit(f"未知操作: {name}，可选: {', '.join(OPERATIONS)}")
+        weights[name.strip()] = float(weight or 1)
+    return weights
+
+
+async def run_client(client: BenchClient, clients: List[BenchClient], weights: Dict[str, float],
+                     deadline: float, think_time: float, content_size: int):
+    names, values = list(weights), list(weights.values())
+    content = "x" * content_size
+    while time.perf_counter() < deadline:
+        if client.reconnect_requested:
+            client.reconnect_requested = False
+            operation = "reconnect"
+        else:
+            operation = random.choices(names, values)[0]
+        try:
+            if operation == "heartbeat":
+                await client.request("/heartbeat", {"timestamp": int(time.time())})
+            elif operation == "send":
+                receiver = random.choice(clients)
+                await client.request("/message/send", {
+                    "receiver_id": receiver.user_id, "type": "text",
+                    "content": {"text": content}, "client_msg_id": uuid.uuid4().hex})
+            elif operation == "group_send" and client.groups:
+                await client.request("/group/message/send", {
+                    "group_id": random.choice(client.groups), "type": "text",
+                    "content": {"text": content}, "client_msg_id": uuid.uuid4().hex})
+            elif operation == "history":
+                await client.request("/history/get", {
+                    "target_type": "user", "target_id": random.choice(clients).user_id,
+                    "end_time": int(time.time()), "limit": 20})
+            elif operation == "login":
+                await client.login()
+            elif operation == "reconnect":
+                await client.reconnect()
+        except (OSError, asyncio.TimeoutError, websockets.WebSocketException):
+            # 连接异常时重建连接，计入超时
+            client.stats.timeout(OPERATIONS[operation])
+            with contextlib.suppress(Exception):
+                await client.reconnect()
+        if think_time:
+            await asyncio.sleep(random.uniform(0, 2 * think_time))
+
+
+async def reconnect_storms(clients: List[BenchClient], every: float, fraction: float, deadline: float):
+    """每隔 every 秒让 fraction 比例的客户端同时断线重连"""
+    while time.perf_counter() + every < deadline:
+        await asyncio.sleep(every)
+        for client in random.sample(clients, max(1, int(len(clients) * fraction))):
+            client.reconnect_requested = True
+
+
+async def start_local_server(args):
+    """在本进程内启动服务器，返回 (server, 服务器任务, url)"""
+    import config
+    if args.mongo_uri:
+        config.Config.mongo_uri = args.mongo_uri
+    else:
+        import memory_mongo
+        memory_mongo.install()
+    from router import server
+    from middleware import rate_limit_middleware
+
+    server.host, server.port = "127.0.0.1", args.port
+    if not args.rate_limits:
+        # 压测关注处理开销，默认去掉限流中间件
+        server.middlewares = [m for m in server.middlewares if m is not rate_limit_middleware]
+        server.recompile_handlers()
+    await server.initialize()
+    task = asyncio.create_task(server.start())
+    url = f"ws://127.0.0.1:{args.port}"
+    for _ in range(100):
+        try:
+            async with websockets.connect(url, proxy=None):
+                return server, task, url
+        except OSError:
+            await asyncio.sleep(0.05)
+    raise RuntimeError("服务器启动超时")
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def bench(args) -> Dict[str, Any]:
+    server = server_task = None
+    if args.url:
+        url = args.url
+    else:
+        server, server_task, url = await start_local_server(args)
+
+    stats = Stats()
+    user_ids = list(range(args.user_id_base, args.user_id_base + args.clients))
+    if not args.no_seed:
+        if server is not None:
+            user_manager = server.user_manager
+        else:
+            import config
+            config.Config.mongo_uri = args.mongo_uri
+            from UserManager import UserManager
+            user_manager = UserManager()
+        user_ids = await seed(user_manager, args.group_sizes, args.clients, args.user_id_base, args.contacts)
+
+    clients = [BenchClient(url, user_id, stats, args.timeout) for user_id in user_ids]
+    started = time.perf_counter()
+    await asyncio.gather(*(client.connect() for client in clients))
+    logins = await asyncio.gather(*(client.login() for client in clients))
+    if not all(logins):
+        raise RuntimeError(f"{logins.count(False)} 个客户端登录失败")
+    await create_groups(clients, args.group_sizes)
+    setup_time = time.perf_counter() - started
+
+    # 准备和预热阶段的数据不计入结果
+    weights = parse_mix(args.mix)
+    if args.warmup:
+        warmup_deadline = time.perf_counter() + args.warmup
+        await asyncio.gather(*(run_client(c, clients, weights, warmup_deadline, args.think_time, args.content_size)
+                               for c in clients))
+    stats.reset()
+    if server is not None:
+        server.metrics.endpoints.clear()
+
+    started = time.perf_counter()
+    deadline = started + args.duration
+    tasks = [run_client(c, clients, weights, deadline, args.think_time, args.content_size) for c in clients]
+    if args.storm_every:
+        tasks.append(reconnect_storms(clients, args.storm_every, args.storm_fraction, deadline))
+    await asyncio.gather(*tasks)
+    duration = time.perf_counter() - started
+
+    result = {
+        "meta": {
+            "commit": git_commit(),
+            "time": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "args": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+            "setup_seconds": round(setup_time, 3)
+        },
+        "client": stats.summary(duration)
+    }
+    if server is not None:
+        metrics = server.metrics.snapshot()
+        result["server"] = {
+            "endpoints": {endpoint: {
+                "requests": m["requests"], "errors": m["errors"],
+                "latency_p50": m["latency"]["p50"], "latency_p99": m["latency"]["p99"],
+                "avg_fanout": round(m["fanout"]["sum"] / m["fanout"]["count"], 2) if m["fanout"]["count"] else 0,
+                "avg_db_calls": round(m["db_calls"]["sum"] / m["db_calls"]["count"], 2)
+                if m["db_calls"]["count"] else 0
+            } for endpoint, m in metrics["endpoints"].items()},
+            "gauges": metrics["gauges"],
+            "mongo": server.mongo_monitor.get_stats()
+        }
+
+    await asyncio.gather(*(client.close() for client in clients), return_exceptions=True)
+    if server_task is not None:
+        server_task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await server_task
+    return result
+
+
+def print_report(result: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None):
+    client = result["client"]
+    print(f"\n总计 {client['total_requests']} 次请求, {client['throughput']} req/s, "
+          f"收到推送 {client['pushes_received']} 条 (时长 {client['duration']}s)")
+    header = f"{'endpoint':<24}{'requests':>10}{'errors':>8}{'timeouts':>9}{'req/s':>10}" \
+             f"{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}"
+    if baseline:
+        header += f"{'Δp50':>9}{'Δp99':>9}{'Δreq/s':>9}"
+    print(header)
+    base_endpoints = (baseline or {}).get("client", {}).get("endpoints", {})
+    for endpoint, s in client["endpoints"].items():
+        line = f"{endpoint:<24}{s['requests']:>10}{s['errors']:>8}{s['timeouts']:>9}{s['throughput']:>10}" \
+               f"{s['p50_ms']:>10}{s['p90_ms']:>10}{s['p99_ms']:>10}"
+        base = base_endpoints.get(endpoint)
+        if base:
+            line += "".join(f"{change(s[k], base[k]):>9}" for k in ("p50_ms", "p99_ms", "throughput"))
+        print(line)
+    if "server" in result:
+        print(f"\n{'endpoint (server)':<24}{'avg fanout':>12}{'avg db calls':>14}")
+        for endpoint, s in result["server"]["endpoints"].items():
+            print(f"{endpoint:<24}{s['avg_fanout']:>12}{s['avg_db_calls']:>14}")
+
+
+def change(current: float, base: float) -> str:
+    if not base:
+        return "-"
+    return f"{(current - base) / base * 100:+.0f}%"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="IM 服务器端到端压测")
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--duration", type=float, default=30, help="计时阶段时长（秒）")
+    parser.add_argument("--warmup", type=float, default=3, help="预热时长（秒），不计入结果")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"操作比例，可选 {', '.join(OPERATIONS)}")
+    parser.add_argument("--group-sizes", type=lambda v: [int(x) for x in v.split(",") if x], default=[10, 100],
+                        help="群规模，逗号分隔，每种规模创建一个群")
+    parser.add_argument("--contacts", type=int, default=20, help="每个用户的联系人数")
+    parser.add_argument("--content-size", type=int, default=64, help="消息文本长度")
+    parser.add_argument("--think-time", type=float, default=0.0, help="客户端两次操作之间的平均间隔（秒）")
+    parser.add_argument("--storm-every", type=float, default=0.0, help="每隔多少秒触发一次重连风暴，0 表示不触发")
+    parser.add_argument("--storm-fraction", type=float, default=0.2, help="每次重连风暴断线的客户端比例")
+    parser.add_argument("--timeout", type=float, default=10.0, help="单个请求超时（秒）")
+    parser.add_argument("--user-id-base", type=int, default=100000, help="测试用户ID起始值")
+    parser.add_argument("--url", help="压测已运行的服务器，例如 ws://127.0.0.1:8765")
+    parser.add_argument("--port", type=int, default=18765, help="本进程内启动服务器时的端口")
+    parser.add_argument("--mongo-uri", help="使用真实 MongoDB（默认使用内存替身）")
+    parser.add_argument("--no-seed", action="store_true", help="不写入测试用户（用户已存在）")
+    parser.add_argument("--rate-limits", action="store_true", help="保留服务器的限流中间件")
+    parser.add_argument("--uvloop", action="store_true", help="使用 uvloop 事件循环")
+    parser.add_argument("--verbose", action="store_true", help="显示服务器日志和输出")
+    parser.add_argument("--output", help="结果 JSON 文件")
+    parser.add_argument("--compare", help="与之前的结果 JSON 对比")
+    args = parser.parse_args()
+    if args.url and not args.mongo_uri and not args.no_seed:
+        parser.error("--url 需要同时给出 --mongo-uri（用于写入测试用户）或 --no-seed")
+
+    if args.uvloop:
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.ERROR)
+
+    # 服务器处理器中的 print 会干扰结果输出
+    with contextlib.ExitStack() as stack:
+        if not args.verbose:
+            stack.enter_context(contextlib.redirect_stdout(stack.enter_context(open(os.devnull, "w"))))
+        result = asyncio.run(bench(args))
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(result, baseline)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已写入 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,596 @@
+"""
+内存版 Mongo 替身：实现服务器各管理器用到的 AsyncMongoClient 接口子集，供压测在没有 MongoDB 时使用
+
+支持的查询：等值（含点路径、数组成员）、$eq/$ne/$gt/$gte/$lt/$lte/$in/$nin/$exists/$type/$regex/$or/$and；
+更新：$set/$unset/$inc/$push/$addToSet/$pull/$setOnInsert，upsert；唯一索引（含 partialFilterExpression）。
+create_index 的第一个字段会建立等值哈希索引，避免每次查询全表扫描。聚合管道不支持（返回空结果）。
+
+用法（必须在导入服务器模块之前调用）：
+    import memory_mongo
+    memory_mongo.install()
+"""
+import copy
+import itertools
+import re
+import time
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Set, Tuple
+
+import pymongo
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+
+_MISSING = object()
+_request_ids = itertools.count(1)
+
+
+class Result:
+    """写操作结果（InsertOneResult / UpdateResult / DeleteResult 等的替身）"""
+
+    def __init__(self, **fields):
+        self.acknowledged = True
+        self.inserted_id = None
+        self.upserted_id = None
+        self.matched_count = self.modified_count = self.deleted_count = 0
+        self.__dict__.update(fields)
+
+
+class CommandEvent:
+    """命令监听事件（只提供 MongoCommandMonitor 用到的字段）"""
+    __slots__ = ('command_name', 'database_name', 'request_id', 'connection_id', 'duration_micros',
+                 'failure')
+
+    def __init__(self, command_name: str, database_name: str, request_id: int):
+        self.command_name = command_name
+        self.database_name = database_name
+        self.request_id = request_id
+        self.connection_id = ("memory", 0)
+        self.duration_micros = 0
+        self.failure = None
+
+
+def _values(doc: Any, path: List[str]) -> List[Any]:
+    """取点路径上的所有值（路径经过数组时展开）"""
+    if not path:
+        return [doc]
+    if isinstance(doc, list):
+        if path[0].isdigit() and int(path[0]) < len(doc):
+            return _values(doc[int(path[0])], path[1:])
+        return [value for item in doc for value in _values(item, path)]
+    if isinstance(doc, dict) and path[0] in doc:
+        return _values(doc[path[0]], path[1:])
+    return [_MISSING]
+
+
+def _compare(value: Any, op: str, operand: Any) -> bool:
+    if value is _MISSING or value is None:
+        return False
+    try:
+        if op == "$gt":
+            return value > operand
+        if op == "$gte":
+            return value >= operand
+        if op == "$lt":
+            return value < operand
+        return value <= operand
+    except TypeError:
+        return False
+
+
+_TYPES = {"string": str, "int": int, "number": (int, float), "double": float, "bool": bool,
+          "object": dict, "array": list, "objectId": ObjectId}
+
+
+def _match_value(value: Any, condition: Any) -> bool:
+    """单个字段值是否满足条件"""
+    if isinstance(condition, dict) and condition and all(k.startswith("$") for k in condition):
+        for op, operand in condition.items():
+            if op == "$eq":
+                ok = _match_value(value, operand)
+            elif op == "$ne":
+                ok = not _match_value(value, operand)
+            elif op in ("$gt", "$gte", "$lt", "$lte"):
+                ok = _compare(value, op, operand)
+            elif op == "$in":
+                ok = any(_match_value(value, item) for item in operand)
+            elif op == "$nin":
+                ok = not any(_match_value(value, item) for item in operand)
+            elif op == "$exists":
+                ok = (value is not _MISSING) == bool(operand)
+            elif op == "$type":
+                ok = value is not _MISSING and isinstance(value, _TYPES.get(operand, object)) \
+                     and not (operand in ("int", "number") and isinstance(value, bool))
+            elif op == "$regex":
+                flags = re.IGNORECASE if "i" in condition.get("$options", "") else 0
+                ok = isinstance(value, str) and re.search(operand, value, flags) is not None
+            elif op == "$options":
+                ok = True
+            else:
+                raise NotImplementedError(f"memory_mongo 不支持查询操作符 {op}")
+            if not ok:
+                return False
+        return True
+    if value is _MISSING:
+        return condition is None
+    if isinstance(value, list) and not isinstance(condition, list):
+        return condition in value
+    return value == condition
+
+
+def match(doc: Dict[str, Any], query: Dict[str, Any]) -> bool:
+    """文档是否匹配查询"""
+    for key, condition in query.items():
+        if key == "$or":
+            if not any(match(doc, sub) for sub in condition):
+                return False
+        elif key == "$and":
+            if not all(match(doc, sub) for sub in condition):
+                return False
+        elif key == "$nor":
+            if any(match(doc, sub) for sub in condition):
+                return False
+        else:
+            values = _values(doc, key.split("."))
+            negative = isinstance(condition, dict) and ("$ne" in condition or "$nin" in condition)
+            if negative:
+                if not all(_match_value(value, condition) for value in values):
+                    return False
+            elif not any(_match_value(value, condition) for value in values):
+                return False
+    return True
+
+
+def _set_path(doc: Dict[str, Any], path: str, value: Any):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        doc = doc.setdefault(part, {})
+    doc[parts[-1]] = value
+
+
+def _get_path(doc: Dict[str, Any], path: str, default: Any = None) -> Any:
+    for part in path.split("."):
+        if not isinstance(doc, dict) or part not in doc:
+            return default
+        doc = doc[part]
+    return doc
+
+
+def _unset_path(doc: Dict[str, Any], path: str):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        doc = doc.get(part)
+        if not isinstance(doc, dict):
+            return
+    doc.pop(parts[-1], None)
+
+
+def apply_update(doc: Dict[str, Any], update: Dict[str, Any], inserting: bool = False):
+    """在文档上执行更新操作符"""
+    if not any(key.startswith("$") for key in update):
+        # 整体替换（保留 _id）
+        _id = doc.get("_id")
+        doc.clear()
+        doc.update(copy.deepcopy(update))
+        if _id is not None:
+            doc["_id"] = _id
+        return
+    for op, fields in update.items():
+        for path, value in fields.items():
+            if op == "$set" or (op == "$setOnInsert" and inserting):
+                _set_path(doc, path, copy.deepcopy(value))
+            elif op == "$setOnInsert":
+                continue
+            elif op == "$unset":
+                _unset_path(doc, path)
+            elif op == "$inc":
+                _set_path(doc, path, _get_path(doc, path, 0) + value)
+            elif op in ("$push", "$addToSet"):
+                items = value["$each"] if isinstance(value, dict) and "$each" in value else [value]
+                current = _get_path(doc, path)
+                if current is None:
+                    current = []
+                    _set_path(doc, path, current)
+                for item in items:
+                    if op == "$push" or item not in current:
+                        current.append(copy.deepcopy(item))
+            elif op == "$pull":
+                current = _get_path(doc, path)
+                if isinstance(current, list):
+                    current[:] = [item for item in current if not _match_value(item, value)]
+            else:
+                raise NotImplementedError(f"memory_mongo 不支持更新操作符 {op}")
+
+
+def _project(doc: Dict[str, Any], projection: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    doc = copy.deepcopy(doc)
+    if not projection:
+        return doc
+    include = [key for key, flag in projection.items() if flag and key != "_id"]
+    if include:
+        result = {key: doc[key] for key in include if key in doc}
+        if projection.get("_id", 1) and "_id" in doc:
+            result["_id"] = doc["_id"]
+        return result
+    for key, flag in projection.items():
+        if not flag:
+            doc.pop(key, None)
+    return doc
+
+
+def _sort_key(value: Any) -> Tuple:
+    # None/缺失排在最前，其余按类型分组比较，避免不同类型之间比较出错
+    if value is None or value is _MISSING:
+        return (0, 0)
+    if isinstance(value, (int, float)):
+        return (1, value)
+    return (2, str(value)) if not isinstance(value, (ObjectId,)) else (3, value)
+
+
+class MemoryCursor:
+    """查询游标：支持 sort / skip / limit / to_list / async for"""
+
+    def __init__(self, collection: "MemoryCollection", docs: List[Dict[str, Any]],
+                 projection: Optional[Dict[str, Any]] = None):
+        self.collection = collection
+        self.docs = docs
+        self.projection = projection
+        self._sort: List[Tuple[str, int]] = []
+        self._skip = 0
+        self._limit = 0
+
+    def sort(self, key, direction: int = 1) -> "MemoryCursor":
+        self._sort = [(key, direction)] if isinstance(key, str) else list(key)
+        return self
+
+    def skip(self, count: int) -> "MemoryCursor":
+        self._skip = count
+        return self
+
+    def limit(self, count: int) -> "MemoryCursor":
+        self._limit = count
+        return self
+
+    def _results(self) -> List[Dict[str, Any]]:
+        docs = self.docs
+        for key, direction in reversed(self._sort):
+            docs = sorted(docs, key=lambda d: _sort_key(_values(d, key.split("."))[0]), reverse=direction < 0)
+        docs = docs[self._skip:]
+        if self._limit:
+            docs = docs[:self._limit]
+        return [_project(doc, self.projection) for doc in docs]
+
+    async def to_list(self, length: Optional[int] = None) -> List[Dict[str, Any]]:
+        results = self._results()
+        return results if not length else results[:length]
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for doc in self._results():
+            yield doc
+
+
+class MemoryCollection:
+    """内存集合"""
+
+    def __init__(self, database: "MemoryDatabase", name: str):
+        self.database = database
+        self.name = name
+        # _id -> 文档（按插入顺序）
+        self.docs: Dict[Any, Dict[str, Any]] = {}
+        # _id -> 插入序号，索引查询时按插入顺序返回
+        self.positions: Dict[Any, int] = {}
+        self._counter = itertools.count()
+        # 字段 -> 值 -> _id 集合（create_index 第一个字段上的等值索引）
+        self.field_indexes: Dict[str, Dict[Hashable, Set[Any]]] = {}
+        # 唯一索引: (字段元组, 部分索引条件, 键 -> _id)
+        self.unique_indexes: List[Tuple[Tuple[str, ...], Optional[Dict[str, Any]], Dict[Tuple, Any]]] = []
+
+    # ---------- 监听事件 ----------
+
+    def _command(self, name: str):
+        return self.database.client._command(self.database.name, name)
+
+    # ---------- 索引 ----------
+
+    async def create_index(self, keys, unique: bool = False, partialFilterExpression=None, **kwargs) -> str:
+        with self._command("createIndexes"):
+            fields = (keys,) if isinstance(keys, str) else tuple(key for key, _ in keys)
+            if fields[0] not in self.field_indexes and fields[0] != "_id":
+                index: Dict[Hashable, Set[Any]] = {}
+                self.field_indexes[fields[0]] = index
+                for _id, doc in self.docs.items():
+                    self._index_add(index, fields[0], doc, _id)
+            if unique and not any(spec[0] == fields for spec in self.unique_indexes):
+                entries: Dict[Tuple, Any] = {}
+                self.unique_indexes.append((fields, partialFilterExpression, entries))
+                for _id, doc in self.docs.items():
+                    key = self._unique_key(fields, partialFilterExpression, doc)
+                    if key is not None:
+                        entries[key] = _id
+            return "_".join(f"{field}_1" for field in fields)
+
+    @staticmethod
+    def _hashable_values(doc: Dict[str, Any], field: str) -> Iterable[Hashable]:
+        for value in _values(doc, field.split(".")):
+            if value is not _MISSING and isinstance(value, Hashable):
+                yield value
+
+    def _index_add(self, index: Dict[Hashable, Set[Any]], field: str, doc: Dict[str, Any], _id: Any):
+        for value in self._hashable_values(doc, field):
+            index.setdefault(value, set()).add(_id)
+
+    def _index_remove(self, index: Dict[Hashable, Set[Any]], field: str, doc: Dict[str, Any], _id: Any):
+        for value in self._hashable_values(doc, field):
+            ids = index.get(value)
+            if ids is not None:
+                ids.discard(_id)
+                if not ids:
+                    del index[value]
+
+    @staticmethod
+    def _unique_key(fields: Tuple[str, ...], partial: Optional[Dict[str, Any]],
+                    doc: Dict[str, Any]) -> Optional[Tuple]:
+        if partial and not match(doc, partial):
+            return None
+        key = tuple(_get_path(doc, field) for field in fields)
+        return key if all(isinstance(v, Hashable) for v in key) else None
+
+    def _check_unique(self, doc: Dict[str, Any], _id: Any):
+        for fields, partial, entries in self.unique_indexes:
+            key = self._unique_key(fields, partial, doc)
+            if key is not None and entries.get(key, _id) != _id:
+                raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.name} "
+                                        f"index: {'_'.join(fields)} dup key: {key}", 11000)
+
+    def _register(self, doc: Dict[str, Any]):
+        _id = doc["_id"]
+        for field, index in self.field_indexes.items():
+            self._index_add(index, field, doc, _id)
+        for fields, partial, entries in self.unique_indexes:
+            key = self._unique_key(fields, partial, doc)
+            if key is not None:
+                entries[key] = _id
+
+    def _unregister(self, doc: Dict[str, Any]):
+        _id = doc["_id"]
+        for field, index in self.field_indexes.items():
+            self._index_remove(index, field, doc, _id)
+        for fields, partial, entries in self.unique_indexes:
+            key = self._unique_key(fields, partial, doc)
+            if key is not None and entries.get(key) == _id:
+                del entries[key]
+
+    # ---------- 查询 ----------
+
+    def _candidates(self, query: Dict[str, Any]) -> Iterable[Dict[str, Any]]:
+        """利用 _id 或等值索引缩小扫描范围"""
+        if "_id" in query and not isinstance(query["_id"], dict):
+            doc = self.docs.get(query["_id"])
+            return [doc] if doc is not None else []
+        for key, condition in query.items():
+            index = self.field_indexes.get(key)
+            if index is None or condition is None:
+                continue
+            if isinstance(condition, dict):
+                if set(condition) == {"$eq"}:
+                    condition = condition["$eq"]
+                else:
+                    continue
+            if isinstance(condition, Hashable):
+                ids = sorted(index.get(condition, ()), key=self.positions.__getitem__)
+                return [self.docs[_id] for _id in ids]
+        return list(self.docs.values())
+
+    def _find(self, query: Optional[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        query = query or {}
+        return [doc for doc in self._candidates(query) if match(doc, query)]
+
+    async def find_one(self, query: Optional[Dict[str, Any]] = None, projection=None, **kwargs):
+        with self._command("find"):
+            query = query or {}
+            for doc in self._candidates(query):
+                if match(doc, query):
+                    return _project(doc, projection)
+            return None
+
+    def find(self, query: Optional[Dict[str, Any]] = None, projection=None, **kwargs) -> MemoryCursor:
+        with self._command("find"):
+            return MemoryCursor(self, self._find(query), projection)
+
+    async def count_documents(self, query: Dict[str, Any], **kwargs) -> int:
+        with self._command("count"):
+            return len(self._find(query))
+
+    async def aggregate(self, pipeline, **kwargs) -> MemoryCursor:
+        with self._command("aggregate"):
+            return MemoryCursor(self, [])
+
+    # ---------- 写入 ----------
+
+    def _insert(self, document: Dict[str, Any]) -> Any:
+        if "_id" not in document:
+            # 与 pymongo 一致：把生成的 _id 写回调用方的文档
+            document["_id"] = ObjectId()
+        doc = copy.deepcopy(document)
+        if doc["_id"] in self.docs:
+            raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.name} index: _id_", 11000)
+        self._check_unique(doc, doc["_id"])
+        self.docs[doc["_id"]] = doc
+        self.positions[doc["_id"]] = next(self._counter)
+        self._register(doc)
+        return doc["_id"]
+
+    async def insert_one(self, document: Dict[str, Any], **kwargs) -> Result:
+        with self._command("insert"):
+            return Result(inserted_id=self._insert(document))
+
+    async def insert_many(self, documents: List[Dict[str, Any]], ordered: bool = True, **kwargs) -> Result:
+        with self._command("insert"):
+            return Result(inserted_ids=[self._insert(document) for document in documents])
+
+    def _update_doc(self, doc: Dict[str, Any], update: Dict[str, Any]) -> bool:
+        updated = copy.deepcopy(doc)
+        apply_update(updated, update)
+        if updated == doc:
+            return False
+        self._check_unique(updated, doc["_id"])
+        self._unregister(doc)
+        doc.clear()
+        doc.update(updated)
+        self._register(doc)
+        return True
+
+    def _upsert(self, query: Dict[str, Any], update: Dict[str, Any]) -> Any:
+        doc: Dict[str, Any] = {}
+        for key, condition in query.items():
+            if not key.startswith("$") and not isinstance(condition, dict):
+                _set_path(doc, key, copy.deepcopy(condition))
+        apply_update(doc, update, inserting=True)
+        return self._insert(doc)
+
+    def _update(self, query: Dict[str, Any], update: Dict[str, Any], upsert: bool, many: bool) -> Result:
+        docs = self._find(query)
+        if not many:
+            docs = docs[:1]
+        if not docs and upsert:
+            return Result(upserted_id=self._upsert(query, update))
+        modified = sum(1 for doc in docs if self._update_doc(doc, update))
+        return Result(matched_count=len(docs), modified_count=modified)
+
+    async def update_one(self, query: Dict[str, Any], update: Dict[str, Any], upsert: bool = False,
+                         **kwargs) -> Result:
+        with self._command("update"):
+            return self._update(query, update, upsert, many=False)
+
+    async def update_many(self, query: Dict[str, Any], update: Dict[str, Any], upsert: bool = False,
+                          **kwargs) -> Result:
+        with self._command("update"):
+            return self._update(query, update, upsert, many=True)
+
+    async def replace_one(self, query: Dict[str, Any], replacement: Dict[str, Any], upsert: bool = False,
+                          **kwargs) -> Result:
+        with self._command("update"):
+            return self._update(query, replacement, upsert, many=False)
+
+    async def find_one_and_update(self, query: Dict[str, Any], update: Dict[str, Any], projection=None,
+                                  upsert: bool = False, return_document: bool = False, **kwargs):
+        with self._command("findAndModify"):
+            docs = self._find(query)[:1]
+            if not docs:
+                if not upsert:
+                    return None
+                _id = self._upsert(query, update)
+                return _project(self.docs[_id], projection) if return_document else None
+            before = _project(docs[0], projection)
+            self._update_doc(docs[0], update)
+            return _project(docs[0], projection) if return_document else before
+
+    def _delete(self, query: Dict[str, Any], many: bool) -> Result:
+        docs = self._find(query)
+        if not many:
+            docs = docs[:1]
+        for doc in docs:
+            self._unregister(doc)
+            del self.docs[doc["_id"]]
+            del self.positions[doc["_id"]]
+        return Result(deleted_count=len(docs))
+
+    async def delete_one(self, query: Dict[str, Any], **kwargs) -> Result:
+        with self._command("delete"):
+            return self._delete(query, many=False)
+
+    async def delete_many(self, query: Dict[str, Any], **kwargs) -> Result:
+        with self._command("delete"):
+            return self._delete(query, many=True)
+
+    async def bulk_write(self, requests: List[Any], ordered: bool = True, **kwargs) -> Result:
+        with self._command("bulkWrite"):
+            modified = 0
+            for operation in requests:
+                kind = type(operation).__name__
+                if kind == "InsertOne":
+                    self._insert(operation._doc)
+                elif kind in ("UpdateOne", "UpdateMany", "ReplaceOne"):
+                    result = self._update(operation._filter, operation._doc, bool(operation._upsert),
+                                          many=kind == "UpdateMany")
+                    modified += result.modified_count
+                elif kind in ("DeleteOne", "DeleteMany"):
+                    self._delete(operation._filter, many=kind == "DeleteMany")
+                else:
+                    raise NotImplementedError(f"memory_mongo 不支持批量操作 {kind}")
+            return Result(modified_count=modified)
+
+
+class MemoryDatabase:
+    """数据库视图：数据在所有客户端之间共享，命令事件发给发起命令的客户端的监听器"""
+
+    def __init__(self, client: "MemoryMongoClient", name: str, collections: Dict[str, MemoryCollection]):
+        self.client = client
+        self.name = name
+        self.collections = collections
+
+    def __getitem__(self, name: str) -> MemoryCollection:
+        collection = self.collections.get(name)
+        if collection is None:
+            collection = self.collections[name] = MemoryCollection(self, name)
+        if collection.database is self:
+            return collection
+        # 浅拷贝共享文档和索引，只把所属数据库（监听器）换成本视图
+        view = copy.copy(collection)
+        view.database = self
+        return view
+
+
+class _CommandScope:
+    """向监听器发布 started / succeeded / failed 事件"""
+    __slots__ = ('listeners', 'event', 'started')
+
+    def __init__(self, listeners, event: CommandEvent):
+        self.listeners = listeners
+        self.event = event
+        self.started = 0.0
+
+    def __enter__(self):
+        for listener in self.listeners:
+            listener.started(self.event)
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.event.duration_micros = int((time.perf_counter() - self.started) * 1e6)
+        for listener in self.listeners:
+            if exc_type is None:
+                listener.succeeded(self.event)
+            else:
+                self.event.failure = {"errmsg": str(exc)}
+                listener.failed(self.event)
+        return False
+
+
+class MemoryMongoClient:
+    """AsyncMongoClient 的替身；同一进程内所有实例共享数据"""
+    # 数据库名 -> 集合名 -> 集合
+    databases: Dict[str, Dict[str, MemoryCollection]] = {}
+
+    def __init__(self, host: Any = None, event_listeners: Optional[List[Any]] = None, **kwargs):
+        self.listeners = list(event_listeners or ())
+
+    def __getitem__(self, name: str) -> MemoryDatabase:
+        return MemoryDatabase(self, name, self.databases.setdefault(name, {}))
+
+    def _command(self, database: str, name: str) -> _CommandScope:
+        return _CommandScope(self.listeners, CommandEvent(name, database, next(_request_ids)))
+
+    async def close(self):
+        pass
+
+    @classmethod
+    def reset(cls):
+        """清空所有数据"""
+        cls.databases.clear()
+
+
+def install():
+    """用内存替身替换 pymongo.AsyncMongoClient（在导入服务器模块之前调用）"""
+    pymongo.AsyncMongoClient = MemoryMongoClient
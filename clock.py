@@ -0,0 +1,42 @@
+# clock.py
+import asyncio
+import time
+from typing import Optional
+
+
+class CoarseClock:
+    """粗粒度单调时钟
+
+    事件循环每隔 resolution 秒刷新一次缓存的 now（time.monotonic() 刻度），
+    热路径上读取 now 只是属性访问，不创建任何对象；需要展示时再用 to_wall 换算成墙上时间。
+    """
+    __slots__ = ('now', 'resolution', '_handle')
+
+    def __init__(self, resolution: float = 0.1):
+        self.now = time.monotonic()
+        self.resolution = resolution
+        self._handle: Optional[asyncio.TimerHandle] = None
+
+    def start(self):
+        """在当前事件循环上开始刷新"""
+        if self._handle is None:
+            self._tick()
+
+    def stop(self):
+        """停止刷新"""
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    def _tick(self):
+        self.now = time.monotonic()
+        self._handle = asyncio.get_running_loop().call_later(self.resolution, self._tick)
+
+    @staticmethod
+    def to_wall(ticks: float) -> float:
+        """把单调时钟刻度换算为墙上时间戳"""
+        return time.time() - (time.monotonic() - ticks)
+
+
+# 进程级共享时钟
+coarse_clock = CoarseClock()
@@ -14,9 +14,16 @@ class Config:
     PORT = os.environ.get('MONGO_PORT')
     AUTH_SOURCE = os.environ.get('MONGO_AUTH_SOURCE')
 
-    # __getattr__ = os.environ.get('MONGO_METHOD')
-    def __getattr__(self, item):
-        if item == "mongo_uri":
-            return f"mongodb://{self.USER}:{self.PASSWORD}@{self.HOST}:{self.PORT}/?authSource={self.AUTH_SOURCE}"
-        else:
-            return super().__getattribute__(item)
+    # 运行时调优（默认值即标准 asyncio 行为，便于与调优后对比压测）
+    USE_UVLOOP = os.environ.get('IM_USE_UVLOOP', '0') == '1'
+    LOOP_DEBUG = os.environ.get('IM_LOOP_DEBUG', '0') == '1'
+    GC_THRESHOLD = os.environ.get('IM_GC_THRESHOLD', '')  # 例如 "50000,20,20"
+    GC_FREEZE = os.environ.get('IM_GC_FREEZE', '0') == '1'
+    EXECUTOR_WORKERS = int(os.environ.get('IM_EXECUTOR_WORKERS', '0'))  # 0 表示使用默认大小
+    METRICS_PORT = int(os.environ.get('IM_METRICS_PORT', '0'))  # Prometheus 指标端口，0 表示不开启
+    SLOW_QUERY_MS = float(os.environ.get('IM_SLOW_QUERY_MS', '100'))  # 慢查询阈值（毫秒），0 表示不记录
+
+    # 各管理器在导入时读取 Config.mongo_uri（类属性）：MONGO_URI 优先，其次由 MONGO_* 拼接，都未配置时连本机
+    mongo_uri = os.environ.get('MONGO_URI') or (
+        f"mongodb://{USER}:{PASSWORD}@{HOST}:{PORT}/?authSource={AUTH_SOURCE}" if HOST
+        else "mongodb://localhost:27017")
@@ -1,45 +1,54 @@
 # context.py
-import asyncio
 import contextvars
 from typing import Optional, Any, Dict
-import weakref
 
 
 class RequestContext:
-    """请求上下文（类似 Flask 的 request 上下文）"""
-    __slots__ = ('_server_ref', '_connection_id', '_request_data',
-                 '_cached_connection', '_cached_user', '_cached_user_id', 'request_id')
-
-    def __init__(self, server, connection_id: str, request_data: Dict[str, Any], request_id: str):
-        self._server_ref = weakref.ref(server)
-        self._connection_id = connection_id
-        self._request_data = request_data
+    """请求上下文（类似 Flask 的 request 上下文）
+
+    全部是 __slots__ 上的普通属性，直接引用 server（服务器与进程同生命周期，无需 weakref）；
+    自身就是上下文管理器，进入/退出只设置/重置一次 ContextVar，每个请求只分配这一个对象。
+    """
+    __slots__ = ('server', 'connection_id', 'request_data', 'request_id', 'data', 'g',
+                 'fanout', 'db_calls', '_cached_connection', '_cached_user', '_cached_user_id', '_token')
+
+    def __init__(self, server, connection_id: str, request_data: Dict[str, Any], request_id: str = None):
+        self.server = server
+        self.connection_id = connection_id
+        self.request_data = request_data
+        self.request_id = request_id
+        # 请求数据中的 data 字段（request.data）
+        self.data = request_data.get("data", {})
+        # 请求级的 g 数据，首次使用时创建
+        self.g: Optional[Dict[str, Any]] = None
+        # 本次请求的推送接收者数和数据库命令数（用于请求指标）
+        self.fanout = 0
+        self.db_calls = 0
         self._cached_connection = None
         self._cached_user = None
         self._cached_user_id = None
-        self.request_id = request_id
+        self._token = None
 
-    @property
-    def server(self):
-        s = self._server_ref()
-        if s is None:
-            raise RuntimeError("Server instance has been garbage collected")
-        return s
+    def __enter__(self) -> "RequestContext":
+        self._token = _request_ctx_var.set(self)
+        return self
 
-    @property
-    def connection_id(self):
-        return self._connection_id
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        _request_ctx_var.reset(self._token)
+        return False  # 不抑制异常
 
-    @property
-    def request_data(self):
-        return self._request_data
+    async def __aenter__(self) -> "RequestContext":
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        return self.__exit__(exc_type, exc_val, exc_tb)
 
     @property
     def connection(self):
         """懒加载连接对象"""
         if self._cached_connection is None:
             self._cached_connection = (
-                self.server.connection_manager.get_connection_by_id(self._connection_id)
+                self.server.connection_manager.get_connection_by_id(self.connection_id)
             )
         return self._cached_connection
 
@@ -57,6 +66,12 @@ class RequestContext:
             self._cached_user_id = conn.user_id if conn else None
         return self._cached_user_id
 
+    @user_id.setter
+    def user_id(self, value):
+        """指定本次请求的用户（连接未绑定会话、只携带 Token 的请求）"""
+        self._cached_user_id = value
+        self._cached_user = None
+
     @property
     def user(self):
         """懒加载用户对象"""
@@ -82,19 +97,16 @@ class RequestContext:
         return self.server.offline_store
 
 
+# 兼容旧名称：RequestContext 本身就是上下文管理器
+RequestContextManager = RequestContext
+
+
 class AppContext:
-    """应用上下文（类似 Flask 的 app 上下文）"""
-    __slots__ = ('_server_ref',)
+    """应用上下文（类似 Flask 的 app 上下文），每个服务器创建一次，整个进程共享"""
+    __slots__ = ('server',)
 
     def __init__(self, server):
-        self._server_ref = weakref.ref(server)
-
-    @property
-    def server(self):
-        s = self._server_ref()
-        if s is None:
-            raise RuntimeError("Server instance has been garbage collected")
-        return s
+        self.server = server
 
 
 # 使用 contextvars 实现异步安全的上下文局部变量
@@ -102,40 +114,16 @@ _request_ctx_var: contextvars.ContextVar[Optional[RequestContext]] = contextvars
     'request_context', default=None
 )
 
-_app_ctx_var: contextvars.ContextVar[Optional[AppContext]] = contextvars.ContextVar(
-    'app_context', default=None
-)
+# 进程级应用上下文（整个进程共享，无需 ContextVar）
+_app_ctx: Optional[AppContext] = None
 
 
-# 上下文管理器
-class RequestContextManager:
-    """请求上下文管理器"""
+def set_app_context(app_ctx: Optional[AppContext]):
+    """设置进程级应用上下文（服务器创建时调用）"""
+    global _app_ctx
+    _app_ctx = app_ctx
 
-    def __init__(self, server, connection_id: str, request_data: Dict[str, Any], request_id: str = None):
-        self.server = server
-        self.connection_id = connection_id
-        self.request_data = request_data
-        self.request_id = request_id
-        self.request_ctx_token = None
-        self.app_ctx_token = None
-
-    async def __aenter__(self):
-        # 创建应用上下文
-        app_ctx = AppContext(self.server)
-        self.app_ctx_token = _app_ctx_var.set(app_ctx)
-
-        # 创建请求上下文
-        request_ctx = RequestContext(self.server, self.connection_id, self.request_data, request_id=self.request_id)
-        self.request_ctx_token = _request_ctx_var.set(request_ctx)
-
-        return request_ctx
 
-    async def __aexit__(self, exc_type, exc_val, exc_tb):
-        # 清理上下文
-        if self.request_ctx_token:
-            _request_ctx_var.reset(self.request_ctx_token)
-
-        if self.app_ctx_token:
-            _app_ctx_var.reset(self.app_ctx_token)
-
-        return False  # 不抑制异常
+def get_app_context() -> Optional[AppContext]:
+    """获取当前应用上下文"""
+    return _app_ctx
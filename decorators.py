@@ -1,12 +1,8 @@
-import datetime
-
-from global_proxy import request
-
 import functools
-import datetime
 from typing import Callable, Any
 
 from global_proxy import request
+from middleware import Blueprint, check_login
 
 
 def need_login(func: Callable) -> Callable:
@@ -17,41 +13,67 @@ def need_login(func: Callable) -> Callable:
         @need_login
         async def protected_handler():
             return {"message": "认证成功"}
+
+    新代码优先使用 @server.route("/protected", require_auth=True)，由中间件管道完成验证
     """
 
     @functools.wraps(func)
     async def wrapper(*args, **kwargs) -> Any:
-        # 获取token（支持多种方式）
-        data = request.data
-
-        # 方式1：从data中获取
-        token = data.get('token')
-
-        # 方式2：从headers中获取（如果支持）
-        # token = request.headers.get('Authorization', '').replace('Bearer ', '')
-
-        if not token:
-            return {
-                "endpoint": "/error",
-                "data": {
-                    "message": "缺少token",
-                    "code": 401
-                },
-                "timestamp": int(datetime.datetime.now().timestamp())
-            }
-
-        # 验证token
-        if not request.server.jwt_manager.verify_token(token):
-            return {
-                "endpoint": "/error",
-                "data": {
-                    "message": "token无效或已过期",
-                    "code": 401
-                },
-                "timestamp": int(datetime.datetime.now().timestamp())
-            }
+        error = await check_login()
+        if error is not None:
+            return error
 
         # 认证通过，执行原函数
         return await func(*args, **kwargs)
 
     return wrapper  # ✅ 返回包装函数，而不是调用结果
+
+
+# Flask 风格别名
+login_required = need_login
+
+
+def idempotent(func: Callable) -> Callable:
+    """
+    发送去重装饰器：同一发送者在去重窗口内向同一 endpoint 以相同 client_msg_id 重试时，直接重放首次的响应
+    使用示例：
+        @server.route("/message/send", require_auth=True)
+        @idempotent
+        async def handle_message_send():
+            ...
+    """
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs) -> Any:
+        client_msg_id = request.data.get('client_msg_id')
+        user_id = request.user_id
+        if not client_msg_id or user_id is None:
+            return await func(*args, **kwargs)
+
+        cache = request.server.send_dedupe
+        # 不同 endpoint 的 client_msg_id 互不影响，不会把私聊的响应重放给群聊发送
+        key = (user_id, request.endpoint, client_msg_id)
+        original = await cache.acquire(key)
+        if original is not None:
+            return dict(original)
+
+        response = None
+        try:
+            response = await func(*args, **kwargs)
+        finally:
+            # 只缓存成功的响应，失败的请求允许重试
+            if response and response.get("code") in (200, 202):
+                cache.complete(key, response)
+            else:
+                cache.release(key)
+        return response
+
+    return wrapper
+
+
+# 默认蓝图：模块级的 route / before_request / after_request，
+# 通过 server.register_blueprint(default_blueprint) 注册到服务器
+default_blueprint = Blueprint("default")
+route = default_blueprint.route
+before_request = default_blueprint.before_request
+after_request = default_blueprint.after_request
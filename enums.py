@@ -33,3 +33,20 @@ class GroupStatus(str, Enum):
     ACTIVE = "active"  # 活跃
     DISBANDED = "disbanded"  # 已解散
     FROZEN = "frozen"  # 冻结
+
+
+class OverflowPolicy(str, Enum):
+    """出站队列溢出策略（队列满时总是先丢弃输入状态/在线状态等低优先级消息）"""
+    DROP_LOW_PRIORITY = "drop_low_priority"  # 只丢弃消息，不做其他处理
+    DISCONNECT = "disconnect"  # 断开慢连接
+    SPILL_OFFLINE = "spill_offline"  # 转存离线消息
+
+
+class EnqueueResult(str, Enum):
+    """出站队列入队结果，只有 QUEUED 为真（已交给连接发送）"""
+    QUEUED = "queued"  # 已入队
+    SPILLED = "spilled"  # 队列已满，已转存离线消息
+    DROPPED = "dropped"  # 已丢弃（低优先级消息或连接已关闭）
+
+    def __bool__(self):
+        return self is EnqueueResult.QUEUED
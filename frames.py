@@ -0,0 +1,54 @@
+# frames.py
+import json
+from typing import Any, Dict, Iterable, Union
+
+
+class EncodedFrame:
+    """只编码一次、由多个接收者共享的不可变消息帧
+
+    群消息扇出时，所有接收者的出站队列和离线存储共享同一个帧对象，
+    JSON 编码只在第一次发送时进行一次，之后直接复用编码结果。
+    """
+    __slots__ = ('message', '_text')
+
+    def __init__(self, message: Dict[str, Any]):
+        object.__setattr__(self, 'message', message)
+        object.__setattr__(self, '_text', None)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("EncodedFrame is immutable")
+
+    @property
+    def text(self) -> str:
+        """编码后的 JSON 文本（惰性编码，只编码一次）"""
+        text = self._text
+        if text is None:
+            text = json.dumps(self.message)
+            object.__setattr__(self, '_text', text)
+        return text
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """与 dict.get 一致，便于按 endpoint 等字段判断"""
+        return self.message.get(key, default)
+
+
+Frame = Union[Dict[str, Any], EncodedFrame]
+
+
+def unwrap(message: Frame) -> Dict[str, Any]:
+    """获取原始消息字典"""
+    return message.message if isinstance(message, EncodedFrame) else message
+
+
+def encode(message: Frame) -> str:
+    """编码单条消息，已编码的帧直接复用"""
+    if isinstance(message, EncodedFrame):
+        return message.text
+    return json.dumps(message)
+
+
+def encode_batch(messages: Iterable[Frame]) -> str:
+    """把多条消息编码为一个 /batch 帧，已编码的帧只做字符串拼接"""
+    parts = [encode(message) for message in messages]
+    return ('{"endpoint": "/batch", "data": {"messages": [' + ", ".join(parts)
+            + '], "count": ' + str(len(parts)) + '}}')
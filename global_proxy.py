@@ -3,16 +3,33 @@
 """
 from typing import Optional
 
-import IMWebSocketServer
 # 导入上下文变量
-from context import _request_ctx_var, _app_ctx_var, RequestContext, AppContext
+from context import _request_ctx_var, RequestContext, AppContext
+from context import get_app_context as _get_app_context
+
+_get_request_ctx = _request_ctx_var.get
+
+
+def _request_attribute(name: str, doc: str) -> property:
+    """直接读取请求上下文属性的快捷访问器（不经过 __getattr__）"""
+
+    def fget(self):
+        ctx = _get_request_ctx()
+        if ctx is None:
+            raise RuntimeError("Working outside of request context.")
+        return getattr(ctx, name)
+
+    return property(fget, doc=doc)
 
 
 class _RequestContextProxy:
-    """request 上下文代理（类似 Flask 的 request）"""
+    """request 上下文代理（类似 Flask 的 request）
+
+    常用属性定义为类属性上的快捷访问器，其余属性经 __getattr__ 转发到当前请求上下文。
+    """
 
     def __getattr__(self, name):
-        ctx = _request_ctx_var.get()
+        ctx = _get_request_ctx()
         if ctx is None:
             raise RuntimeError(
                 "Working outside of request context. "
@@ -21,7 +38,7 @@ class _RequestContextProxy:
         return getattr(ctx, name)
 
     def __setattr__(self, name, value):
-        ctx = _request_ctx_var.get()
+        ctx = _get_request_ctx()
         if ctx is None:
             raise RuntimeError(
                 "Working outside of request context. "
@@ -29,18 +46,18 @@ class _RequestContextProxy:
             )
         setattr(ctx, name, value)
 
-    @property
-    def data(self):
-        """快捷访问请求数据"""
-        ctx = _request_ctx_var.get()
-        if ctx is None:
-            raise RuntimeError("Working outside of request context.")
-        return ctx.request_data.get("data", {})
+    server = _request_attribute("server", "服务器实例")
+    data = _request_attribute("data", "快捷访问请求数据")
+    request_data = _request_attribute("request_data", "完整的请求消息")
+    request_id = _request_attribute("request_id", "请求 ID")
+    connection_id = _request_attribute("connection_id", "连接 ID")
+    connection = _request_attribute("connection", "连接对象")
+    user_id = _request_attribute("user_id", "当前用户 ID")
 
     @property
     def endpoint(self):
         """快捷访问 endpoint"""
-        ctx = _request_ctx_var.get()
+        ctx = _get_request_ctx()
         if ctx is None:
             raise RuntimeError("Working outside of request context.")
         return ctx.request_data.get("endpoint", "")
@@ -76,20 +93,12 @@ class _RequestContextProxy:
         role = self.group_manager.get_member_role(group_id, user_id)
         return role.value if role else None
 
-    @property
-    def server(self) -> IMWebSocketServer.IMWebSocketServer:
-        """快捷访问请求数据"""
-        ctx = _request_ctx_var.get()
-        if ctx is None:
-            raise RuntimeError("Working outside of request context.")
-        return ctx.get("server", {})
-
 
 class _AppContextProxy:
     """app 上下文代理（类似 Flask 的 current_app）"""
 
     def __getattr__(self, name):
-        ctx = _app_ctx_var.get()
+        ctx = _get_app_context()
         if ctx is None:
             raise RuntimeError(
                 "Working outside of application context. "
@@ -100,32 +109,44 @@ class _AppContextProxy:
     @property
     def server(self):
         """获取服务器实例"""
-        ctx = _app_ctx_var.get()
+        ctx = _get_app_context()
         if ctx is None:
             raise RuntimeError("Working outside of application context.")
         return ctx.server
 
 
 class _GlobalContextProxy:
-    """全局上下文（类似 Flask 的 g）"""
+    """全局上下文（类似 Flask 的 g，请求内的数据只对当前请求可见）"""
 
     def __init__(self):
         self._data = {}
 
+    def _store(self) -> dict:
+        ctx = _request_ctx_var.get()
+        if ctx is None:
+            # 请求之外使用进程级数据
+            return self._data
+        if ctx.g is None:
+            ctx.g = {}
+        return ctx.g
+
     def __getattr__(self, name):
-        return self._data.get(name)
+        return self._store().get(name)
 
     def __setattr__(self, name, value):
         if name == '_data':
             super().__setattr__(name, value)
         else:
-            self._data[name] = value
+            self._store()[name] = value
+
+    def __contains__(self, name):
+        return name in self._store()
 
     def get(self, name, default=None):
-        return self._data.get(name, default)
+        return self._store().get(name, default)
 
     def set(self, name, value):
-        self._data[name] = value
+        self._store()[name] = value
 
 
 # 创建全局代理对象
@@ -142,6 +163,6 @@ def get_request_context() -> Optional[RequestContext]:
 
 def get_app_context() -> Optional[AppContext]:
     """获取当前应用上下文"""
-    return _app_ctx_var.get()
+    return _get_app_context()
 
 # 在 global_proxy.py 中添加群聊相关的快捷方法
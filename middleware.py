@@ -0,0 +1,215 @@
+# middleware.py
+"""
+请求中间件管道
+
+中间件是 (server, handler, options) -> handler 的工厂函数，在注册路由时按 endpoint 预先组装成调用链；
+对某个 endpoint 不需要的中间件直接返回原 handler，不会出现在调用链中，分发时也不再查表。
+"""
+import datetime
+import logging
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from context import _request_ctx_var
+
+Handler = Callable[[], Awaitable[Optional[Dict[str, Any]]]]
+Middleware = Callable[[Any, Handler, "RouteOptions"], Handler]
+
+logger = logging.getLogger("Middleware")
+
+
+@dataclass(frozen=True)
+class RouteOptions:
+    """路由选项"""
+    endpoint: str
+    require_auth: bool = False
+    rate_limit: Optional[int] = None  # 每个连接的限额
+    user_rate_limit: Optional[int] = None  # 每个用户（所有设备合计）的限额
+    required_fields: Tuple[str, ...] = ()
+
+
+def error_response(message: str, code: int) -> Dict[str, Any]:
+    """构造错误响应"""
+    return {
+        "endpoint": "/error",
+        "data": {
+            "message": message,
+            "code": code
+        },
+        "timestamp": int(datetime.datetime.now().timestamp())
+    }
+
+
+async def check_login() -> Optional[Dict[str, Any]]:
+    """检查当前请求的登录状态，未通过时返回错误响应"""
+    ctx = _request_ctx_var.get()
+    server = ctx.server
+    connection = ctx.connection
+
+    # 快速路径：连接已绑定未过期、未吊销的会话，无需任何加解密
+    if (connection is not None and connection.authenticated
+            and connection.token_expires_at > time.time()
+            and not server.jwt_manager.is_revoked(connection.token_jti)):
+        return None
+
+    token = ctx.data.get('token')
+    if not token:
+        return error_response("缺少token", 401)
+
+    # 验证token
+    payload = await server.jwt_manager.verify_token_async(token)
+    if not payload:
+        return error_response("token无效或已过期", 401)
+
+    # 会话过期后用新Token续期
+    if connection is not None and connection.authenticated and payload.get("user_id") == connection.user_id:
+        server.connection_manager.bind_session(connection, payload)
+    else:
+        # 连接未绑定该用户的会话（只携带 Token 的请求），本次请求以 Token 中的用户处理
+        ctx.user_id = payload.get("user_id")
+    return None
+
+
+def timing_middleware(server, handler: Handler, options: RouteOptions) -> Handler:
+    """记录请求指标（耗时、错误、推送扇出、数据库命令数），并记录超过 slow_request_threshold 秒的慢请求"""
+    threshold = server.slow_request_threshold
+    observe = server.metrics.observe_request
+    endpoint = options.endpoint
+
+    async def timed():
+        started = time.perf_counter()
+        error = True
+        try:
+            response = await handler()
+            error = isinstance(response, dict) and (
+                response.get("endpoint") == "/error" or (response.get("code") or 200) >= 400)
+            return response
+        finally:
+            elapsed = time.perf_counter() - started
+            ctx = _request_ctx_var.get()
+            observe(endpoint, elapsed, error, ctx.fanout, ctx.db_calls)
+            if threshold and elapsed >= threshold:
+                logger.warning(f"慢请求 {endpoint}: {elapsed * 1000:.1f}ms")
+
+    return timed
+
+
+def rate_limit_middleware(server, handler: Handler, options: RouteOptions) -> Handler:
+    """按连接和用户的令牌桶限流"""
+    rate_limit, user_rate_limit = options.rate_limit, options.user_rate_limit
+    if not rate_limit and not user_rate_limit:
+        return handler
+    allow = server.rate_limiter.allow
+    endpoint = options.endpoint
+
+    async def rate_limited():
+        ctx = _request_ctx_var.get()
+        if rate_limit and not allow((ctx.connection_id, endpoint), rate_limit):
+            return error_response("请求过于频繁，请稍后再试", 429)
+        if user_rate_limit:
+            connection = ctx.connection
+            if (connection is not None and connection.user_id is not None
+                    and not allow((connection.user_id, endpoint), user_rate_limit)):
+                return error_response("请求过于频繁，请稍后再试", 429)
+        return await handler()
+
+    return rate_limited
+
+
+def hooks_middleware(server, handler: Handler, options: RouteOptions) -> Handler:
+    """执行 before_request / after_request 钩子"""
+    before = tuple(server.before_request_funcs)
+    after = tuple(server.after_request_funcs)
+    if not before and not after:
+        return handler
+
+    async def hooked():
+        for func in before:
+            # 钩子返回非空值时不再执行处理器
+            response = await func()
+            if response is not None:
+                break
+        else:
+            response = await handler()
+        for func in after:
+            response = await func(response)
+        return response
+
+    return hooked
+
+
+def auth_middleware(server, handler: Handler, options: RouteOptions) -> Handler:
+    """登录验证"""
+    if not options.require_auth:
+        return handler
+
+    async def authenticated():
+        error = await check_login()
+        if error is not None:
+            return error
+        return await handler()
+
+    return authenticated
+
+
+def validation_middleware(server, handler: Handler, options: RouteOptions) -> Handler:
+    """检查请求数据中的必填字段"""
+    required_fields = options.required_fields
+    if not required_fields:
+        return handler
+
+    async def validated():
+        data = _request_ctx_var.get().data
+        missing = [name for name in required_fields if data.get(name) in (None, "")]
+        if missing:
+            return error_response(f"缺少参数: {', '.join(missing)}", 400)
+        return await handler()
+
+    return validated
+
+
+# 默认中间件顺序（由外到内）
+DEFAULT_MIDDLEWARES: Tuple[Middleware, ...] = (
+    timing_middleware,
+    rate_limit_middleware,
+    hooks_middleware,
+    auth_middleware,
+    validation_middleware,
+)
+
+
+def compile_handler(server, handler: Handler, options: RouteOptions,
+                    middlewares: Iterable[Middleware]) -> Handler:
+    """把中间件按顺序组装到处理器外层"""
+    for middleware in reversed(list(middlewares)):
+        handler = middleware(server, handler, options)
+    return handler
+
+
+class Blueprint:
+    """路由蓝图：先收集路由和钩子，注册到服务器时统一编译"""
+
+    def __init__(self, name: str = "default"):
+        self.name = name
+        self.routes: Dict[str, Tuple[Handler, RouteOptions]] = {}
+        self.before_request_funcs: List[Callable] = []
+        self.after_request_funcs: List[Callable] = []
+
+    def route(self, endpoint: str, require_auth: bool = False, rate_limit: Optional[int] = None,
+              user_rate_limit: Optional[int] = None, required_fields: Iterable[str] = ()):
+        options = RouteOptions(endpoint, require_auth, rate_limit, user_rate_limit, tuple(required_fields))
+
+        def wrapper(func):
+            self.routes[endpoint] = (func, options)
+            return func
+
+        return wrapper
+
+    def before_request(self, func):
+        self.before_request_funcs.append(func)
+        return func
+
+    def after_request(self, func):
+        self.after_request_funcs.append(func)
+        return func
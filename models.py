@@ -1,9 +1,10 @@
 import datetime
 from dataclasses import dataclass, field
-from typing import Dict, List, Optional, Any, Callable, Set
+from typing import Dict, List, Optional, Any, Callable, Set, Tuple
 
 from websockets import ServerConnection
 
+from clock import coarse_clock
 from enums import GroupStatus, GroupRole, UserStatus, MessageType
 
 
@@ -52,18 +53,24 @@ class User:
     contact_list: List[int] = field(default_factory=list)  # 联系人ID列表
 
 
-@dataclass
+@dataclass(slots=True)
 class ClientConnection:
-    """客户端连接信息"""
+    """客户端连接信息（__slots__，每个连接不再携带实例 __dict__）"""
     connection_id: str
     websocket: ServerConnection
     user_id: Optional[int] = None
     device_id: Optional[str] = None
     authenticated: bool = False
-    last_heartbeat: datetime.datetime = field(default_factory=datetime.datetime.now)
-    last_activity: datetime.datetime = field(default_factory=datetime.datetime.now)
-    created_at: datetime.datetime = field(default_factory=datetime.datetime.now)
-    client_info: Dict[str, Any] = field(default_factory=dict)
+    # 连接级会话：登录或重连时绑定一次，之后按过期时间复核
+    token_jti: Optional[str] = None
+    token_expires_at: int = 0
+    scopes: Tuple[str, ...] = ()
+    # 单调时钟刻度（coarse_clock.now），展示时用 coarse_clock.to_wall 换算
+    last_heartbeat: float = field(default_factory=lambda: coarse_clock.now)
+    last_activity: float = field(default_factory=lambda: coarse_clock.now)
+    created_at: float = field(default_factory=lambda: coarse_clock.now)
+    client_info: Optional[Dict[str, Any]] = None  # 按需创建
+    writer: Optional[Any] = None  # ConnectionWriter，出站发送队列
 
 
 @dataclass
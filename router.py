@@ -3,9 +3,10 @@ import uuid
 from typing import Optional
 
 from IMWebSocketServer import IMWebSocketServer
-from enums import UserStatus, MessageType, GroupRole, GroupStatus
+from enums import UserStatus, MessageType, GroupRole, GroupStatus, EnqueueResult
 from global_proxy import request
-from decorators import need_login
+from decorators import idempotent
+from frames import EncodedFrame
 
 server = IMWebSocketServer(
     host="0.0.0.0",
@@ -15,7 +16,7 @@ server = IMWebSocketServer(
 )
 
 
-@server.route("/auth/login")
+@server.route("/auth/login", rate_limit=10)
 async def handle_login():
     """处理登录请求"""
     request.server.connection_manager.get_connection_by_id(request.connection_id)
@@ -59,10 +60,15 @@ async def handle_login():
         }
 
     # 生成Token
-    token = request.server.jwt_manager.create_token(user.user_id, user.username)
+    token = await request.server.jwt_manager.create_token_async(user.user_id, user.username)
+    # 签发时payload已进入缓存，这里不会再次验签
+    token_payload = request.server.jwt_manager.verify_token(token)
 
-    # 认证连接
-    await request.server.connection_manager.authenticate_connection(request.connection_id, user.user_id)
+    # 认证连接并绑定会话
+    await request.server.authenticate_connection(request.connection_id, user.user_id, token_payload)
+    # 订阅联系人的状态变更，并通知订阅者本用户上线
+    request.server.presence.subscribe_contacts(request.connection_id, user.user_id, user.contact_list)
+    await request.server.notify_user_online(user.user_id, user.username, user.nickname)
 
     # 更新用户状态
     user.status = UserStatus.ONLINE
@@ -94,8 +100,7 @@ async def handle_login():
     return response
 
 
-@server.route("/auth/logout")
-@need_login
+@server.route("/auth/logout", require_auth=True)
 async def handle_logout():
     """处理登出请求"""
     connection = request.server.connection_manager.get_connection_by_id(request.connection_id)
@@ -109,7 +114,7 @@ async def handle_logout():
             "timestamp": int(datetime.datetime.now().timestamp())
         }
 
-    token = request.data.get("data", {}).get("token")
+    token = request.data.get("token")
     if token:
         request.server.jwt_manager.revoke_token(token)
 
@@ -140,11 +145,10 @@ async def handle_token_verify():
 
     token = data.get("data", {}).get("token")
     if not token:
-        await self.send_error(connection.websocket,
-                              "Token不能为空", 400, request_id)
+        await self.send_error_to_connection(connection, "Token不能为空", 400, request_id)
         return
 
-    payload = self.jwt_manager.verify_token(token)
+    payload = await self.jwt_manager.verify_token_async(token)
 
     response = {
         "endpoint": "/auth/verify_response",
@@ -158,12 +162,11 @@ async def handle_token_verify():
     if request_id:
         response["request_id"] = request_id
 
-    await self.send_message(connection.websocket, response)
+    await self.send_to_connection(connection, response)
 
 
 # 联系人处理器
-@server.route("/contacts/list")
-@need_login
+@server.route("/contacts/list", require_auth=True)
 async def handle_contacts_list():
     self = request.server
     data = request.data
@@ -179,7 +182,7 @@ async def handle_contacts_list():
     contacts = await self.user_manager.get_user_contacts(user_id)
     for contact in contacts:
         # 检查在线状态
-        is_online = self.connection_manager.is_user_online(contact.user_id)
+        is_online = await self.connection_manager.is_user_online_anywhere(contact.user_id)
         status = UserStatus.ONLINE if is_online else UserStatus.OFFLINE
 
         contacts_data.append({
@@ -208,8 +211,7 @@ async def handle_contacts_list():
     return response
 
 
-@server.route("/contacts/search")
-@need_login
+@server.route("/contacts/search", require_auth=True)
 async def handle_contacts_search():
     self = request.server
     data = request.data
@@ -218,8 +220,7 @@ async def handle_contacts_search():
     """搜索用户"""
     connection = self.connection_manager.get_connection_by_id(connection_id)
     if not connection or not connection.authenticated:
-        await self.send_error(connection.websocket,
-                              "未登录", 401, request_id)
+        await self.send_error_to_connection(connection, "未登录", 401, request_id)
         return
 
     search_data = data.get("data", {})
@@ -227,8 +228,7 @@ async def handle_contacts_search():
     limit = search_data.get("limit", 20)
 
     if not keyword or len(keyword.strip()) < 2:
-        await self.send_error(connection.websocket,
-                              "搜索关键词至少2个字符", 400, request_id)
+        await self.send_error_to_connection(connection, "搜索关键词至少2个字符", 400, request_id)
         return
 
     # 搜索用户
@@ -236,7 +236,7 @@ async def handle_contacts_search():
     users_data = []
 
     for user in users:
-        is_online = self.connection_manager.is_user_online(user.user_id)
+        is_online = await self.connection_manager.is_user_online_anywhere(user.user_id)
         status = UserStatus.ONLINE if is_online else UserStatus.OFFLINE
 
         users_data.append({
@@ -263,11 +263,10 @@ async def handle_contacts_search():
     if request_id:
         response["request_id"] = request_id
 
-    await self.send_message(connection.websocket, response)
+    await self.send_to_connection(connection, response)
 
 
-@server.route("/contacts/add")
-@need_login
+@server.route("/contacts/add", require_auth=True)
 async def handle_contacts_add():
     self = request.server
     data = request.data
@@ -276,8 +275,7 @@ async def handle_contacts_add():
     """添加联系人"""
     connection = self.connection_manager.get_connection_by_id(connection_id)
     if not connection or not connection.authenticated:
-        await self.send_error(connection.websocket,
-                              "未登录", 401, request_id)
+        await self.send_error_to_connection(connection, "未登录", 401, request_id)
         return
 
     add_data = data.get("data", {})
@@ -285,15 +283,13 @@ async def handle_contacts_add():
     add_data.get("message", "")
 
     if not target_user_id:
-        await self.send_error(connection.websocket,
-                              "目标用户ID不能为空", 400, request_id)
+        await self.send_error_to_connection(connection, "目标用户ID不能为空", 400, request_id)
         return
 
     # 检查目标用户是否存在
     target_user = await self.user_manager.get_user_by_id(target_user_id)
     if not target_user:
-        await self.send_error(connection.websocket,
-                              "目标用户不存在", 404, request_id)
+        await self.send_error_to_connection(connection, "目标用户不存在", 404, request_id)
         return
 
     # 这里简化处理，直接添加为联系人
@@ -320,12 +316,12 @@ async def handle_contacts_add():
     if request_id:
         response["request_id"] = request_id
 
-    await self.send_message(connection.websocket, response)
+    await self.send_to_connection(connection, response)
 
 
-@server.route("/message/send")
+@server.route("/message/send", rate_limit=50, user_rate_limit=100, require_auth=True)
 # 消息处理器
-@need_login
+@idempotent
 async def handle_message_send():
     self = request.server
     data = request.data
@@ -334,8 +330,7 @@ async def handle_message_send():
     request_id: Optional[str] = None
     connection = self.connection_manager.get_connection_by_id(connection_id)
     if not connection or not connection.authenticated:
-        await self.send_error(connection.websocket,
-                              "未登录", 401, request_id)
+        await self.send_error_to_connection(connection, "未登录", 401, request_id)
         return
 
     msg_data = data
@@ -345,16 +340,14 @@ async def handle_message_send():
     client_msg_id = msg_data.get("client_msg_id")
 
     if not receiver_id:
-        await self.send_error(connection.websocket,
-                              "接收者ID不能为空", 400, request_id)
+        await self.send_error_to_connection(connection, "接收者ID不能为空", 400, request_id)
         return
 
     # 检查接收者是否存在
     receiver = await self.user_manager.get_user_by_id(receiver_id)
     print(receiver_id)
     if not receiver:
-        await self.send_error(connection.websocket,
-                              "接收者不存在", 404, request_id)
+        await self.send_error_to_connection(connection, "接收者不存在", 404, request_id)
         return
 
     sender_id = connection.user_id
@@ -384,11 +377,32 @@ async def handle_message_send():
         }
     }
 
+    # 先保存（分配接收者的收件序号），再推送，推送的消息携带序号
+    saved_message = {
+        "message_id": message_id,
+        "sender_id": sender_id,
+        "receiver_id": receiver_id,
+        "type": "text",
+        "content": content,
+        "timestamp": timestamp,
+        "client_msg_id": client_msg_id,
+        "delivered": False,
+        "read": False,
+        "created_at": datetime.datetime.now(),
+        "is_group": False
+    }
+    duplicate = await server.message_manager.save_private_message(saved_message) != message_id
+    receive_message["data"]["seq"] = saved_message.get("seq")
+    if duplicate:
+        # 去重缓存未命中但数据库中已有同一 client_msg_id 的消息：不再推送，返回首次保存的消息ID
+        message_id, timestamp = saved_message["message_id"], saved_message["timestamp"]
+
     # 检查接收者是否在线
-    delivered = False
-    if self.connection_manager.is_user_online(receiver_id):
+    pushed = EnqueueResult.DROPPED
+    if not duplicate and await self.connection_manager.is_user_online_anywhere(receiver_id):
         # 尝试发送消息
-        delivered = await self.push_message_to_user(receiver_id, receive_message)
+        pushed = await self.push_message_to_user(receiver_id, receive_message)
+    delivered = bool(pushed)
 
     # 发送响应给发送者
     response = {
@@ -406,26 +420,13 @@ async def handle_message_send():
     if request_id:
         response["request_id"] = request_id
 
-    await self.send_message(connection.websocket, response)
-    await server.message_manager.save_private_message({
-        "message_id": message_id,
-        "sender_id": sender_id,
-        "receiver_id": receiver_id,
-        "type": "text",
-        "content": content,
-        "timestamp": timestamp,
-        "client_msg_id": msg_data['client_msg_id'],
-        "delivered": False,
-        "read": False,
-        "created_at": datetime.datetime.now(),
-        "is_group": False
-    })
-
-    # 如果未送达，存储为离线消息
-    if not delivered:
-        await self.offline_store.add_offline_message(receiver_id, receive_message)
+    # 如果未送达，在后台存储为离线消息（出站队列溢出时已经转存过）
+    if pushed is EnqueueResult.DROPPED and not duplicate:
+        self.spawn(self.offline_store.add_offline_message(receiver_id, receive_message))
         self.logger.info(f"消息 {message_id} 存储为离线消息，接收者: {receiver_id}")
 
+    return response
+
 
 @server.route("/message/read_receipt")
 async def handle_message_read_receipt():
@@ -436,8 +437,7 @@ async def handle_message_read_receipt():
     """处理已读回执"""
     connection = self.connection_manager.get_connection_by_id(connection_id)
     if not connection or not connection.authenticated:
-        await self.send_error(connection.websocket,
-                              "未登录", 401, request_id)
+        await self.send_error_to_connection(connection, "未登录", 401, request_id)
         return
 
     receipt_data = data.get("data", {})
@@ -445,12 +445,11 @@ async def handle_message_read_receipt():
     message_ids = receipt_data.get("message_ids", [])
 
     if not message_ids:
-        await self.send_error(connection.websocket,
-                              "消息ID列表不能为空", 400, request_id)
+        await self.send_error_to_connection(connection, "消息ID列表不能为空", 400, request_id)
         return
 
     # 发送已读回执给发送者
-    if sender_id and self.connection_manager.is_user_online(sender_id):
+    if sender_id and await self.connection_manager.is_user_online_anywhere(sender_id):
         receipt_message = {
             "endpoint": "/message/read_receipt",
             "data": {
@@ -474,11 +473,10 @@ async def handle_message_read_receipt():
     if request_id:
         response["request_id"] = request_id
 
-    await self.send_message(connection.websocket, response)
+    await self.send_to_connection(connection, response)
 
 
-@server.route("/message/typing")
-@need_login
+@server.route("/message/typing", require_auth=True)
 async def handle_message_typing():
     self = request.server
     data = request.data
@@ -491,12 +489,11 @@ async def handle_message_typing():
     is_typing = typing_data.get("is_typing", False)
 
     if not receiver_id:
-        await self.send_error(connection.websocket,
-                              "接收者ID不能为空", 400, request_id)
+        await self.send_error_to_connection(connection, "接收者ID不能为空", 400, request_id)
         return
 
     # 发送正在输入状态给接收者
-    if self.connection_manager.is_user_online(receiver_id):
+    if await self.connection_manager.is_user_online_anywhere(receiver_id):
         typing_message = {
             "endpoint": "/message/typing",
             "data": {
@@ -521,10 +518,10 @@ async def handle_message_typing():
     if request_id:
         response["request_id"] = request_id
 
-    await self.send_message(connection.websocket, response)
+    await self.send_to_connection(connection, response)
 
 
-@server.route("/heartbeat")
+@server.route("/heartbeat", rate_limit=1000)
 # 心跳处理器
 async def handle_heartbeat():
     self: IMWebSocketServer = request.server
@@ -554,7 +551,7 @@ async def handle_heartbeat():
         if request_id:
             response["request_id"] = request_id
 
-        await self.send_message(connection.websocket, response)
+        await self.send_to_connection(connection, response)
 
 
 @server.route("/system/info")
@@ -578,6 +575,11 @@ async def handle_system_info():
             "heartbeat_interval": self.heartbeat_interval,
             "heartbeat_timeout": self.heartbeat_timeout,
             "connection_stats": conn_stats,
+            "crypto_executor": self.crypto_executor.get_stats(),
+            "presence": self.presence.get_stats(),
+            "send_dedupe": self.send_dedupe.get_stats(),
+            "rate_limiter": self.rate_limiter.get_stats(),
+            "mongo": self.mongo_monitor.get_stats(),
             "total_users": len(list(self.user_manager.db.find({})))
             #     todo
         },
@@ -587,11 +589,20 @@ async def handle_system_info():
     if request_id:
         response["request_id"] = request_id
 
-    await self.send_message(connection.websocket, response)
+    await self.send_to_connection(connection, response)
+
+
+@server.route("/system/metrics", require_auth=True)
+async def handle_system_metrics():
+    """获取按 endpoint 统计的请求指标"""
+    return {
+        "endpoint": "/system/metrics_response",
+        "data": request.server.metrics.snapshot(),
+        "code": 200
+    }
 
 
-@server.route('/history/get')
-@need_login
+@server.route('/history/get', require_auth=True)
 async def handle_history_get():
     self: IMWebSocketServer = request.server
     data = request.data
@@ -600,7 +611,7 @@ async def handle_history_get():
     connection_id = request.connection_id
     if data['target_type'] == "user":
         messages = await self.message_manager.get_private_messages(
-            user1_id=self.jwt_manager.get_user_id_from_token(data["token"]), user2_id=user_id,
+            user1_id=request.user_id, user2_id=user_id,
             start_time=data.get("start_time"),
             limit=data.get('limit', 50), end_time=data["end_time"], )
         print("handle_history_get", messages)
@@ -620,8 +631,7 @@ async def handle_history_get():
     }
 
 
-@server.route("/group/create")
-@need_login
+@server.route("/group/create", require_auth=True)
 async def handle_group_create():
     """创建群组"""
     data = request.data
@@ -695,11 +705,10 @@ async def handle_group_create():
 
 
 # 群聊开始
-@server.route("/group/list")
-@need_login
+@server.route("/group/list", require_auth=True)
 async def handle_group_list():
     """获取用户加入的群组列表"""
-    user_id = request.server.jwt_manager.get_user_id_from_token(request.request_data["data"]["token"])
+    user_id = request.user_id
     group_manager = request.server.group_manager
     groups = await group_manager.get_user_groups(user_id)
     groups_data = []
@@ -731,8 +740,7 @@ async def handle_group_list():
     }
 
 
-@server.route("/group/info")
-@need_login
+@server.route("/group/info", require_auth=True)
 async def handle_group_info():
     """获取群组详细信息"""
     data = request.data
@@ -787,6 +795,7 @@ async def handle_group_info():
     members = await group_manager.get_group_members(group_id)
 
     members_data = []
+    online = await request.server.connection_manager.filter_online_anywhere(member.user_id for member in members)
     for member in members:
         # 获取用户信息
         user_info = await request.server.user_manager.get_user_by_id(member.user_id)
@@ -799,7 +808,7 @@ async def handle_group_info():
                 "role": member.role.value,
                 "joined_at": member.joined_at,
                 "group_nickname": member.nickname,
-                "is_online": request.server.connection_manager.is_user_online(member.user_id)
+                "is_online": member.user_id in online
             })
 
     # 获取用户在群中的角色
@@ -830,8 +839,7 @@ async def handle_group_info():
     }
 
 
-@server.route("/group/join")
-@need_login
+@server.route("/group/join", require_auth=True)
 async def handle_group_join():
     """加入群组"""
     data = request.data
@@ -923,8 +931,7 @@ async def handle_group_join():
     }
 
 
-@server.route("/group/invite")
-@need_login
+@server.route("/group/invite", require_auth=True)
 async def handle_group_invite():
     """邀请用户加入群组"""
     data = request.data
@@ -1009,7 +1016,7 @@ async def handle_group_invite():
             continue
 
         # 发送邀请通知给被邀请者
-        if request.server.connection_manager.is_user_online(invitee_id):
+        if await request.server.connection_manager.is_user_online_anywhere(invitee_id):
             invitation_message = {
                 "endpoint": "/group/invitation_received",
                 "data": {
@@ -1043,8 +1050,7 @@ async def handle_group_invite():
     }
 
 
-@server.route("/group/leave")
-@need_login
+@server.route("/group/leave", require_auth=True)
 async def handle_group_leave():
     """退出群组"""
     data = request.data
@@ -1140,8 +1146,7 @@ async def handle_group_leave():
     }
 
 
-@server.route("/group/kick")
-@need_login
+@server.route("/group/kick", require_auth=True)
 async def handle_group_kick():
     """踢出群成员"""
     data = request.data
@@ -1276,8 +1281,7 @@ async def handle_group_kick():
     }
 
 
-@server.route("/group/settings/update")
-@need_login
+@server.route("/group/settings/update", require_auth=True)
 async def handle_group_settings_update():
     """更新群组设置"""
     data = request.data
@@ -1383,8 +1387,8 @@ async def handle_group_settings_update():
 
 # ========== 群消息路由 ==========
 
-@server.route("/group/message/send")
-@need_login
+@server.route("/group/message/send", rate_limit=50, user_rate_limit=100, require_auth=True)
+@idempotent
 async def handle_group_message_send():
     """发送群消息"""
     data = request.data
@@ -1517,29 +1521,41 @@ async def handle_group_message_send():
             "is_system": False
         }
     }
-    await server.message_manager.save_group_message(group_message)
+    # 保存时分配群消息序号并写入 group_message，之后再编码推送
+    if await server.message_manager.save_group_message(group_message) != message_id:
+        # 数据库中已有同一 client_msg_id 的消息，不再扇出
+        return {
+            "endpoint": "/group/message/send_response",
+            "data": {
+                "success": True,
+                "message_id": group_message["data"]["message_id"],
+                "group_id": group_id,
+                "client_msg_id": client_msg_id,
+                "timestamp": group_message["data"]["timestamp"],
+                "duplicate": True
+            },
+            "code": 200,
+            "timestamp": timestamp
+        }
+    # 只编码一次，所有接收者的出站队列和离线存储共享同一个帧
+    group_frame = EncodedFrame(group_message)
 
-    # 获取群成员
-    members = await group_manager.get_group_members(group_id)
+    # 获取群成员ID（成员缓存）
+    member_ids = await group_manager.get_member_ids(group_id)
 
-    # 发送消息给所有在线成员（除了发送者自己）
+    # 发送消息给所有在线成员（除了发送者自己），一次查询所有成员所在的节点
+    recipients = [member_id for member_id in member_ids if member_id != user_id]
+    online = await request.server.push_message_to_users(recipients, group_frame)
     delivered_to = []
     offline_members = []
-
-    for member in members:
-        if member.user_id == user_id:
-            continue  # 不发送给自己
-
-        # 检查是否在线
-        if request.server.connection_manager.is_user_online(member.user_id):
-            await request.server.push_message_to_user(member.user_id, group_message)
-            delivered_to.append(member.user_id)
+    for member_id in recipients:
+        if member_id in online:
+            delivered_to.append(member_id)
         else:
-            # 存储为离线消息
-            await request.server.offline_store.add_offline_message(
-                member.user_id, group_message
-            )
-            offline_members.append(member.user_id)
+            offline_members.append(member_id)
+
+    # 离线成员一次性批量存储为离线消息
+    await request.server.offline_store.add_offline_messages(offline_members, group_frame)
 
     # 发送响应给发送者
     response = {
@@ -1552,7 +1568,7 @@ async def handle_group_message_send():
             "timestamp": timestamp,
             "delivered_to": delivered_to,
             "offline_members": offline_members,
-            "total_members": len(members) - 1  # 排除发送者
+            "total_members": len(member_ids) - 1  # 排除发送者
         },
         "code": 200,
         "timestamp": timestamp
@@ -1561,8 +1577,7 @@ async def handle_group_message_send():
     return response
 
 
-@server.route("/group/messages/history")
-@need_login
+@server.route("/group/messages/history", require_auth=True)
 async def handle_group_messages_history():
     """获取群聊历史消息"""
     data = request.data
@@ -1695,13 +1710,10 @@ async def _send_group_notification(group_id: str, notification_type: str,
         "data": notification_data
     }
     # 发送给所有在线成员
-    for member in members:
-        if request.server.connection_manager.is_user_online(member.user_id):
-            await request.server.push_message_to_user(member.user_id, notification_message)
+    await request.server.push_message_to_users((member.user_id for member in members), notification_message)
 
 
-@server.route("/offline/get")
-@need_login
+@server.route("/offline/get", require_auth=True)
 async def handle_offline_get():
     user_id = request.data.get("user_id")
     if not user_id:
@@ -1730,3 +1742,268 @@ async def handle_offline_get():
 
             }
         }
+
+
+@server.route("/presence/subscribe", require_auth=True)
+async def handle_presence_subscribe():
+    """订阅用户状态变更"""
+    user_id = request.user_id
+    if not user_id:
+        return {
+            "endpoint": "/error",
+            "data": {
+                "message": "用户未登录",
+                "code": 401
+            },
+            "timestamp": int(datetime.datetime.now().timestamp())
+        }
+    presence = request.server.presence
+    user_ids = request.data.get("user_ids")
+    if not isinstance(user_ids, list) or not user_ids:
+        message = "user_ids不能为空"
+    elif len(user_ids) > presence.MAX_SUBSCRIBE_BATCH:
+        message = f"一次最多订阅 {presence.MAX_SUBSCRIBE_BATCH} 个用户"
+    elif not all(isinstance(target_id, (int, str)) and not isinstance(target_id, bool)
+                 and str(target_id).isdigit() for target_id in user_ids):
+        message = "user_ids必须是用户ID列表"
+    else:
+        message = None
+    if message:
+        return {
+            "endpoint": "/presence/subscribe_response",
+            "data": {
+                "message": message,
+                "code": 400
+            },
+            "timestamp": int(datetime.datetime.now().timestamp())
+        }
+
+    # 只允许订阅联系人和同群成员，其余的忽略并在响应中列出
+    requested = list(dict.fromkeys(int(target_id) for target_id in user_ids))
+    visible = await request.server.filter_visible_users(user_id, requested)
+    allowed = [target_id for target_id in requested if target_id in visible]
+    presence.subscribe(request.connection_id, allowed)
+
+    # 返回订阅用户的当前状态
+    return {
+        "endpoint": "/presence/subscribe_response",
+        "data": {
+            "presences": [{"user_id": target_id, "status": presence.get_status(target_id).value}
+                          for target_id in allowed],
+            "count": len(allowed),
+            "rejected": [target_id for target_id in requested if target_id not in visible]
+        },
+        "code": 200,
+        "timestamp": int(datetime.datetime.now().timestamp())
+    }
+
+
+@server.route("/presence/update", require_auth=True)
+async def handle_presence_update():
+    """更新在线状态（离线由连接断开决定，不能主动设置）"""
+    user_id = request.user_id
+    if not user_id:
+        return {
+            "endpoint": "/error",
+            "data": {
+                "message": "用户未登录",
+                "code": 401
+            },
+            "timestamp": int(datetime.datetime.now().timestamp())
+        }
+    data = request.data
+    try:
+        status = UserStatus(data.get("status", UserStatus.ONLINE.value))
+        expires_in = int(data.get("expires_in") or 0)
+    except (TypeError, ValueError):
+        status = None
+    if status is None or status == UserStatus.OFFLINE:
+        return {
+            "endpoint": "/presence/update_response",
+            "data": {
+                "message": "无效的状态",
+                "code": 400
+            },
+            "timestamp": int(datetime.datetime.now().timestamp())
+        }
+
+    presence = request.server.presence
+    try:
+        presence.set_status(user_id, status, data.get("custom_status") or "", expires_in)
+    except ValueError as e:
+        return {
+            "endpoint": "/presence/update_response",
+            "data": {
+                "message": str(e),
+                "code": 400
+            },
+            "timestamp": int(datetime.datetime.now().timestamp())
+        }
+
+    return {
+        "endpoint": "/presence/update_response",
+        "data": {
+            "status": status.value,
+            "custom_status": data.get("custom_status") or "",
+            "expires_in": expires_in
+        },
+        "code": 200,
+        "timestamp": int(datetime.datetime.now().timestamp())
+    }
+
+
+@server.route("/group/online_members", require_auth=True)
+async def handle_group_online_members():
+    """获取群组在线成员及其状态（不查询数据库）"""
+    user_id = request.user_id
+    if not user_id:
+        return {
+            "endpoint": "/error",
+            "data": {
+                "message": "用户未登录",
+                "code": 401
+            },
+            "timestamp": int(datetime.datetime.now().timestamp())
+        }
+    group_id = request.data.get("group_id")
+    if not group_id:
+        return {
+            "endpoint": "/error",
+            "data": {
+                "message": "群组ID不能为空",
+                "code": 400
+            },
+            "timestamp": int(datetime.datetime.now().timestamp())
+        }
+    if user_id not in await request.server.group_manager.get_member_ids(group_id):
+        return {
+            "endpoint": "/error",
+            "data": {
+                "message": "您不是该群成员",
+                "code": 403
+            },
+            "timestamp": int(datetime.datetime.now().timestamp())
+        }
+
+    presence = request.server.presence
+    online_members = await request.server.get_online_group_members(group_id)
+    members = []
+    for member_id in online_members:
+        member = presence.get_presence(member_id)
+        # 连接在其他节点上的成员本节点没有状态详情
+        if member["status"] == UserStatus.OFFLINE.value:
+            member["status"] = UserStatus.ONLINE.value
+        members.append(member)
+    return {
+        "endpoint": "/group/online_members_response",
+        "data": {
+            "group_id": group_id,
+            "members": members,
+            "count": len(online_members)
+        },
+        "code": 200,
+        "timestamp": int(datetime.datetime.now().timestamp())
+    }
+
+
+@server.route("/reconnect", rate_limit=10)
+async def handle_reconnect():
+    """断线重连：用Token重新绑定新连接，并续传 last_msg_id 之后的消息"""
+    server = request.server
+    connection = request.connection
+    token = request.data.get("token")
+    payload = await server.jwt_manager.verify_token_async(token) if token else None
+    if not payload:
+        return {
+            "endpoint": "/reconnect_response",
+            "data": {
+                "message": "token无效或已过期，请重新登录",
+                "code": 401
+            },
+            "timestamp": int(datetime.datetime.now().timestamp())
+        }
+
+    user_id = int(payload["user_id"])
+    await server.authenticate_connection(request.connection_id, user_id, payload)
+
+    # 宽限期内重连时联系人列表仍在内存中，无需查询数据库
+    presence = server.presence
+    contact_ids = presence.get_contacts(user_id)
+    if contact_ids is not None:
+        presence.subscribe_contacts(request.connection_id, user_id, contact_ids)
+        await server.notify_user_online(user_id)
+    else:
+        user = await server.user_manager.get_user_by_id(user_id)
+        presence.subscribe_contacts(request.connection_id, user_id, user.contact_list if user else [])
+        await server.notify_user_online(user_id, payload.get("username", ""), user.nickname if user else "")
+
+    # 先发送响应，再在后台任务中续传消息，不阻塞本连接后续的请求（包括心跳）
+    await server.send_to_connection(connection, {
+        "endpoint": "/reconnect_response",
+        "data": {
+            "user_id": user_id,
+            "status": presence.get_status(user_id).value,
+            "last_msg_id": request.data.get("last_msg_id")
+        },
+        "code": 200,
+        "timestamp": int(datetime.datetime.now().timestamp())
+    })
+    server.spawn(server.resume_offline_messages(connection, request.data.get("last_msg_id")))
+
+
+@server.route("/message/sync", require_auth=True)
+async def handle_message_sync():
+    """按序号增量同步：返回序号大于 after_seq 的消息"""
+    user_id = request.user_id
+    if not user_id:
+        return {
+            "endpoint": "/error",
+            "data": {
+                "message": "用户未登录",
+                "code": 401
+            },
+            "timestamp": int(datetime.datetime.now().timestamp())
+        }
+    data = request.data
+    group_id = data.get("group_id")
+    after_seq = data.get("after_seq") or 0
+    limit = data.get("limit") or 100
+    if (not all(isinstance(value, int) and not isinstance(value, bool) for value in (after_seq, limit))
+            or after_seq < 0):
+        return {
+            "endpoint": "/message/sync_response",
+            "data": {
+                "message": "after_seq必须是非负整数，limit必须是整数",
+                "code": 400
+            },
+            "timestamp": int(datetime.datetime.now().timestamp())
+        }
+
+    message_manager = request.server.message_manager
+    limit = max(1, min(limit, message_manager.MAX_SYNC_LIMIT))
+    if group_id:
+        if user_id not in await request.server.group_manager.get_member_ids(group_id):
+            return {
+                "endpoint": "/error",
+                "data": {
+                    "message": "您不是该群成员",
+                    "code": 403
+                },
+                "timestamp": int(datetime.datetime.now().timestamp())
+            }
+        messages = await message_manager.get_group_messages_after_seq(group_id, after_seq, limit)
+    else:
+        messages = await message_manager.get_private_messages_after_seq(user_id, after_seq, limit)
+
+    return {
+        "endpoint": "/message/sync_response",
+        "data": {
+            "group_id": group_id,
+            "messages": messages,
+            "count": len(messages),
+            "max_seq": messages[-1]["seq"] if messages else after_seq,
+            "has_more": len(messages) == limit
+        },
+        "code": 200,
+        "timestamp": int(datetime.datetime.now().timestamp())
+    }
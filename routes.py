@@ -11,7 +11,7 @@ from typing import Dict, Any
 # 导入装饰器和全局对象
 from decorators import route, before_request, after_request, login_required
 from global_proxy import request, current_app, g
-from enums import UserStatus, MessageType
+from enums import UserStatus, MessageType, EnqueueResult
 
 
 # ========== 钩子函数 ==========
@@ -79,9 +79,7 @@ async def handle_login():
     token = current_app.jwt_manager.create_token(user.user_id, user.username)
 
     # 认证连接
-    await current_app.connection_manager.authenticate_connection(
-        request.connection_id, user.user_id
-    )
+    await current_app.authenticate_connection(request.connection_id, user.user_id)
 
     # 返回响应
     return {
@@ -167,9 +165,10 @@ async def handle_send_message():
     }
 
     # 检查接收者是否在线
-    delivered = False
+    pushed = EnqueueResult.DROPPED
     if current_app.connection_manager.is_user_online(receiver_id):
-        delivered = await current_app.push_message_to_user(receiver_id, receive_message)
+        pushed = await current_app.push_message_to_user(receiver_id, receive_message)
+    delivered = bool(pushed)
 
     # 返回响应（包含后续操作）
     return {
@@ -184,7 +183,8 @@ async def handle_send_message():
         "code": 200 if delivered else 202,
         "actions": [
             {
-                "type": "store_offline_message" if not delivered else None,
+                # 出站队列溢出时已经转存过离线消息
+                "type": "store_offline_message" if pushed is EnqueueResult.DROPPED else None,
                 "user_id": receiver_id,
                 "message": receive_message
             }
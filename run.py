@@ -1,6 +1,10 @@
+import argparse
 import asyncio
+import gc
 import logging
+from concurrent.futures import ThreadPoolExecutor
 
+from config import Config
 from router import server
 
 # 配置日志
@@ -11,12 +15,63 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-async def main():
+def parse_args():
+    """解析运行时参数（默认值来自环境变量）"""
+    parser = argparse.ArgumentParser(description="IM WebSocket服务器")
+    parser.add_argument("--uvloop", action=argparse.BooleanOptionalAction, default=Config.USE_UVLOOP,
+                        help="可用时使用 uvloop 事件循环")
+    parser.add_argument("--loop-debug", action=argparse.BooleanOptionalAction, default=Config.LOOP_DEBUG,
+                        help="开启事件循环调试模式")
+    parser.add_argument("--gc-threshold", default=Config.GC_THRESHOLD,
+                        help="GC 阈值，逗号分隔，例如 50000,20,20")
+    parser.add_argument("--gc-freeze", action=argparse.BooleanOptionalAction, default=Config.GC_FREEZE,
+                        help="启动完成后调用 gc.freeze()，把启动期对象移出 GC 扫描")
+    parser.add_argument("--executor-workers", type=int, default=Config.EXECUTOR_WORKERS,
+                        help="默认线程池大小，0 表示使用 asyncio 默认值")
+    parser.add_argument("--metrics-port", type=int, default=Config.METRICS_PORT,
+                        help="Prometheus 指标导出端口（GET /metrics），0 表示不开启")
+    parser.add_argument("--slow-query-ms", type=float, default=Config.SLOW_QUERY_MS,
+                        help="Mongo 慢查询日志阈值（毫秒），0 表示不记录")
+    return parser.parse_args()
+
+
+def install_uvloop() -> bool:
+    """安装 uvloop 事件循环策略，未安装时回退到默认事件循环"""
+    try:
+        import uvloop
+    except ImportError:
+        logger.warning("未安装 uvloop，使用默认事件循环")
+        return False
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    return True
+
+
+def apply_gc_threshold(threshold: str):
+    """设置 GC 阈值"""
+    if not threshold:
+        return
+    values = [int(v) for v in threshold.split(",") if v.strip()]
+    gc.set_threshold(*values)
+
+
+async def main(args):
     """主函数"""
-    # 创建服务器实例
+    if args.executor_workers > 0:
+        asyncio.get_running_loop().set_default_executor(
+            ThreadPoolExecutor(max_workers=args.executor_workers)
+        )
+
+    server.metrics_port = args.metrics_port
+    server.mongo_monitor.slow_threshold = args.slow_query_ms / 1000
+
     # 启动服务器
     try:
         await server.initialize()
+        if args.gc_freeze:
+            # 启动期创建的长生命周期对象不再参与后续分代回收
+            gc.collect()
+            gc.freeze()
+            logger.info(f"gc.freeze() 完成，冻结对象数: {gc.get_freeze_count()}")
         await server.start()
     except KeyboardInterrupt:
         logger.info("接收到中断信号，正在关闭服务器...")
@@ -24,4 +79,12 @@ async def main():
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    args = parse_args()
+    use_uvloop = install_uvloop() if args.uvloop else False
+    apply_gc_threshold(args.gc_threshold)
+    logger.info(
+        f"运行时配置: uvloop={use_uvloop}, loop_debug={args.loop_debug}, "
+        f"gc_threshold={gc.get_threshold()}, gc_freeze={args.gc_freeze}, "
+        f"executor_workers={args.executor_workers or 'default'}, metrics_port={args.metrics_port or 'off'}"
+    )
+    asyncio.run(main(args), debug=args.loop_debug)
@@ -0,0 +1,12 @@
+# conftest.py
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+import memory_mongo  # noqa: E402
+
+# 用内存替身代替 MongoDB，必须在导入服务器模块之前安装
+memory_mongo.install()
@@ -0,0 +1,152 @@
+# test_connection_writer.py
+import asyncio
+import json
+import unittest
+
+from websockets.exceptions import ConnectionClosedOK
+
+from ConnectionWriter import ConnectionWriter
+from enums import EnqueueResult, OverflowPolicy
+
+
+class FakeWebSocket:
+    """记录发送内容的假连接，block 为 True 时 send 一直挂起"""
+
+    def __init__(self, block: bool = False, closed: bool = False):
+        self.sent = []
+        self.block = block
+        self.closed = closed
+
+    async def send(self, text: str):
+        if self.closed:
+            raise ConnectionClosedOK(None, None)
+        if self.block:
+            await asyncio.Event().wait()
+        self.sent.append(json.loads(text))
+
+
+def message(index: int, endpoint: str = "/message/receive"):
+    return {"endpoint": endpoint, "data": {"index": index}}
+
+
+TYPING = {"endpoint": "/message/typing", "data": {}}
+
+
+class ConnectionWriterOverflowTest(unittest.IsolatedAsyncioTestCase):
+    """队列满时的处理（写任务未启动，队列不会被消费）"""
+
+    async def test_spill_offline_reports_spilled(self):
+        spilled = []
+        writer = ConnectionWriter(FakeWebSocket(), max_size=2, on_spill=spilled.append)
+        results = [writer.enqueue(message(i)) for i in range(3)]
+
+        self.assertEqual(results, [EnqueueResult.QUEUED, EnqueueResult.QUEUED, EnqueueResult.SPILLED])
+        # 转存离线不算送达
+        self.assertFalse(results[2])
+        self.assertEqual(spilled, [message(2)])
+        self.assertEqual(writer.spilled, 1)
+
+    async def test_drop_low_priority_policy(self):
+        writer = ConnectionWriter(FakeWebSocket(), max_size=1, policy=OverflowPolicy.DROP_LOW_PRIORITY)
+        writer.enqueue(message(0))
+
+        self.assertIs(writer.enqueue(message(1)), EnqueueResult.DROPPED)
+        self.assertEqual(writer.dropped, 1)
+        self.assertEqual(list(writer.queue), [message(0)])
+
+    async def test_disconnect_policy(self):
+        disconnected = []
+        writer = ConnectionWriter(FakeWebSocket(), max_size=1, policy=OverflowPolicy.DISCONNECT,
+                                  on_disconnect=lambda: disconnected.append(True))
+        writer.enqueue(message(0))
+
+        self.assertIs(writer.enqueue(message(1)), EnqueueResult.DROPPED)
+        self.assertTrue(writer.closed)
+        self.assertEqual(disconnected, [True])
+        self.assertIs(writer.enqueue(message(2)), EnqueueResult.DROPPED)
+
+    async def test_low_priority_evicted_first(self):
+        spilled = []
+        writer = ConnectionWriter(FakeWebSocket(), max_size=2, on_spill=spilled.append)
+        writer.enqueue(TYPING)
+        writer.enqueue(message(0))
+
+        # 新的重要消息挤掉排队中的输入状态
+        self.assertIs(writer.enqueue(message(1)), EnqueueResult.QUEUED)
+        # 新的低优先级消息直接丢弃
+        self.assertIs(writer.enqueue(TYPING), EnqueueResult.DROPPED)
+        self.assertEqual(list(writer.queue), [message(0), message(1)])
+        self.assertEqual(writer.dropped, 2)
+        self.assertEqual(spilled, [])
+
+
+class ConnectionWriterSendTest(unittest.IsolatedAsyncioTestCase):
+    """写任务发送、合并与关闭"""
+
+    async def test_sends_in_order(self):
+        websocket = FakeWebSocket()
+        writer = ConnectionWriter(websocket)
+        writer.start()
+        for i in range(5):
+            writer.enqueue(message(i))
+        await writer.join()
+
+        self.assertEqual(websocket.sent, [message(i) for i in range(5)])
+        self.assertEqual(writer.frames_sent, 5)
+        await writer.close()
+
+    async def test_batching_merges_queued_messages(self):
+        websocket = FakeWebSocket()
+        writer = ConnectionWriter(websocket, batching=True, coalesce_delay=0.01)
+        writer.start()
+        for i in range(3):
+            writer.enqueue(message(i))
+        await writer.join()
+
+        self.assertEqual(len(websocket.sent), 1)
+        self.assertEqual(websocket.sent[0]["endpoint"], "/batch")
+        self.assertEqual(websocket.sent[0]["data"]["messages"], [message(i) for i in range(3)])
+        await writer.close()
+
+    async def test_close_drains_queue(self):
+        websocket = FakeWebSocket()
+        spilled = []
+        writer = ConnectionWriter(websocket, on_spill=spilled.append)
+        writer.start()
+        for i in range(3):
+            writer.enqueue(message(i))
+        await writer.close()
+
+        self.assertEqual(websocket.sent, [message(i) for i in range(3)])
+        self.assertEqual(spilled, [])
+        self.assertIs(writer.enqueue(message(3)), EnqueueResult.DROPPED)
+
+    async def test_close_timeout_spills_in_flight_and_queued(self):
+        spilled = []
+        writer = ConnectionWriter(FakeWebSocket(block=True), on_spill=spilled.append, drain_timeout=0.05)
+        writer.start()
+        writer.enqueue(message(0))
+        await asyncio.sleep(0)  # 写任务取出第一条，挂起在 send 中
+        writer.enqueue(message(1))
+        writer.enqueue(TYPING)
+        await writer.close()
+
+        # 被中断发送的消息不丢失，低优先级消息不转存
+        self.assertEqual(spilled, [message(0), message(1)])
+        self.assertEqual(len(writer.queue), 0)
+
+    async def test_connection_closed_keeps_unsent_messages(self):
+        spilled = []
+        writer = ConnectionWriter(FakeWebSocket(closed=True), on_spill=spilled.append)
+        writer.start()
+        writer.enqueue(message(0))
+        writer.enqueue(message(1))
+        await writer.join()
+
+        self.assertTrue(writer.closed)
+        await writer.close()
+        self.assertEqual(spilled, [message(0), message(1)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+# test_dedupe_cache.py
+import asyncio
+import unittest
+
+from clock import coarse_clock
+from DedupeCache import DedupeCache
+
+RESPONSE = {"endpoint": "/message/send_response", "data": {"server_msg_id": "m1"}, "code": 200}
+
+
+class DedupeCacheTest(unittest.IsolatedAsyncioTestCase):
+    """发送去重缓存：重放、并发重试、时间窗口与容量淘汰"""
+
+    def setUp(self):
+        self._saved_now = coarse_clock.now
+        coarse_clock.now = 1000.0
+
+    def tearDown(self):
+        coarse_clock.now = self._saved_now
+
+    async def test_retry_replays_response(self):
+        cache = DedupeCache(window=60)
+        self.assertIsNone(await cache.acquire("k"))
+        cache.complete("k", RESPONSE)
+
+        self.assertEqual(await cache.acquire("k"), RESPONSE)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    async def test_concurrent_retry_waits_for_first_request(self):
+        cache = DedupeCache(window=60)
+        self.assertIsNone(await cache.acquire("k"))
+
+        retry = asyncio.create_task(cache.acquire("k"))
+        await asyncio.sleep(0)
+        self.assertFalse(retry.done())
+
+        cache.complete("k", RESPONSE)
+        self.assertEqual(await retry, RESPONSE)
+
+    async def test_release_lets_waiting_retry_reprocess(self):
+        cache = DedupeCache(window=60)
+        self.assertIsNone(await cache.acquire("k"))
+
+        retry = asyncio.create_task(cache.acquire("k"))
+        await asyncio.sleep(0)
+        cache.release("k")
+
+        # 首次请求失败，重试成为新的处理者
+        self.assertIsNone(await retry)
+        self.assertIn("k", cache.entries)
+
+    async def test_entry_expires_after_window(self):
+        cache = DedupeCache(window=60)
+        await cache.acquire("k")
+        cache.complete("k", RESPONSE)
+
+        coarse_clock.now += 61
+        self.assertIsNone(await cache.acquire("k"))
+
+    async def test_expired_entries_evicted_on_insert(self):
+        cache = DedupeCache(window=60)
+        for key in ("a", "b"):
+            await cache.acquire(key)
+            cache.complete(key, RESPONSE)
+
+        coarse_clock.now += 61
+        await cache.acquire("c")
+        self.assertEqual(list(cache.entries), ["c"])
+
+    async def test_max_size_evicts_oldest(self):
+        cache = DedupeCache(max_size=2, window=60)
+        for key in ("a", "b", "c"):
+            await cache.acquire(key)
+            cache.complete(key, RESPONSE)
+
+        self.assertEqual(list(cache.entries), ["b", "c"])
+
+    async def test_max_size_keeps_in_flight_entries(self):
+        cache = DedupeCache(max_size=2, window=60)
+        await cache.acquire("pending")
+        for key in ("a", "b"):
+            await cache.acquire(key)
+            cache.complete(key, RESPONSE)
+
+        retry = asyncio.create_task(cache.acquire("pending"))
+        await asyncio.sleep(0)
+        await cache.acquire("c")
+
+        # 处理中的记录不被容量淘汰，等待的重试得到首次请求的响应
+        self.assertFalse(retry.done())
+        self.assertNotIn("a", cache.entries)
+        self.assertIn("pending", cache.entries)
+        cache.complete("pending", RESPONSE)
+        self.assertEqual(await retry, RESPONSE)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,39 @@
+# test_jwt_session_manager.py
+import unittest
+
+from JWTSessionManager import JWTSessionManager
+
+
+class JWTSessionManagerTest(unittest.TestCase):
+    """已验证Token缓存：命中、吊销与调用方修改"""
+
+    def setUp(self):
+        self.manager = JWTSessionManager(secret_key="test-secret-key-for-unit-tests-only")
+
+    def test_cached_payload_not_shared_with_callers(self):
+        token = self.manager.create_token(1, "u1")
+        payload = self.manager.verify_token(token)
+        payload["user_id"] = 2
+
+        self.assertEqual(self.manager.verify_token(token)["user_id"], 1)
+        # 嵌套的 scopes 以元组缓存，不能原地修改
+        self.assertEqual(self.manager.verify_token(token)["scopes"], ("user",))
+
+    def test_decoded_payload_not_shared_with_callers(self):
+        token = self.manager.create_token(1, "u1")
+        self.manager._verified_cache.clear()
+        self.manager.verify_token(token)["user_id"] = 2
+
+        self.assertEqual(self.manager.verify_token(token)["user_id"], 1)
+
+    def test_revoked_token_evicted_from_cache(self):
+        token = self.manager.create_token(1, "u1")
+        self.assertIsNotNone(self.manager.verify_token(token))
+
+        self.assertTrue(self.manager.revoke_token(token))
+        self.assertIsNone(self.manager.verify_token(token))
+        self.assertEqual(len(self.manager._verified_cache), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
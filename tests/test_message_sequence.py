@@ -0,0 +1,96 @@
+# test_message_sequence.py
+import unittest
+
+from pymongo.errors import NetworkTimeout
+
+from memory_mongo import MemoryMongoClient
+from MessageManager import MessageManager
+
+
+def private_message(client_msg_id=None, **fields):
+    return {"sender_id": 1, "receiver_id": 2, "content": {"text": "hi"}, "client_msg_id": client_msg_id, **fields}
+
+
+class MessageSequenceTest(unittest.IsolatedAsyncioTestCase):
+    """消息序号：重复发送不消耗序号，写入失败可以留下空洞但不会重复"""
+
+    async def asyncSetUp(self):
+        MemoryMongoClient.reset()
+        self.manager = MessageManager()
+        await self.manager.initialize()
+
+    async def counter(self, key: str) -> int:
+        return (await self.manager.db_sequences.find_one({"_id": key}))["seq"]
+
+    async def test_sequences_are_contiguous(self):
+        for _ in range(3):
+            await self.manager.save_private_message(private_message())
+        messages = await self.manager.get_private_messages_after_seq(2)
+
+        self.assertEqual([message["seq"] for message in messages], [1, 2, 3])
+
+    async def test_duplicate_send_reuses_first_message(self):
+        first = private_message("c1", message_id="m1")
+        retry = private_message("c1", message_id="m2")
+        await self.manager.save_private_message(first)
+
+        self.assertEqual(await self.manager.save_private_message(retry), "m1")
+        self.assertEqual(retry["seq"], first["seq"])
+        self.assertEqual(await self.counter("user:2"), 1)
+
+    async def test_concurrent_duplicate_returns_allocated_sequence(self):
+        await self.manager.save_private_message(private_message("c1", message_id="m1"))
+
+        # 模拟并发重复发送：查重时尚未看到首次写入，写入时撞上唯一索引
+        find_duplicate = self.manager.find_duplicate
+        calls = []
+
+        async def racing_find_duplicate(record):
+            calls.append(record)
+            return None if len(calls) == 1 else await find_duplicate(record)
+
+        self.manager.find_duplicate = racing_find_duplicate
+        retry = private_message("c1", message_id="m2")
+
+        self.assertEqual(await self.manager.save_private_message(retry), "m1")
+        self.assertEqual(await self.counter("user:2"), 1)
+        await self.manager.save_private_message(private_message("c2"))
+        self.assertEqual(await self.counter("user:2"), 2)
+
+    async def test_ambiguous_failure_keeps_sequence(self):
+        insert_one = self.manager.db_messages.insert_one
+
+        async def applied_then_timeout(record):
+            # 服务器已写入，但客户端没有收到确认
+            await insert_one(record)
+            raise NetworkTimeout("timed out")
+
+        self.manager.db_messages.insert_one = applied_then_timeout
+        with self.assertRaises(NetworkTimeout):
+            await self.manager.save_private_message(private_message())
+        self.manager.db_messages.insert_one = insert_one
+
+        message = private_message()
+        await self.manager.save_private_message(message)
+        self.assertEqual(message["seq"], 2)
+        messages = await self.manager.get_private_messages_after_seq(2)
+        self.assertEqual([message["seq"] for message in messages], [1, 2])
+
+    async def test_failed_write_leaves_gap(self):
+        async def failing_insert(record):
+            raise NetworkTimeout("timed out")
+
+        insert_one = self.manager.db_messages.insert_one
+        self.manager.db_messages.insert_one = failing_insert
+        with self.assertRaises(NetworkTimeout):
+            await self.manager.save_private_message(private_message())
+        self.manager.db_messages.insert_one = insert_one
+
+        await self.manager.save_private_message(private_message())
+        messages = await self.manager.get_private_messages_after_seq(2)
+        # 序号 1 未被使用，同步时直接跳过
+        self.assertEqual([message["seq"] for message in messages], [2])
+
+
+if __name__ == "__main__":
+    unittest.main()
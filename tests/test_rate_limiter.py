@@ -0,0 +1,60 @@
+# test_rate_limiter.py
+import unittest
+
+from RateLimiter import RateLimiter
+
+
+class RateLimiterTest(unittest.TestCase):
+    """令牌桶限流：突发、补充与桶淘汰"""
+
+    def test_burst_up_to_rate(self):
+        limiter = RateLimiter(period=60)
+        results = [limiter.allow("k", 3, now=0) for _ in range(4)]
+
+        self.assertEqual(results, [True, True, True, False])
+        self.assertEqual((limiter.allowed, limiter.rejected), (3, 1))
+
+    def test_refill_over_period(self):
+        limiter = RateLimiter(period=60)
+        for _ in range(3):
+            limiter.allow("k", 3, now=0)
+
+        self.assertFalse(limiter.allow("k", 3, now=10))
+        # 每 20 秒补充一个令牌
+        self.assertTrue(limiter.allow("k", 3, now=20))
+        self.assertFalse(limiter.allow("k", 3, now=21))
+
+    def test_refill_capped_at_rate(self):
+        limiter = RateLimiter(period=60)
+        limiter.allow("k", 2, now=0)
+        results = [limiter.allow("k", 2, now=1000) for _ in range(3)]
+
+        self.assertEqual(results, [True, True, False])
+
+    def test_keys_are_independent(self):
+        limiter = RateLimiter(period=60)
+        self.assertTrue(limiter.allow("a", 1, now=0))
+        self.assertFalse(limiter.allow("a", 1, now=0))
+        self.assertTrue(limiter.allow("b", 1, now=0))
+
+    def test_idle_buckets_evicted(self):
+        limiter = RateLimiter(period=60)
+        limiter.allow("a", 1, now=0)
+        limiter.allow("b", 1, now=30)
+        limiter.allow("c", 1, now=61)
+
+        self.assertEqual(list(limiter.buckets), ["b", "c"])
+
+    def test_lru_eviction_over_max_buckets(self):
+        limiter = RateLimiter(period=60, max_buckets=2)
+        limiter.allow("a", 5, now=0)
+        limiter.allow("b", 5, now=1)
+        # 访问 a 使其成为最近使用
+        limiter.allow("a", 5, now=2)
+        limiter.allow("c", 5, now=3)
+
+        self.assertEqual(list(limiter.buckets), ["a", "c"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,139 @@
+# test_routing_registry.py
+import json
+import unittest
+
+from RoutingRegistry import InMemoryRoutingRegistry, RedisRoutingRegistry
+
+
+class FakeRedis:
+    """实现 RedisRoutingRegistry 所需命令的内存替身，expire 手动模拟存活标记过期"""
+
+    def __init__(self):
+        self.data = {}
+        self.published = []
+
+    async def sadd(self, key, *values):
+        self.data.setdefault(key, set()).update(str(value) for value in values)
+
+    async def srem(self, key, *values):
+        members = self.data.get(key, set())
+        members.difference_update(str(value) for value in values)
+        if not members:
+            self.data.pop(key, None)
+
+    async def smembers(self, key):
+        return set(self.data.get(key, ()))
+
+    async def set(self, key, value, ex=None):
+        self.data[key] = value
+
+    async def mget(self, keys):
+        return [self.data.get(key) for key in keys]
+
+    async def delete(self, key):
+        self.data.pop(key, None)
+
+    async def publish(self, channel, payload):
+        self.published.append((channel, json.loads(payload)))
+        return 1
+
+    def expire(self, key):
+        self.data.pop(key, None)
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    def __init__(self, client):
+        self.client = client
+        self.commands = []
+
+    def __getattr__(self, name):
+        method = getattr(self.client, name)
+        return lambda *args, **kwargs: self.commands.append((method, args, kwargs))
+
+    async def execute(self):
+        return [await method(*args, **kwargs) for method, args, kwargs in self.commands]
+
+
+class RedisRoutingRegistryTest(unittest.IsolatedAsyncioTestCase):
+    """Redis 路由注册表：失效节点清理、错过续期后恢复路由、批量查询与合并转发"""
+
+    async def asyncSetUp(self):
+        self.redis = FakeRedis()
+        self.local_users = {1, 2}
+        self.a = RedisRoutingRegistry(self.redis)
+        self.b = RedisRoutingRegistry(self.redis)
+        # 只调用 refresh，不启动续期任务
+        self.a.node_id, self.a._local_users = "A", lambda: self.local_users
+        self.b.node_id = "B"
+        await self.a.refresh()
+        await self.b.refresh()
+        for user_id in self.local_users:
+            await self.a.register(user_id, "A")
+        await self.b.register(3, "B")
+
+    async def test_get_nodes_batch(self):
+        located = await self.b.get_nodes_batch([1, 2, 3, 4])
+
+        self.assertEqual(located, {1: {"A"}, 2: {"A"}, 3: {"B"}})
+        self.assertEqual(await self.b.get_online_users([1, 4]), {1})
+
+    async def test_dead_node_purged(self):
+        self.redis.expire(self.a._alive_key("A"))
+        await self.b.refresh()
+
+        self.assertEqual(self.b.dead_nodes, {"A"})
+        self.assertEqual(await self.b.get_nodes_batch([1, 2, 3]), {3: {"B"}})
+        self.assertNotIn(self.a._node_users_key("A"), self.redis.data)
+
+    async def test_missed_refresh_restores_routes(self):
+        # A 仍在运行但错过续期，B 把它当作失效节点清理
+        self.redis.expire(self.a._alive_key("A"))
+        await self.b.refresh()
+        await self.a.refresh()
+        await self.b.refresh()
+
+        self.assertEqual(self.b.dead_nodes, set())
+        self.assertEqual(await self.b.get_nodes_batch([1, 2]), {1: {"A"}, 2: {"A"}})
+        self.assertEqual(await self.redis.smembers(self.a._node_users_key("A")), {"1", "2"})
+
+    async def test_purged_after_renewal_restored_on_next_refresh(self):
+        # B 在 A 续期前读到 A 已过期，在 A 续期后才清理
+        self.redis.expire(self.a._alive_key("A"))
+        await self.a.refresh()
+        await self.b._purge_node("A")
+        await self.a.refresh()
+
+        self.assertEqual(await self.b.get_nodes_batch([1, 2]), {1: {"A"}, 2: {"A"}})
+
+    async def test_forward_many_publishes_once(self):
+        await self.b.forward_many("A", [1, 2], {"endpoint": "/message/receive", "data": {}})
+
+        self.assertEqual(self.redis.published, [
+            ("im:node:A", {"user_ids": [1, 2], "message": {"endpoint": "/message/receive", "data": {}}})
+        ])
+
+
+class InMemoryRoutingRegistryTest(unittest.IsolatedAsyncioTestCase):
+    """进程内路由注册表：批量查询与合并转发"""
+
+    async def test_forward_many(self):
+        registry = InMemoryRoutingRegistry()
+        received = []
+
+        async def callback(user_id, message):
+            received.append((user_id, message))
+
+        await registry.subscribe("A", callback)
+        await registry.register(1, "A")
+        await registry.register(1, "B")
+
+        self.assertEqual(await registry.get_nodes_batch([1, 2]), {1: {"A", "B"}})
+        self.assertTrue(await registry.forward_many("A", [1, 2], {"endpoint": "/x"}))
+        self.assertEqual(received, [(1, {"endpoint": "/x"}), (2, {"endpoint": "/x"})])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+# test_timer_wheel.py
+import math
+import unittest
+
+from TimerWheel import TimerWheel
+
+
+class TimerWheelTest(unittest.TestCase):
+    """哈希时间轮：到期、取消、重设与跨圈"""
+
+    def make_wheel(self, slots: int = 8) -> TimerWheel:
+        return TimerWheel(tick=1.0, slots=slots, clock=lambda: 0.0)
+
+    def test_expires_in_deadline_order(self):
+        wheel = self.make_wheel()
+        wheel.schedule("a", 2)
+        wheel.schedule("b", 4)
+
+        self.assertEqual(wheel.advance(1), [])
+        self.assertEqual(wheel.advance(2), ["a"])
+        self.assertEqual(wheel.advance(3), [])
+        self.assertEqual(wheel.advance(5), ["b"])
+        self.assertEqual(len(wheel), 0)
+
+    def test_advance_backwards_is_noop(self):
+        wheel = self.make_wheel()
+        wheel.schedule("a", 2)
+        wheel.advance(1)
+        self.assertEqual(wheel.advance(0.5), [])
+        self.assertIn("a", wheel)
+
+    def test_cancel(self):
+        wheel = self.make_wheel()
+        wheel.schedule("a", 2)
+        wheel.cancel("a")
+        wheel.cancel("missing")
+
+        self.assertNotIn("a", wheel)
+        self.assertEqual(wheel.advance(10), [])
+
+    def test_reschedule_moves_deadline(self):
+        wheel = self.make_wheel()
+        wheel.schedule("a", 2)
+        wheel.schedule("a", 6)
+
+        self.assertEqual(wheel.advance(3), [])
+        self.assertEqual(wheel.deadline("a"), 6)
+        self.assertEqual(wheel.advance(6), ["a"])
+        self.assertEqual(wheel.deadline("a"), math.inf)
+
+    def test_past_deadline_fires_on_next_tick(self):
+        wheel = self.make_wheel()
+        wheel.advance(5)
+        wheel.schedule("late", 1)
+
+        self.assertEqual(wheel.deadline("late"), 6)
+        self.assertEqual(wheel.advance(6), ["late"])
+
+    def test_rollover_keeps_timers_beyond_one_lap(self):
+        wheel = self.make_wheel(slots=8)
+        # 与 "near" 落在同一个槽，但晚一圈
+        wheel.schedule("near", 3)
+        wheel.schedule("far", 11)
+
+        self.assertEqual(wheel.advance(3), ["near"])
+        self.assertEqual(wheel.advance(10), [])
+        self.assertIn("far", wheel)
+        self.assertEqual(wheel.advance(11), ["far"])
+
+    def test_jump_over_several_laps_expires_everything_due(self):
+        wheel = self.make_wheel(slots=8)
+        for key in range(20):
+            wheel.schedule(key, key + 1)
+        wheel.schedule("later", 100)
+
+        self.assertEqual(sorted(wheel.advance(50)), list(range(20)))
+        self.assertEqual(len(wheel), 1)
+        self.assertEqual(wheel.advance(100), ["later"])
+
+
+if __name__ == "__main__":
+    unittest.main()
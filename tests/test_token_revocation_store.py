@@ -0,0 +1,74 @@
+# test_token_revocation_store.py
+import datetime
+import time
+import unittest
+
+from memory_mongo import MemoryMongoClient
+from TokenRevocationStore import TokenRevocationStore
+
+
+class TokenRevocationStoreTest(unittest.IsolatedAsyncioTestCase):
+    """Token吊销存储：内存淘汰与多进程增量同步"""
+
+    def setUp(self):
+        MemoryMongoClient.reset()
+
+    async def test_revoked_until_exp(self):
+        store = TokenRevocationStore(persist=False)
+        now = time.time()
+        store.add("a", int(now) + 10)
+        store.add("expired", int(now) - 1)
+
+        self.assertIn("a", store)
+        self.assertNotIn("expired", store)
+        self.assertEqual(len(store), 1)
+
+        self.assertEqual(store.purge_expired(now + 11), 1)
+        self.assertNotIn("a", store)
+        self.assertEqual(len(store), 0)
+
+    async def test_sync_loads_other_process_revocations(self):
+        writer = TokenRevocationStore(persist=True)
+        reader = TokenRevocationStore(persist=True)
+        await writer.initialize()
+        await reader.initialize()
+
+        exp = int(time.time()) + 60
+        await writer._persist("jti-1", exp)
+        await reader.sync()
+
+        self.assertIn("jti-1", reader)
+
+    async def test_sync_overlap_catches_late_committed_write(self):
+        reader = TokenRevocationStore(persist=True, sync_overlap=30)
+        await reader.initialize()
+        exp = int(time.time()) + 60
+
+        # 另一进程在上次同步之前打上 created_at，但在同步之后才提交
+        late = reader._last_sync - datetime.timedelta(seconds=5)
+        too_old = reader._last_sync - datetime.timedelta(seconds=120)
+        await reader.db.insert_one({"jti": "late", "exp": exp, "created_at": late})
+        await reader.db.insert_one({"jti": "too-old", "exp": exp, "created_at": too_old})
+        await reader.sync()
+
+        self.assertIn("late", reader)
+        # 超出回看窗口的记录由重启时的全量加载覆盖
+        self.assertNotIn("too-old", reader)
+
+    async def test_sync_overlap_does_not_duplicate_entries(self):
+        reader = TokenRevocationStore(persist=True)
+        await reader.initialize()
+        await reader.db.insert_one({"jti": "x", "exp": int(time.time()) + 60,
+                                    "created_at": datetime.datetime.now(datetime.timezone.utc)})
+
+        await reader.sync()
+        heap_size = len(reader._heap)
+        await reader.sync()
+        await reader.sync()
+
+        self.assertEqual(len(reader._heap), heap_size)
+        self.assertEqual(len(reader), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()